@@ -0,0 +1,323 @@
+import asyncio
+import collections
+import json
+import os
+import time
+import zlib
+
+from Compression import Compression
+from DataChannel import CHUNK_SIZE, FRAME_HEADER, FILE_FRAME_SIZE, TRANSFER_ACK, UNCLAIMED_TIMEOUT, ChecksumWriter, frame, frameLength, partChunks, validHandle
+
+class ChordProtocol(asyncio.DatagramProtocol):
+    '''Hands control datagrams to the ChordServer on the event loop'''
+    def __init__(self, server):
+        self.server = server
+
+    def datagram_received(self, data, addr):
+        self.server.ctrlMsgReceived(data, addr)
+
+    def error_received(self, exc):
+        print(exc)
+
+class AsyncTransport():
+    '''
+    Transport of a chord node in its own process, driven by an asyncio event loop (Python 3 only)
+    Message handlers and the periodic stabilize, fix-fingers and liveness coroutines all run on
+    the loop, so node state is never touched from two threads; file I/O runs in the loop's executor
+    ip: ip of the node
+    control_port, data_port: ports every node listens on
+    transfer_timeout: seconds to wait on a peer during a file transfer
+    '''
+    def __init__(self, ip, control_port, data_port, transfer_timeout):
+        self.ip = ip
+        self.control_port = control_port
+        self.data_port = data_port
+        self.transfer_timeout = transfer_timeout
+        self.server = None
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def attach(self, server):
+        '''Open the node's endpoints, called by the ChordServer using this transport
+        '''
+        self.server = server
+
+        # Endpoint specifically for communicating with other chord nodes
+        self.control_transport, protocol = self.loop.run_until_complete(
+            self.loop.create_datagram_endpoint(lambda: ChordProtocol(server), local_addr=(self.ip, self.control_port)))
+
+        # Endpoint for streaming file content to and from other chord nodes and clients
+        self.data_channel = AsyncDataChannel(self.loop, self.ip, self.data_port, server.staging_dir_path, server.myLogger, self.transfer_timeout, server.compression)
+        self.loop.run_until_complete(self.data_channel.start())
+
+    def sendCtrl(self, dst_ip, data):
+        self.control_transport.sendto(data, (dst_ip, self.control_port))
+
+    def newHandle(self):
+        return self.data_channel.new_handle()
+
+    def sendData(self, dst_ip, handle, path, callback=None, content=None, files=None):
+        self.data_channel.send(dst_ip, handle, path, callback, content, files)
+
+    def claim(self, handle):
+        return self.data_channel.claim(handle)
+
+    def offload(self, fn, callback):
+        '''Run fn in the loop's executor, and call callback with its result back on the loop'''
+        future = self.loop.run_in_executor(None, fn)
+        future.add_done_callback(lambda done: callback(done.result()))
+
+    def schedule(self, delay, fn):
+        self.loop.call_later(delay, fn)
+
+    def now(self):
+        return time.time()
+
+    def run(self):
+        '''Run the node's periodic coroutines and serve forever
+        '''
+        self.loop.create_task(self.periodic(self.server.checkSuccessor))
+        self.loop.create_task(self.periodic(self.server.refreshFingers))
+        self.loop.create_task(self.periodic(self.server.checkPredecessor))
+        self.loop.create_task(self.periodic(self.server.churn))
+        self.loop.create_task(self.periodic(self.server.expireRequests))
+        self.loop.run_forever()
+
+    async def periodic(self, fn):
+        '''Call fn every refresh_rate seconds'''
+        while True:
+            fn()
+            await asyncio.sleep(self.server.refresh_rate)
+
+class AsyncDataChannel():
+    '''
+    asyncio version of DataChannel, speaking the same length-prefixed stream protocol
+    Transfers complete before their ack is sent, and senders only send the control message
+    after the ack, so claim() never has to wait
+    '''
+    def __init__(self, loop, ip, port, staging_dir, logger, timeout, compression=None, unclaimed_timeout=UNCLAIMED_TIMEOUT):
+        self.loop = loop
+        self.ip = ip
+        self.port = port
+        self.staging_dir = staging_dir
+        self.myLogger = logger
+        self.timeout = timeout
+        self.compression = Compression() if compression is None else compression
+        self.unclaimed_timeout = unclaimed_timeout
+
+        if not os.path.exists(self.staging_dir):
+            os.makedirs(self.staging_dir)
+
+        # Completed incoming transfers in the order they completed (handle->(staged path, crc32 of
+        #   the content, completion time))
+        self.completed = collections.OrderedDict()
+        self.handle_count = 0
+        # Outgoing transfers waiting for each destination (dst_ip->deque), streamed in order by a task per destination
+        self.pending = dict()
+
+    async def start(self):
+        self.listener = await asyncio.start_server(self.receive, self.ip, self.port, reuse_address=True)
+
+    def new_handle(self):
+        self.handle_count += 1
+        return "{0}_{1}_{2}".format(self.ip, int(time.time() * 1000), self.handle_count)
+
+    def send(self, dst_ip, handle, path, callback=None, content=None, files=None):
+        pending = self.pending.get(dst_ip)
+        if pending is None:
+            pending = self.pending[dst_ip] = collections.deque()
+            self.loop.create_task(self.sendWorker(dst_ip))
+        pending.append((handle, path, callback, content, files))
+
+    def claim(self, handle):
+        if handle is None:
+            return None, None
+        path, checksum, completed = self.completed.pop(handle, (None, None, None))
+        return path, checksum
+
+    def complete(self, handle, path, checksum):
+        '''Keep a completed transfer until it is claimed, deleting the ones nobody claimed in time'''
+        now = time.time()
+        self.completed[handle] = (path, checksum, now)
+        while len(self.completed) > 0:
+            stale, (staged, _, completed) = next(iter(self.completed.items()))
+            if now - completed < self.unclaimed_timeout:
+                break
+            del self.completed[stale]
+            self.myLogger.mnPrint("Error: transfer {0} was never claimed".format(stale))
+            if os.path.exists(staged):
+                os.remove(staged)
+
+    async def readFrame(self, reader):
+        header = await asyncio.wait_for(reader.readexactly(FRAME_HEADER.size), self.timeout)
+        length = frameLength(header)
+        return await asyncio.wait_for(reader.readexactly(length), self.timeout)
+
+    async def receive(self, reader, writer):
+        '''Read a length-prefixed stream of chunks into the staging directory
+        '''
+        handle = None
+        path = None
+        staged = None
+        try:
+            header = json.loads((await self.readFrame(reader)).decode("utf-8"))
+            if not validHandle(header["handle"]):
+                raise ValueError("invalid transfer handle {0!r}".format(header["handle"]))
+            handle = header["handle"]
+            decompressor = self.compression.decompressor(header.get("codec"))
+            path = os.path.join(self.staging_dir, handle + ".part")
+            staged = ChecksumWriter(await self.loop.run_in_executor(None, open, path, "wb"))
+            while True:
+                chunk = await self.readFrame(reader)
+                if len(chunk) == 0:
+                    break
+                if decompressor is not None:
+                    chunk = await self.loop.run_in_executor(None, self.compression.decompress, decompressor, chunk)
+                await self.loop.run_in_executor(None, staged.write, chunk)
+            if decompressor is not None:
+                await self.loop.run_in_executor(None, lambda: staged.write(self.compression.decompress(decompressor)))
+            await self.loop.run_in_executor(None, staged.f.close)
+            self.complete(handle, path, staged.checksum())
+            staged = None
+            writer.write(bytes(self.compression.ackFor(header)))
+            await writer.drain()
+        except (OSError, ValueError, KeyError, zlib.error, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+            self.myLogger.mnPrint("Error: transfer {0} failed: {1}".format(handle, e))
+            if staged is not None:
+                staged.f.close()
+            if path is not None and os.path.exists(path):
+                os.remove(path)
+            self.completed.pop(handle, None)
+        finally:
+            writer.close()
+
+    async def sendWorker(self, dst_ip):
+        '''Stream the transfers queued for dst_ip, until there are none left'''
+        pending = self.pending[dst_ip]
+        try:
+            while len(pending) > 0:
+                handle, path, callback, content, files = pending.popleft()
+                try:
+                    await self.stream(dst_ip, handle, path, content, files)
+                    sent = True
+                except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+                    self.myLogger.mnPrint("Error: transfer {0} to {1} failed: {2}".format(handle, dst_ip, e))
+                    sent = False
+                if callback is not None:
+                    # A failing callback must not stop the transfers queued behind it
+                    try:
+                        callback(sent)
+                    except Exception as e:
+                        self.myLogger.mnPrint("Error: callback of transfer {0} to {1} failed: {2}".format(handle, dst_ip, e))
+        finally:
+            # Whatever stops us, the next send to dst_ip starts a new task
+            del self.pending[dst_ip]
+
+    async def stream(self, dst_ip, handle, path, content=None, files=None):
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(dst_ip, self.port), self.timeout)
+        try:
+            header = self.compression.header(handle)
+            if files is not None:
+                await self.streamParts(writer, dst_ip, header, content, files)
+            elif content is not None:
+                await self.streamContent(writer, dst_ip, header, content)
+            else:
+                await self.streamFile(writer, dst_ip, header, path)
+            writer.write(frame(b""))
+            await asyncio.wait_for(writer.drain(), self.timeout)
+            ack = await asyncio.wait_for(reader.readexactly(len(TRANSFER_ACK)), self.timeout)
+            if not self.compression.acked(dst_ip, ack):
+                raise OSError("transfer {0} was not acknowledged".format(handle))
+        finally:
+            writer.close()
+
+    async def streamContent(self, writer, dst_ip, header, content):
+        codec = None
+        if self.compression.wants(dst_ip, len(content)):
+            codec = self.compression.codecFor(dst_ip, content[:CHUNK_SIZE])
+            header["codec"] = codec
+        writer.write(frame(json.dumps(header).encode("utf-8")))
+        if codec is not None:
+            chunks = (content[offset:offset + CHUNK_SIZE] for offset in range(0, len(content), CHUNK_SIZE))
+            await self.streamCompressed(writer, codec, chunks)
+            return
+        view = memoryview(content)
+        for offset in range(0, len(content), FILE_FRAME_SIZE):
+            chunk = view[offset:offset + FILE_FRAME_SIZE]
+            writer.write(FRAME_HEADER.pack(len(chunk)))
+            writer.write(chunk)
+            await asyncio.wait_for(writer.drain(), self.timeout)
+
+    async def streamCompressed(self, writer, codec, chunks):
+        '''
+        Send chunks compressed with codec, chunks may read files: each one is read
+        and compressed in the loop's executor
+        '''
+        compressor = self.compression.compressor(codec)
+        def compressNext():
+            chunk = next(chunks, None)
+            if chunk is None:
+                return None
+            return self.compression.compress(compressor, chunk)
+        while True:
+            out = await self.loop.run_in_executor(None, compressNext)
+            if out is None:
+                break
+            # zlib holds on to small inputs, and an empty frame would end the transfer
+            if out:
+                writer.write(frame(out))
+                await asyncio.wait_for(writer.drain(), self.timeout)
+        out = await self.loop.run_in_executor(None, self.compression.compress, compressor)
+        if out:
+            writer.write(frame(out))
+
+    async def streamFile(self, writer, dst_ip, header, path):
+        source = await self.loop.run_in_executor(None, open, path, "rb")
+        try:
+            size = os.fstat(source.fileno()).st_size
+            codec = None
+            if self.compression.wants(dst_ip, size):
+                sample = await self.loop.run_in_executor(None, source.read, CHUNK_SIZE)
+                codec = self.compression.codecFor(dst_ip, sample)
+                header["codec"] = codec
+                source.seek(0)
+            writer.write(frame(json.dumps(header).encode("utf-8")))
+            if codec is not None:
+                await self.streamCompressed(writer, codec, iter(lambda: source.read(CHUNK_SIZE), b""))
+                return
+            await self.streamFileFrames(writer, source, size, path)
+        finally:
+            source.close()
+
+    async def streamParts(self, writer, dst_ip, header, content, files):
+        size = len(content) + sum(size for path, size in files)
+        codec = None
+        if self.compression.wants(dst_ip, size):
+            codec = self.compression.codecFor(dst_ip, content[:CHUNK_SIZE])
+            header["codec"] = codec
+        writer.write(frame(json.dumps(header).encode("utf-8")))
+        if codec is not None:
+            await self.streamCompressed(writer, codec, partChunks(content, files))
+            return
+        view = memoryview(content)
+        for offset in range(0, len(content), FILE_FRAME_SIZE):
+            writer.write(frame(view[offset:offset + FILE_FRAME_SIZE]))
+        for path, size in files:
+            source = await self.loop.run_in_executor(None, open, path, "rb")
+            try:
+                await self.streamFileFrames(writer, source, size, path)
+            finally:
+                source.close()
+
+    async def streamFileFrames(self, writer, source, size, path):
+        '''Send the first size bytes of source as frames'''
+        # The loop sends each frame's content with os.sendfile where the transport allows it
+        offset = 0
+        while offset < size:
+            length = min(FILE_FRAME_SIZE, size - offset)
+            writer.write(FRAME_HEADER.pack(length))
+            await asyncio.wait_for(writer.drain(), self.timeout)
+            sent = await asyncio.wait_for(self.loop.sendfile(writer.transport, source, offset, length), self.timeout)
+            if sent != length:
+                raise OSError("{0} shrank mid-transfer".format(path))
+            offset += length
@@ -0,0 +1,91 @@
+import sys
+import timeit
+
+from ChordMessage import ChordMessage as c_msg
+from ChordMessage import newMsgDict, getCodec, CODECS
+
+def sample_msgs():
+    '''Representative control messages, as the nodes and clients build them
+    '''
+    msgs = []
+
+    msg = newMsgDict()
+    msg['msg_type'] = c_msg.FIND_SUCCESSOR
+    msg['key'] = 37
+    msg['target'] = "172.1.1.12"
+    msg['hops'] = 4
+    msgs.append(msg)
+
+    msg = newMsgDict()
+    msg['msg_type'] = c_msg.RETURN_SUCCESSOR
+    msg['key'] = 37
+    msg['target'] = "172.1.1.12"
+    msg['suc_ip'] = "172.1.1.40"
+    msg['finger'] = 41
+    msg['hops'] = 6
+    msgs.append(msg)
+
+    msg = newMsgDict()
+    msg['msg_type'] = c_msg.GET_PREDECESSOR
+    msgs.append(msg)
+
+    msg = newMsgDict()
+    msg['msg_type'] = c_msg.RETURN_PREDECESSOR
+    msg['pred_ip'] = "172.1.1.7"
+    msgs.append(msg)
+
+    msg = newMsgDict()
+    msg['msg_type'] = c_msg.NOTIFY_PREDECESSOR
+    msg['pred_ip'] = "172.1.1.7"
+    msgs.append(msg)
+
+    msg = newMsgDict()
+    msg['msg_type'] = c_msg.CHECK_ALIVE
+    msgs.append(msg)
+
+    msg = newMsgDict()
+    msg['msg_type'] = c_msg.SEND_FILE
+    msg['filename'] = "1234.txt"
+    msg['client_ip'] = "172.1.1.2"
+    msg['suc_ip'] = "172.1.1.40"
+    msg['key'] = 37
+    msg['target'] = "172.1.1.1"
+    msg['transfer'] = "172.1.1.1_1525880436868_17"
+    msg['size'] = 31
+    msg['hops'] = 9
+    msgs.append(msg)
+
+    msg = newMsgDict()
+    msg['msg_type'] = c_msg.GET_FILE
+    msg['filename'] = "1234.txt"
+    msg['client_ip'] = "172.1.1.2"
+    msgs.append(msg)
+
+    return msgs
+
+def bench(codec, msg, number):
+    data = codec.encode(msg)
+    encode_time = timeit.timeit(lambda: codec.encode(msg), number=number) / number
+    decode_time = timeit.timeit(lambda: codec.decode(data), number=number) / number
+    return len(data), encode_time, decode_time
+
+if __name__ == "__main__":
+    number = 20000
+    if len(sys.argv) > 1:
+        number = int(sys.argv[1])
+
+    codecs = [getCodec(name) for name in sorted(CODECS.keys(), reverse=True)]
+    print("{0:<20}{1:<8}{2:>8}{3:>12}{4:>12}".format("msg type", "codec", "bytes", "encode us", "decode us"))
+    totals = dict((codec.name, [0, 0, 0]) for codec in codecs)
+    for msg in sample_msgs():
+        for codec in codecs:
+            size, encode_time, decode_time = bench(codec, msg, number)
+            totals[codec.name][0] += size
+            totals[codec.name][1] += encode_time
+            totals[codec.name][2] += decode_time
+            print("{0:<20}{1:<8}{2:>8}{3:>12.2f}{4:>12.2f}".format(msg['msg_type'], codec.name, size, encode_time * 1e6, decode_time * 1e6))
+    count = len(sample_msgs())
+    for codec in codecs:
+        size, encode_time, decode_time = totals[codec.name]
+        print("{0:<20}{1:<8}{2:>8.1f}{3:>12.2f}{4:>12.2f}".format("average", codec.name, size / float(count), encode_time * 1e6 / count, decode_time * 1e6 / count))
+    sys.stdout.flush()
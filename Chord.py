@@ -1,224 +1,492 @@
-from datetime import datetime
-import hashlib
 import json
 import os
 import random
-import select
 import signal
-import socket
 import struct
 import sys
 import threading
 import time
-import os
 
-from ReadLog import MyLogger
+from ReadLog import MyLogger, PrettyMsg, flushLogs
+from ChordRing import keyInRange, FingerTable, KeyIndex, ChordNode, IdentityCache
+from RequestTable import RequestTable
+from MetaStore import MetaStore
+from ContentCache import ContentCache
+from Migration import BATCHES_IN_FLIGHT, planBatches, batchManifest, unpackBatch
+from Compression import Compression, loadDictionary
+from ChordTransport import UdpTransport
 from ChordMessage import ChordMessage as c_msg
-from ChordMessage import newMsgDict
-
-
-# Represents any object that has a place on the Chord ring
-class ChordNode:
-    def __init__(self, key, name="", isFile=False):
-        # Chord Nodes can be used for network nodes or files
-        self.ip = key
-        self.filename = key
-        self.name = name
-        
-        # Use hash to find position on ring
-        if isFile:
-            self.chord_id = [h % ring_size for h in get_hash(key, numHashes=num_replicates)]
-        else:
-            self.chord_id = get_hash(key)[0] % ring_size
-
-    def __str__(self):
-        if self.name == "":
-            return "key: {0}, chord id: {1}".format(self.ip, self.chord_id)
-        return "key: {0}, name: {1}, chord id: {2}".format(self.ip, self.name, self.chord_id)
-
-    def generate_fingers(self, finger_table_size):
-        ''' Generate skeleton fingers
-        '''
-        fingers = []
-        for index in range(finger_table_size):
-            fingers.append(self.chord_id + (2**index))        
-        return fingers    
-
-    def print_finger_table(self, finger_table):
-        ''' Print entries in finger table
-        '''
-        text = "\n"
-        index = 0
-        print(finger_table.keys())
-        for key,value in sorted(finger_table.items()):
-            if value is not None:
-                text +="N{0} + {1}: {2}\n".format(key-(2**index),2**index,value.ip)
-            else:
-                text +="N{0} + {1}: {2}\n".format(key-(2**index),2**index,"None")
-            index +=1
-        return text
-
-# Get the hash of a key
-def get_hash(key, numHashes=1):
-    hash_func = hashlib.sha1()
-    hashList = []
-    for i in range(numHashes):
-        # Update with key and keep first 4 bytes
-        hash_func.update(key.encode())
-        hash_bytes = hash_func.digest()
-        hashList.append(struct.unpack("<L", hash_bytes[:4])[0])
-
-    return hashList
+from ChordMessage import newMsgDict, getCodec
+
+# Parameters used when chordDFS.config does not set them
+DEFAULT_CONFIG = {
+    "finger_table_size": 6,
+    "tracker_node_ip": "172.1.1.1",
+    "control_port": 500,
+    "data_port": 501,
+    "transfer_timeout": 10,
+    "request_timeout": 10,
+    "msg_codec": "binary",
+    "using_finger_table": False,
+    "fingers_per_refresh": 1,
+    "num_replicates": 1,
+    "num_successors": 3,
+    "refresh_rate": 1,
+    "leave_join_prob": 0,
+    "fail_prob": 0,
+    "event_loop": "select",
+    "log_flush_interval": 0.5,
+    "log_events": False,
+    "content_cache_bytes": 32 * 1024 * 1024,
+    "compress_level": 1,
+    "compress_min_bytes": 1024,
+    "compress_dict": None,
+}
+
+# Filenames per HOLDINGS message, keeps each announcement within one datagram
+HOLDINGS_PER_MSG = 100
 
 # Get the outcome of a random roll with probability p
 def bernoulli(p):
     return random.uniform(0, 1) <= p
 
-# Send a UDP message to another node
-def sendCtrlMsg(dst_ip, msg_type, msg):
-    # Include the type of message this is
-    msg['msg_type'] = msg_type
-
-    # Serialize the message
-    msg_json = json.dumps(msg)
-    if sys.version_info[0] >= 3:
-        msg_json = bytes(msg_json, encoding="utf-8")
-    
-    # Send the message to the destination's control port
-    control_sock.sendto(msg_json, (dst_ip, control_port))
-    myLogger.mnPrint("msg type:{0} sent to {1}: msg:{2}".format(msg_type, dst_ip, myLogger.pretty_msg(msg)), debug=False)
-
-# Received a UDP message
-def ctrlMsgReceived():
-    global successor, predecessor, entries, outstanding_file_reqs, finger_table, tracker_node_ip, inNetwork
-
-    # Get data from socket
+# Load parameters from config file on top of the defaults
+def loadConfig(path="chordDFS.config"):
+    config = dict(DEFAULT_CONFIG)
     try:
-        data, addr = control_sock.recvfrom(1024)
-    except socket.error as e:
-        print(e)
-        return
-    
-    # Drop all packets if we are not participating in the network
-    if not inNetwork:
-        return
-
-    # Parse message type, update hops, and respond accordingly
-    msg = json.loads(str(data))
-    msg_type = msg['msg_type']
-    msg["hops"] += 1
-    myLogger.mnPrint("msg type:{0} rcvd from {1}: msg:{2}".format(msg_type, addr[0], myLogger.pretty_msg(msg)), debug=False)
+        with open(path) as configFile:
+            config.update(json.loads(configFile.read()))
+    except (IOError, ValueError):
+        pass
+    return config
+
+class ChordServer():
+    '''
+    A chord node, owning all of its ring state and the transport it talks to other nodes through
+    ip: ip of the node
+    name: name of the node, its files and logs live under nodes/<name>
+    config: parameters, see DEFAULT_CONFIG
+    transport: UdpTransport for a node in its own process, MemoryTransport to run many nodes in one
+    echo: print log output to stdout as well
+    '''
+    def __init__(self, ip, name, config=None, transport=None, echo=True):
+        if config is None:
+            config = loadConfig()
+
+        # Load parameters from config
+        self.finger_table_size = config['finger_table_size']
+        self.tracker_node_ip = config['tracker_node_ip']
+        self.using_finger_table = config['using_finger_table']
+        self.fingers_per_refresh = config['fingers_per_refresh']
+        self.num_replicates = config['num_replicates']
+        self.num_successors = config['num_successors']
+        self.refresh_rate = config['refresh_rate']
+        self.leave_join_prob = config['leave_join_prob']
+        self.fail_prob = config['fail_prob']
+
+        # Ring size is relative to finger table size s.t.
+        #   the last entry on the finger table will cross half the ring
+        self.ring_size = 2**self.finger_table_size # m
+
+        # Ring positions of the nodes and files we hear about, hashed once each
+        self.identities = IdentityCache(self.ring_size, self.num_replicates)
+
+        self.me = self.chordNode(ip, name=name)
+
+        # Set relative file paths
+        self.node_directory = "nodes/" + self.me.name
+        self.log_file_path = "{0}/logs/{1}.log".format(self.node_directory, self.me.ip.replace(".", "_"))
+        self.file_dir_path = self.node_directory + "/files/chord/"
+        self.staging_dir_path = self.node_directory + "/files/staging/"
+        self.meta_dir_path = self.node_directory + "/files/meta/"
+
+        # Get tracker based on ip from config
+        self.tracker = self.chordNode(self.tracker_node_ip)
+
+        # If we are the tracker node
+        self.is_tracker = self.me.ip == self.tracker_node_ip
+
+        # create logger
+        self.myLogger = MyLogger(self.me.ip, self.me.chord_id, self.log_file_path, echo=echo, flush_interval=config['log_flush_interval'], events=config['log_events'])
+
+        # Announce initialization
+        self.myLogger.mnPrint("Hi! I'm a chord node, my IP is {0}, my chord_id is {1}, my name is {2}".format(self.me.ip, self.me.chord_id, self.me.name))
+        if self.is_tracker:
+            self.myLogger.mnPrint("Oh, and I'm the tracker!")
+        self.myLogger.event("start", chord_id=self.me.chord_id, tracker=self.is_tracker)
+
+        # Serializes control messages
+        self.codec = getCodec(config['msg_codec'])
+
+        # Compresses the file content we send to nodes that accept it
+        self.compression = Compression(config['compress_level'], config['compress_min_bytes'], loadDictionary(config['compress_dict']))
+
+        # Carries control messages and file content to other nodes
+        if transport is None:
+            transport = UdpTransport(self.me.ip, config['control_port'], config['data_port'], config['transfer_timeout'])
+        self.transport = transport
+        self.transport.attach(self)
+
+        # Every file that we are responsible for (name->ChordNode)
+        self.entries = dict()
+        # Guards our entries and everything derived from them (key index, unbalanced entries, handoffs,
+        #   uploads): they change on the control thread, the refresh thread and in transfer callbacks
+        self.entries_lock = threading.RLock()
+
+        # Chord ids of our entries by position on the ring, so rebalancing only looks at the keys
+        #   that changed hands: entries added since the last rebalance and the keys between the
+        #   predecessor we last rebalanced against and our current one
+        self.key_index = KeyIndex()
+        self.unbalanced = set()
+        self.balanced_pred_id = None
+
+        # Durable index of our entries, survives restarts
+        self.meta = MetaStore(self.meta_dir_path)
+        self.restoreEntries()
+
+        # Content of the files we serve most, so popular files are not read from disk every time
+        self.content_cache = ContentCache(config['content_cache_bytes'])
+
+        # Every file on the network, only used by tracker (name->ChordNode), and their chord ids
+        #   by position on the ring so the files a dead node held are found by a range query
+        self.allFiles = dict()
+        self.file_index = KeyIndex()
+
+        # Our find successor lookups in flight, by the lookup id their answer carries back
+        self.lookups = RequestTable(config['request_timeout'], clock=self.transport.now)
+
+        # Batches of files we handed over and whose receiver has not acked them yet, and the
+        #   files in them by the number of such batches holding each
+        self.migrations = RequestTable(config['request_timeout'], clock=self.transport.now)
+        self.handoffs = dict()
+
+        # Client uploads waiting to be sent to their replicas (upload handle->[staged path, replicas left])
+        self.uploads = dict()
+
+        # If we are waiting for a certain node to tell us that it is alive
+        self.waiting_for_alive_resp = dict()
+
+        # Nodes we have seen die, skipped when routing until we hear from them again
+        self.dead_nodes = set()
+
+        # Predecessor is null by default, successor is set on start
+        self.predecessor = None
+        self.successor = None
+        self.successor_list = []
+        self.inNetwork = False
+
+        # up to m entries; me.chord_id + 2^i
+        self.finger_table = None
+        if self.using_finger_table:
+            self.finger_table = FingerTable(self.me.chord_id, self.finger_table_size, self.ring_size)
+            # Rotating position of the finger refresh
+            self.next_finger = 0
+
+        # Message handlers by message type
+        self.handlers = {
+            c_msg.FIND_SUCCESSOR: self.handleFindSuccessor,
+            c_msg.RETURN_SUCCESSOR: self.handleReturnSuccessor,
+            c_msg.GET_PREDECESSOR: self.handleGetPredecessor,
+            c_msg.RETURN_PREDECESSOR: self.handleReturnPredecessor,
+            c_msg.NOTIFY_PREDECESSOR: self.handleNotifyPredecessor,
+            c_msg.CHECK_ALIVE: self.handleCheckAlive,
+            c_msg.AM_ALIVE: self.handleAmAlive,
+            c_msg.SEND_FILE: self.handleSendFile,
+            c_msg.REQUEST_FILE: self.handleRequestFile,
+            c_msg.SOMEONE_DIED: self.handleSomeoneDied,
+            c_msg.LEAVING: self.handleLeaving,
+            c_msg.INSERT_FILE: self.handleInsertFile,
+            c_msg.GET_FILE: self.handleGetFile,
+            c_msg.GET_FILE_LIST: self.handleGetFileList,
+            c_msg.ENTRIES: self.handleEntries,
+            c_msg.ERR: self.handleErr,
+            c_msg.HOLDINGS: self.handleHoldings,
+            c_msg.MIGRATE: self.handleMigrate,
+            c_msg.MIGRATE_ACK: self.handleMigrateAck,
+        }
+
+    def chordNode(self, ip, name=""):
+        '''ChordNode for a node on our ring'''
+        if name != "":
+            return ChordNode(ip, self.ring_size, name=name)
+        return self.identities.node(ip)
+
+    def fileNode(self, filename):
+        '''ChordNode for a file on our ring'''
+        return self.identities.file(filename)
+
+    def fileNodes(self, filenames):
+        '''ChordNodes for many files on our ring'''
+        return self.identities.files(filenames)
+
+    def start(self):
+        '''Create the network if we are the tracker, otherwise (most likely) join it'''
+        # Tracker creates the network, and is thus its own successor
+        if self.is_tracker:
+            self.inNetwork = True
+            self.successor = self.me
+        # Every other node is joining the network after the tracker
+        # We want most nodes to join the network initially
+        elif bernoulli(1 - self.leave_join_prob):
+            self.join()
+
+        # The first finger lookup fills the rest of the table
+        if self.using_finger_table:
+            self.lookupFinger(0)
+
+        # Files we kept from before a restart are on the network again
+        self.announceHoldings()
+
+    def restoreEntries(self):
+        '''Take back the files listed in our metadata index, checking only that each is still on disk'''
+        restored = []
+        for filename, (chord_ids, size, checksum) in list(self.meta.files.items()):
+            path = self.file_dir_path + filename
+            if os.path.isfile(path) and os.path.getsize(path) == size:
+                restored.append(filename)
+            else:
+                self.meta.remove(filename)
+        restored = list(zip(restored, self.fileNodes(restored)))
+        for filename, fileNode in restored:
+            self.entries[filename] = fileNode
+        # The first rebalance checks every entry, they need not be marked unbalanced
+        self.key_index.addFiles((filename, fileNode.chord_id) for filename, fileNode in restored)
+        if len(self.entries) > 0:
+            self.myLogger.mnPrint("Restored {0} files from the metadata index".format(len(self.entries)))
+
+    def addEntry(self, filename, fileNode, checksum):
+        '''
+        Start being responsible for a file whose content is in our file directory
+        checksum: crc32 of the content, taken when it was received
+        '''
+        path = self.file_dir_path + filename
+        with self.entries_lock:
+            self.holdEntry(filename, fileNode)
+            self.content_cache.invalidate(filename)
+            self.meta.add(filename, fileNode.chord_id, os.path.getsize(path), checksum)
+
+    def holdEntry(self, filename, fileNode):
+        '''Add a file to our entries and key index, the next rebalance checks whether it is ours'''
+        with self.entries_lock:
+            old = self.entries.get(filename)
+            if old is not None:
+                self.key_index.remove(filename, old.chord_id)
+            self.entries[filename] = fileNode
+            self.key_index.add(filename, fileNode.chord_id)
+            self.unbalanced.add(filename)
+
+    def removeEntry(self, filename):
+        '''Stop being responsible for a file, returns its ChordNode'''
+        with self.entries_lock:
+            self.meta.remove(filename)
+            self.content_cache.invalidate(filename)
+            fileNode = self.entries.pop(filename)
+            self.key_index.remove(filename, fileNode.chord_id)
+            self.unbalanced.discard(filename)
+            return fileNode
+
+    def announceHoldings(self):
+        '''Tell the tracker which files we hold, so it lists them again after a restart'''
+        with self.entries_lock:
+            filenames = sorted(self.entries.keys())
+        self.trackFiles(filenames)
+
+    def trackFiles(self, filenames):
+        '''Have the tracker list these files, it keeps the list of every file on the network'''
+        if self.is_tracker:
+            added = [f for f in filenames if f not in self.allFiles]
+            for f, cn in zip(added, self.fileNodes(added)):
+                self.allFiles[f] = cn
+            self.file_index.addFiles((f, self.allFiles[f].chord_id) for f in added)
+            return
+        for i in range(0, len(filenames), HOLDINGS_PER_MSG):
+            msg = newMsgDict()
+            msg['file_list'] = filenames[i:i + HOLDINGS_PER_MSG]
+            self.sendCtrlMsg(self.tracker.ip, c_msg.HOLDINGS, msg)
+
+    # Send a control message to another node
+    def sendCtrlMsg(self, dst_ip, msg_type, msg):
+        # Include the type of message this is
+        msg['msg_type'] = msg_type
+
+        # Serialize the message and send it to the destination's control port
+        data = self.codec.encode(msg)
+        self.transport.sendCtrl(dst_ip, data)
+        self.myLogger.mnPrint("msg type:{0} sent to {1}: msg:{2}", msg_type, dst_ip, PrettyMsg(msg), debug=False)
+        self.myLogger.event("send", msg=msg_type, req=msg['req_id'], hops=msg['hops'], bytes=len(data), dst=dst_ip)
+
+    # Received a control message
+    def ctrlMsgReceived(self, data, addr):
+        # Drop all packets if we are not participating in the network, apart from the acks
+        #   of files we handed over as we left
+        if not self.inNetwork and len(self.migrations) == 0:
+            return
+
+        # Anyone we hear from is alive again
+        self.dead_nodes.discard(addr[0])
+
+        # Parse message type, update hops, and respond accordingly
+        try:
+            msg = self.codec.decode(data)
+        except (ValueError, IndexError, struct.error) as e:
+            self.myLogger.mnPrint("Dropping malformed message from {0}: {1}".format(addr[0], e))
+            return
+        msg_type = msg['msg_type']
+        if not self.inNetwork and msg_type != c_msg.MIGRATE_ACK:
+            return
+        msg["hops"] += 1
+        self.myLogger.mnPrint("msg type:{0} rcvd from {1}: msg:{2}", msg_type, addr[0], PrettyMsg(msg), debug=False)
+        self.myLogger.event("recv", msg=msg_type, req=msg['req_id'], hops=msg['hops'], bytes=len(data), src=addr[0])
+
+        handler = self.handlers.get(msg_type)
+        if handler is not None:
+            handler(msg, addr)
 
     # We are supposed to find target's successor
-    if msg_type == c_msg.FIND_SUCCESSOR:
+    def handleFindSuccessor(self, msg, addr):
         key = msg['key']
         target = msg['target']
-        #filename = msg['filename']
-        findSuccessor(key, target, msg)
-
-    # Someone returned our find successor query
-    elif msg_type == c_msg.RETURN_SUCCESSOR:
+        self.findSuccessor(key, target, msg)
+
+    # Someone returned one of our find successor queries
+    def handleReturnSuccessor(self, msg, addr):
+        if not self.lookups.complete(msg['lookup_id'], msg):
+            self.myLogger.mnPrint("Dropping answer to expired lookup {0}".format(msg['lookup_id']))
+
+    # Found our successor by looking up our own id
+    def successorFound(self, msg):
+        self.successor = self.chordNode(msg['suc_ip'])
+        self.successor_list = [self.successor]
+        self.successorChanged()
+        self.myLogger.mnPrint("Successor updated by find successor: {0}".format(self.successor))
+
+    # Found the node holding one of a file's keys, carry out the operation we looked it up for
+    def fileFound(self, op, msg):
         suc_ip = msg['suc_ip']
-        filename = msg['filename']
-        finger = msg['finger']
-        # No filename indicates we wanted to find our successor
-        if filename is None:
-	        # Finger update
-            if finger is not None:
-                finger_table[finger] = ChordNode(suc_ip)            
-                #myLogger.mnPrint(me.print_finger_table(finger_table))
-            # Successor update
-            else:
-                successor = ChordNode(suc_ip)
-                myLogger.mnPrint("Successor updated by find successor: {0}".format(successor))
-        # Filename indicates we wanted to find a file's location
-        else:
-            fileNode = ChordNode(filename, isFile=True)
-            myLogger.mnPrint("Found file ({0}) ({1}) at ({2})".format(fileNode, msg['key'], ChordNode(suc_ip)))
-            if outstanding_file_reqs[filename] == c_msg.OP_SEND_FILE:
-                # When we get to this point, assume that file content is already present in msg
-                sendFile(suc_ip, msg)
-            elif outstanding_file_reqs[filename] == c_msg.OP_REQ_FILE:
-                sendCtrlMsg(suc_ip, c_msg.REQUEST_FILE, msg)
-            elif outstanding_file_reqs[filename] == c_msg.OP_INSERT_FILE:
-                sendCtrlMsg(suc_ip, c_msg.INSERT_FILE, msg)
+        self.myLogger.mnPrint("Found file ({0}) ({1}) at ({2})".format(self.fileNode(msg['filename']), msg['key'], self.chordNode(suc_ip)))
+        if op == c_msg.OP_SEND_FILE:
+            # Client uploads are forwarded from their staged copy, reinsertions from our own copy
+            self.sendFile(suc_ip, msg, readFromFile=msg['upload'] is None)
+        elif op == c_msg.OP_REQ_FILE:
+            self.sendCtrlMsg(suc_ip, c_msg.REQUEST_FILE, msg)
+        elif op == c_msg.OP_INSERT_FILE:
+            self.sendCtrlMsg(suc_ip, c_msg.INSERT_FILE, msg)
 
     # Someone wants to know who our predecessor is
-    elif msg_type == c_msg.GET_PREDECESSOR:
+    def handleGetPredecessor(self, msg, addr):
         msg = newMsgDict()
-        msg['pred_ip'] = None if predecessor is None else predecessor.ip
-        sendCtrlMsg(addr[0], c_msg.RETURN_PREDECESSOR, msg)
+        msg['pred_ip'] = None if self.predecessor is None else self.predecessor.ip
+        msg['suc_list'] = [node.ip for node in self.successor_list]
+        self.sendCtrlMsg(addr[0], c_msg.RETURN_PREDECESSOR, msg)
 
     # Our successor told us who their predecessor is
-    elif msg_type == c_msg.RETURN_PREDECESSOR:
+    def handleReturnPredecessor(self, msg, addr):
         pred_ip = msg['pred_ip']
-        stabilize(None if pred_ip == None else ChordNode(pred_ip))
+        self.stabilize(None if pred_ip == None else self.chordNode(pred_ip), msg['suc_list'])
 
     # Someone told us that they are our predecessor
-    elif msg_type == c_msg.NOTIFY_PREDECESSOR:
+    def handleNotifyPredecessor(self, msg, addr):
         pred_ip = msg['pred_ip']
         if pred_ip is not None:
-            notify(ChordNode(pred_ip))
+            self.notify(self.chordNode(pred_ip))
 
     # Someone wants to know we are alive
-    elif msg_type == c_msg.CHECK_ALIVE:
-        sendCtrlMsg(addr[0], c_msg.AM_ALIVE, msg)
+    def handleCheckAlive(self, msg, addr):
+        self.sendCtrlMsg(addr[0], c_msg.AM_ALIVE, msg)
 
     # Someone told us they were alive
-    elif msg_type == c_msg.AM_ALIVE:
-        waiting_for_alive_resp[addr[0]] = False
+    def handleAmAlive(self, msg, addr):
+        self.waiting_for_alive_resp[addr[0]] = False
 
     # Someone sent us a file
-    elif msg_type == c_msg.SEND_FILE:
+    def handleSendFile(self, msg, addr):
         filename = msg['filename']
-        fileNode = ChordNode(filename, isFile=True)
-        content = msg['content']
+        fileNode = self.fileNode(filename)
 
         '''
         # If this file was for a recovery, make sure it was meant for us, otherwise reinsert
         lost_key = msg['hash']
-        if lost_key is not None and predecessor is not None:
-            if not keyInRange(lost_key, predecessor.ip, me.ip, inc_end=True):
-                myLogger.mnPrint("Received {0} to recover at {1}, but this doesn't belong to us".format(fileNode, lost_key))
+        if lost_key is not None and self.predecessor is not None:
+            if not keyInRange(lost_key, self.predecessor.ip, self.me.ip, inc_end=True):
+                self.myLogger.mnPrint("Received {0} to recover at {1}, but this doesn't belong to us".format(fileNode, lost_key))
                 # Wait, and then restart request to recover file
-                t = threading.Timer(2 * refresh_rate, lambda: sendCtrlMsg(tracker.ip, c_msg.SOMEONE_DIED, msg))
-                t.start()
+                self.transport.schedule(2 * self.refresh_rate, lambda: self.sendCtrlMsg(self.tracker.ip, c_msg.SOMEONE_DIED, msg))
                 return
         '''
 
-        # Save this file
-        with open("{0}/{1}".format(file_dir_path, filename), "w") as newFile:
-            newFile.write(content)
-        entries[filename] = fileNode
-        myLogger.mnPrint("Received file " + filename + " from " + str(addr[0]))
+        # Save this file once its content has arrived over the data channel
+        staged, checksum = self.transport.claim(msg['transfer'])
+        if staged is None:
+            self.myLogger.mnPrint("Error: content of {0} from {1} never arrived".format(filename, addr[0]))
+            return
+        os.rename(staged, self.file_dir_path + filename)
+        self.addEntry(filename, fileNode, checksum)
+        self.myLogger.mnPrint("Received file " + filename + " from " + str(addr[0]))
+        self.myLogger.event("store", msg=c_msg.SEND_FILE, req=msg['req_id'], hops=msg['hops'], bytes=msg['size'], file=filename)
 
         # If file from the client -> tell them insertion was successful
         if msg["client_ip"] != None:
-            sendCtrlMsg(msg["client_ip"], c_msg.INSERT_FILE, msg)
+            self.sendCtrlMsg(msg["client_ip"], c_msg.INSERT_FILE, msg)
         # Current responsible entries
-        myLogger.mnPrint("entry keys: {0}".format(entries.keys()))
+        with self.entries_lock:
+            self.myLogger.mnPrint("entry keys: {0}".format(list(self.entries.keys())))
+
+    # A node handed us a batch of files
+    def handleMigrate(self, msg, addr):
+        staged, _ = self.transport.claim(msg['transfer'])
+        if staged is None:
+            self.myLogger.mnPrint("Error: batch {0} from {1} never arrived".format(msg['transfer'], addr[0]))
+            return
+
+        # Copying the files out is left to the transport, away from the control path
+        def unpack():
+            try:
+                return unpackBatch(staged, self.file_dir_path), None
+            except (IOError, OSError, ValueError) as e:
+                return None, e
+            finally:
+                os.remove(staged)
+        self.transport.offload(unpack, lambda result: self.batchUnpacked(msg, addr, *result))
+
+    def batchUnpacked(self, msg, addr, manifest, error):
+        '''Take over the files of a batch once they are in our file directory'''
+        if error is not None:
+            self.myLogger.mnPrint("Error: could not unpack batch {0} from {1}: {2}".format(msg['transfer'], addr[0], error))
+            return
+        filenames = [filename for filename, size, checksum in manifest]
+        for (filename, size, checksum), fileNode in zip(manifest, self.fileNodes(filenames)):
+            self.addEntry(filename, fileNode, checksum)
+        self.myLogger.mnPrint("Received {0} files from {1}".format(len(manifest), addr[0]))
+        self.myLogger.event("store", msg=c_msg.MIGRATE, req=msg['req_id'], hops=msg['hops'], bytes=msg['size'], files=len(manifest))
+
+        # The sender deletes its copies once we ack
+        self.sendCtrlMsg(addr[0], c_msg.MIGRATE_ACK, msg)
+
+    def handleMigrateAck(self, msg, addr):
+        if not self.migrations.complete(msg['req_id'], msg):
+            self.myLogger.mnPrint("Late ack of batch {0} from {1}".format(msg['transfer'], addr[0]))
 
     # Someone wants a file from us
-    elif msg_type == c_msg.REQUEST_FILE:
+    def handleRequestFile(self, msg, addr):
         # Send directly to client
         if msg["client_ip"] is not None:
-            myLogger.mnPrint(msg['filename'] + " requested from " + msg["client_ip"])
-            sendFile(msg["client_ip"], msg, readFromFile=True)            
+            self.myLogger.mnPrint(msg['filename'] + " requested from " + msg["client_ip"])
+            self.sendFile(msg["client_ip"], msg, readFromFile=True)
         # Send to node who requested it
         # TODO: don't think this should happen
         else:
-            sendFile(addr[0], msg, readFromFile=True, rmEntry=True)
-            myLogger.mnPrint(msg['filename'] + " requested from " + addr[0])
+            self.sendFile(addr[0], msg, readFromFile=True, rmEntry=True)
+            self.myLogger.mnPrint(msg['filename'] + " requested from " + addr[0])
 
     # We were informed of the death of a node
-    elif msg_type == c_msg.SOMEONE_DIED:
-        dead_node = ChordNode(msg['dead_node'])
-        dn_pred = ChordNode(msg['pred_ip'])
-        myLogger.mnPrint("Heard that {0} died".format(dead_node))
-        
-        # For every file in the network...
-        for f, cn in allFiles.items():
-            # See if a copy of it should have been in dn
+    def handleSomeoneDied(self, msg, addr):
+        dead_node = self.chordNode(msg['dead_node'])
+        dn_pred = self.chordNode(msg['pred_ip'])
+        self.myLogger.mnPrint("Heard that {0} died".format(dead_node))
+
+        # For every file in the network with a copy that should have been in dn...
+        for f in self.file_index.filesIn(dn_pred.chord_id, dead_node.chord_id):
+            cn = self.allFiles[f]
             keys_not_in_dn = []
             dn_fkey = 0
             for k in cn.chord_id:
@@ -226,471 +494,639 @@ def ctrlMsgReceived():
                     dn_fkey = k
                 else:
                     keys_not_in_dn.append(k)
-            
+
             # If all copies were there, there is no chance of recovery and the file is lost
             if len(keys_not_in_dn) == 0:
                 pass # TODO: mark file as lost
             # If at least one copy was there, find another node that is hosting the file
-            elif len(keys_not_in_dn) < num_replicates:
-                myLogger.mnPrint("Attempting to re-insert {0} ({1}) from {2}".format(f, dn_fkey, keys_not_in_dn[0]))
-                outstanding_file_reqs[f] = c_msg.OP_INSERT_FILE
+            elif len(keys_not_in_dn) < self.num_replicates:
+                self.myLogger.mnPrint("Attempting to re-insert {0} ({1}) from {2}".format(f, dn_fkey, keys_not_in_dn[0]))
                 msg['filename'] = f
                 msg['hash'] = dn_fkey
-                findSuccessor(keys_not_in_dn[0], me.ip, msg)
+                self.lookup(keys_not_in_dn[0], lambda found: self.fileFound(c_msg.OP_INSERT_FILE, found), msg)
 
     # We were informed that a node is leaving
-    elif msg_type == c_msg.LEAVING:
+    def handleLeaving(self, msg, addr):
         suc_ip = msg['suc_ip']
         pred_ip = msg['pred_ip']
         if suc_ip is not None:
-            successor = ChordNode(suc_ip)
-            myLogger.mnPrint("Successor updated by prev leaving: {0}".format(successor))
+            self.successor = self.chordNode(suc_ip)
+            self.successor_list = [self.successor] + [node for node in self.successor_list if node.ip not in (addr[0], suc_ip)]
+            self.successorChanged()
+            self.myLogger.mnPrint("Successor updated by prev leaving: {0}".format(self.successor))
         elif pred_ip is not None:
-            predecessor = ChordNode(pred_ip)
-            myLogger.mnPrint("Predecessor updated by prev leaving: {0}".format(predecessor))
+            self.predecessor = self.chordNode(pred_ip)
+            self.myLogger.mnPrint("Predecessor updated by prev leaving: {0}".format(self.predecessor))
 
     # We are supposed to insert a file into the network
-    elif msg_type == c_msg.INSERT_FILE:
+    def handleInsertFile(self, msg, addr):
         filename = msg['filename']
-        outstanding_file_reqs[filename] = c_msg.OP_SEND_FILE
-        fileNode = ChordNode(filename, isFile=True)
-        
+        fileNode = self.fileNode(filename)
+
         # If from client, we are inserting a file for the first time
         if msg['client_ip'] is not None:
-            myLogger.mnPrint("Inserting " + str(fileNode) + " into the network")
-            allFiles[filename] = fileNode # TODO: only set on confirm? or should we assume this always succeeds?
+            # Hold on to the uploaded content until every replica has been sent
+            staged, _ = self.transport.claim(msg['transfer'])
+            if staged is None:
+                self.myLogger.mnPrint("Error: upload of {0} from {1} never arrived".format(filename, addr[0]))
+                self.sendCtrlMsg(msg['client_ip'], c_msg.ERR, msg)
+                return
+            upload = msg['transfer']
+            msg['upload'] = upload
+            with self.entries_lock:
+                self.uploads[upload] = [staged, len(fileNode.chord_id)]
+            self.myLogger.mnPrint("Inserting " + str(fileNode) + " into the network")
+            # Any node can take inserts, the tracker only has to list the file
+            self.trackFiles([filename])
             for chord_id in fileNode.chord_id:
-                findSuccessor(chord_id, me.ip, msg)
+                # A replica we never find a home for must not pin the staged upload forever
+                self.lookup(chord_id, lambda found: self.fileFound(c_msg.OP_SEND_FILE, found), msg,
+                    on_timeout=lambda: self.releaseUpload(upload))
         # Otherwise, we are reinserting a file that we think was partially lost
         else:
             # Find the new location of the lost key for reinsertion
-            if filename in entries:
+            if filename in self.entries:
                 lost_key = msg['hash']
-                myLogger.mnPrint("Reinserting {0} ({1}) into the network".format(fileNode, lost_key))
-                with open(file_dir_path + filename) as f:
-                    msg['content'] = f.read()
-                findSuccessor(lost_key, me.ip, msg)
+                self.myLogger.mnPrint("Reinserting {0} ({1}) into the network".format(fileNode, lost_key))
+                self.lookup(lost_key, lambda found: self.fileFound(c_msg.OP_SEND_FILE, found), msg)
             # If our network hasn't stabilized yet, we may have falsely received this request
             else:
                 # Wait, and then restart request to recover file
-                t = threading.Timer(2 * refresh_rate, lambda: sendCtrlMsg(tracker.ip, c_msg.SOMEONE_DIED, msg))
-                t.start()
+                self.transport.schedule(2 * self.refresh_rate, lambda: self.sendCtrlMsg(self.tracker.ip, c_msg.SOMEONE_DIED, msg))
 
     # We are supposed to retrieve a file from the network
-    elif msg_type == c_msg.GET_FILE:
+    def handleGetFile(self, msg, addr):
         filename = msg['filename']
-        outstanding_file_reqs[filename] = c_msg.OP_REQ_FILE
-        fileNode = ChordNode(filename, isFile=True)
-        myLogger.mnPrint("Retrieving " + str(fileNode))
-        for k in fileNode.chord_id:
-            findSuccessor(k, me.ip, msg)
-
-    # send all known entries back to client if tracker
-    elif msg_type == c_msg.GET_FILE_LIST:
-        if me.ip == tracker_node_ip:
-            msg["file_list"] = allFiles.keys()
-            sendCtrlMsg(msg["client_ip"], c_msg.GET_FILE_LIST, msg)
+        fileNode = self.fileNode(filename)
+        self.myLogger.mnPrint("Retrieving " + str(fileNode))
+        # A hedged read asks for a single replica, otherwise every replica sends its copy
+        keys = fileNode.chord_id
+        if msg['replica'] is not None:
+            keys = [keys[msg['replica'] % len(keys)]]
+        for k in keys:
+            self.lookup(k, lambda found: self.fileFound(c_msg.OP_REQ_FILE, found), msg)
+
+    # send all known entries back to client if tracker, only the tracker knows them
+    def handleGetFileList(self, msg, addr):
+        if self.is_tracker:
+            msg["file_list"] = list(self.allFiles.keys())
+            self.sendCtrlMsg(msg["client_ip"], c_msg.GET_FILE_LIST, msg)
+        else:
+            self.sendCtrlMsg(self.tracker.ip, c_msg.GET_FILE_LIST, msg)
+
     # avgs keys per node
-    elif msg_type == c_msg.ENTRIES:
-        # log entries and pass request along        
-        myLogger.mnPrint("entries: {0}".format(print_entries()))
+    def handleEntries(self, msg, addr):
+        # log entries and pass request along
+        self.myLogger.mnPrint("entries: {0}".format(self.print_entries()))
+        self.myLogger.mnPrint("content cache: {0}".format(self.content_cache))
+        self.myLogger.mnPrint("compression: {0}".format(self.compression))
+        self.myLogger.mnPrint("identity cache: {0}".format(self.identities))
+        self.myLogger.event("entries", msg=c_msg.ENTRIES, req=msg['req_id'], count=len(self.entries),
+            cache_hits=self.content_cache.hits, cache_misses=self.content_cache.misses, cache_bytes=self.content_cache.size,
+            raw_bytes=self.compression.raw_bytes, wire_bytes=self.compression.wire_bytes, compress_time=self.compression.compress_time)
         # we've come full circle -> tell client about success
-        if successor.ip == tracker_node_ip or\
-           (successor.ip == tracker_node_ip and successor.ip == me.ip):            
-            sendCtrlMsg(msg["client_ip"], c_msg.ENTRIES, msg)
+        if self.successor.ip == self.tracker_node_ip:
+            self.sendCtrlMsg(msg["client_ip"], c_msg.ENTRIES, msg)
         else:
-            myLogger.mnPrint("Sending entries request forward: {0}".format(successor.ip))
-            sendCtrlMsg(successor.ip, c_msg.ENTRIES, msg)
+            self.myLogger.mnPrint("Sending entries request forward: {0}".format(self.successor.ip))
+            self.sendCtrlMsg(self.successor.ip, c_msg.ENTRIES, msg)
+
+    # A node told us which files it holds
+    def handleHoldings(self, msg, addr):
+        if self.is_tracker:
+            self.trackFiles(msg['file_list'])
+            self.myLogger.mnPrint("{0} holds {1} files".format(addr[0], len(msg['file_list'])))
 
     # TODO: when will this happen?
-    elif msg_type == c_msg.ERR:
+    def handleErr(self, msg, addr):
         pass
 
-# This calls all methods that need to be called frequently to keep the network synchronized
-def refresh():
-    global successor, predecessor, refresh_rate, inNetwork
+    # This calls all methods that need to be called frequently to keep the network synchronized
+    def refresh(self):
+        self.checkSuccessor()
+        self.refreshFingers()
+        self.checkPredecessor()
+        self.churn()
+        self.expireRequests()
+
+    # Make sure our successor is alive and stabilize with it
+    def checkSuccessor(self):
+        if self.successor == None:
+            return
 
-    while True:
-        if successor != None:
-            # If we were waiting on a response from our successor and never got one, assume they died
-            if waitingForAlive(successor.ip):
-                # Inform the tracker that this node is dead so we can recover any files it was hosting
-                msg = newMsgDict()
-                msg['dead_node'] = successor.ip
-                msg['pred_ip'] = me.ip
-                sendCtrlMsg(tracker.ip, c_msg.SOMEONE_DIED, msg)
-
-                myLogger.mnPrint("Our successor {0} has died!".format(successor))
-                waiting_for_alive_resp[successor.ip] = False
-                successor = None
-                findSuccessor(me.chord_id, me.ip)
-                successor = me
-            # Will get our successor's predecessor and call stabilize on return
-            else:
-                waiting_for_alive_resp[successor.ip] = True
-                sendCtrlMsg(successor.ip, c_msg.GET_PREDECESSOR, newMsgDict())
-
-        # Update our finger table
-        if using_finger_table and inNetwork:
-            fixFingers()
-
-        # Handle predecessor death
-        if predecessor != None:
-            # If we were waiting on a response from our predecessor and never got one, assume they died
-            if waitingForAlive(predecessor.ip) and predecessor.ip is not successor.ip:
-                myLogger.mnPrint("Our predecessor {0} has died!".format(predecessor))
-                waiting_for_alive_resp[predecessor.ip] = False
-                predecessor = None
+        # If we were waiting on a response from our successor and never got one, assume they died
+        if self.waitingForAlive(self.successor.ip):
+            # Inform the tracker that this node is dead so we can recover any files it was hosting
+            msg = newMsgDict()
+            msg['dead_node'] = self.successor.ip
+            msg['pred_ip'] = self.me.ip
+            self.sendCtrlMsg(self.tracker.ip, c_msg.SOMEONE_DIED, msg)
+
+            self.myLogger.mnPrint("Our successor {0} has died!".format(self.successor))
+            self.waiting_for_alive_resp[self.successor.ip] = False
+            self.dead_nodes.add(self.successor.ip)
+
+            # Promote the next live node of our successor list and stabilize with it right away
+            self.successor_list = [node for node in self.successor_list if node.ip not in self.dead_nodes]
+            if len(self.successor_list) > 0:
+                self.successor = self.successor_list[0]
+                self.successorChanged()
+                self.myLogger.mnPrint("Successor updated by successor list: {0}".format(self.successor))
+                self.waiting_for_alive_resp[self.successor.ip] = True
+                self.sendCtrlMsg(self.successor.ip, c_msg.GET_PREDECESSOR, newMsgDict())
+            # With nobody left to promote, look our successor up through the tracker
             else:
-                # Check to see if the predecessor is still alive
-                waiting_for_alive_resp[predecessor.ip] = True
-                sendCtrlMsg(predecessor.ip, c_msg.CHECK_ALIVE, newMsgDict())
-                # Send any files that shouldn't be here to the predecessor
-                sendFilesToPred()
-
-        # Nodes should randomly leave/join the network or fail outright
-        if not is_tracker:
-            if bernoulli(leave_join_prob):
-                if inNetwork:
-                    leave()
-                else:
-                    join()
-            if bernoulli(fail_prob):
-                fail()
-
-        # Wait for short time
-        time.sleep(refresh_rate)
-
-# Return if we are waiting for an alive response from the given ip
-def waitingForAlive(ip):
-    return ip in waiting_for_alive_resp and waiting_for_alive_resp[ip]
-
-# Determine if the given key is between the two given endpoints
-def keyInRange(key, start_id, end_id, inc_end=False):
-    # If endpoints are on same side of chord ring
-    if end_id > start_id:
-        return key > start_id and (key <= end_id if inc_end else key < end_id)
-    # If endpoints straddle the 0 point of the chord ring (or are equal)
-    else:
-        return key > start_id or (key <= end_id if inc_end else key < end_id)
-
-# Join the network by finding out who your successor is
-def join():
-    global inNetwork
-
-    inNetwork = True
-    myLogger.mnPrint("Joining the network...")
-    findSuccessor(me.chord_id, me.ip)
-
-# Leave the network gracefully
-def leave():
-    global inNetwork, predecessor, successor
-
-    inNetwork = False
-    myLogger.mnPrint("Leaving the network...")
-
-    # Send all of our current files to our successor
-    if successor is not None:
-        msg = newMsgDict()
-        for f in list(entries.keys()):
-            msg['filename'] = f
-            sendFile(successor.ip, msg, readFromFile=True, rmEntry=True)
+                self.successor = None
+                self.lookup(self.me.chord_id, self.successorFound)
+                self.successor = self.me
+        # Will get our successor's predecessor and call stabilize on return
+        else:
+            self.waiting_for_alive_resp[self.successor.ip] = True
+            self.sendCtrlMsg(self.successor.ip, c_msg.GET_PREDECESSOR, newMsgDict())
 
-    if successor is not None and predecessor is not None:
-        # Tell our successor we are leaving and pass them our predecessor
-        msg = newMsgDict()
-        msg['pred_ip'] = predecessor.ip
-        sendCtrlMsg(successor.ip, c_msg.LEAVING, msg)
+    # Update our finger table
+    def refreshFingers(self):
+        if self.using_finger_table and self.inNetwork:
+            self.fixFingers()
 
-        # Tell our predecessor we are leaving and pass them our successor
-        msg = newMsgDict()
-        msg['suc_ip'] = successor.ip
-        sendCtrlMsg(predecessor.ip, c_msg.LEAVING, msg)
-
-    successor = None
-    predecessor = None
-
-# Simulate this node crashing
-def fail():
-    global inNetwork, predecessor, successor
-    
-    myLogger.mnPrint("Failing...")
-
-    inNetwork = False
-    predecessor = None
-    successor = None
-
-# Find the ip of the chord node that should succeed the given key
-# If filename is specified, this is for finding a file location
-def findSuccessor(key, target, msg=None):
-    global successor
-
-    # If key is somewhere between self and self.successor, then self.successor directly succeeds key
-    if successor != None and keyInRange(key, me.chord_id, successor.chord_id, inc_end=True):
-        # Build and send response
-        if msg is None:
-            msg = newMsgDict()                       
-        msg['suc_ip'] = successor.ip
-        sendCtrlMsg(target, c_msg.RETURN_SUCCESSOR, msg)
-    # Otherwise, send request to successor
-    else:
-        # Get node to send request to
-        if successor == None:
-            dst = tracker
-        elif using_finger_table:
-            dst = closestPreceedingNode(key) # TODO: if dst == me, we might have a problem
+    # Make sure our predecessor is alive and hand it any files that are its own
+    def checkPredecessor(self):
+        if self.predecessor == None:
+            return
+
+        # If we were waiting on a response from our predecessor and never got one, assume they died
+        if self.waitingForAlive(self.predecessor.ip) and self.predecessor.ip is not self.successor.ip:
+            self.myLogger.mnPrint("Our predecessor {0} has died!".format(self.predecessor))
+            self.waiting_for_alive_resp[self.predecessor.ip] = False
+            self.dead_nodes.add(self.predecessor.ip)
+            self.predecessor = None
         else:
-            dst = successor
+            # Check to see if the predecessor is still alive
+            self.waiting_for_alive_resp[self.predecessor.ip] = True
+            self.sendCtrlMsg(self.predecessor.ip, c_msg.CHECK_ALIVE, newMsgDict())
+            # Send any files that shouldn't be here to the predecessor
+            self.sendFilesToPred()
+
+    # Nodes should randomly leave/join the network or fail outright
+    def churn(self):
+        if self.is_tracker:
+            return
+        if bernoulli(self.leave_join_prob):
+            if self.inNetwork:
+                self.leave()
+            else:
+                self.join()
+        if bernoulli(self.fail_prob):
+            self.fail()
+
+    # Return if we are waiting for an alive response from the given ip
+    def waitingForAlive(self, ip):
+        return ip in self.waiting_for_alive_resp and self.waiting_for_alive_resp[ip]
+
+    # Join the network by finding out who your successor is
+    def join(self):
+        self.inNetwork = True
+        self.myLogger.mnPrint("Joining the network...")
+        self.lookup(self.me.chord_id, self.successorFound)
+
+    # Leave the network gracefully
+    def leave(self):
+        self.inNetwork = False
+        self.myLogger.mnPrint("Leaving the network...")
+
+        # Send all of our current files to our successor
+        if self.successor is not None:
+            with self.entries_lock:
+                moves = [(f, True) for f in self.entries.keys()]
+            self.migrate(self.successor.ip, moves, "leaving")
+
+        if self.successor is not None and self.predecessor is not None:
+            # Tell our successor we are leaving and pass them our predecessor
+            msg = newMsgDict()
+            msg['pred_ip'] = self.predecessor.ip
+            self.sendCtrlMsg(self.successor.ip, c_msg.LEAVING, msg)
 
-        # Build and send request
+            # Tell our predecessor we are leaving and pass them our successor
+            msg = newMsgDict()
+            msg['suc_ip'] = self.successor.ip
+            self.sendCtrlMsg(self.predecessor.ip, c_msg.LEAVING, msg)
+
+        self.successor = None
+        self.successor_list = []
+        self.predecessor = None
+
+    # Simulate this node crashing
+    def fail(self):
+        self.myLogger.mnPrint("Failing...")
+
+        self.inNetwork = False
+        self.predecessor = None
+        self.successor = None
+        self.successor_list = []
+
+    # Drop lookups that were never answered, the node they were routed through may have died
+    def expireRequests(self):
+        expired = self.lookups.expire()
+        if expired > 0:
+            self.myLogger.mnPrint("Expired {0} unanswered lookups".format(expired))
+        expired = self.migrations.expire()
+        if expired > 0:
+            self.myLogger.mnPrint("Expired {0} unacked file batches".format(expired))
+
+    def lookup(self, key, callback, msg=None, on_timeout=None):
+        '''
+        Start a find successor query for key on our own behalf
+        callback: called with the RETURN_SUCCESSOR message once it comes back
+        msg: message to carry along, e.g. the client request the lookup is for
+        on_timeout: called instead if no answer arrives within request_timeout
+        '''
         if msg is None:
-            msg = newMsgDict()       
-        msg['key'] = key
-        msg['target'] = target
-        sendCtrlMsg(dst.ip, c_msg.FIND_SUCCESSOR, msg)
-
-# Find the node in { {me} U finger_table } that preceeds the given key closest
-def closestPreceedingNode(key):
-    global finger_table, finger_table_size
-
-    # Starting at furthest point in table, moving closer, see if table entry preceeds the given key
-    for i in range(finger_table_size):
-        if keyInRange(finger_table[fingers[i]], me.chord_id, key):
-            return finger_table[fingers[i]]
-    
-    # Otherwise, we are the closest node we know of
-    return me
-
-# Given the returned predecessor of our successor, update if necessary and touch base with successor
-def stabilize(x):
-    global successor
-
-    if successor is None:
-        return
-
-    waiting_for_alive_resp[successor.ip] = False
-
-    # If x is closer than our current successor, it is our new successor
-    if x != None and keyInRange(x.chord_id, me.chord_id, successor.chord_id):
-        successor = x
-        waiting_for_alive_resp[successor.ip] = False
-        myLogger.mnPrint("Successor updated by stabilize: " + str(successor))
-
-    # Notify successor that we are its predecessor
-    msg = newMsgDict()
-    msg['pred_ip'] = me.ip
-    sendCtrlMsg(successor.ip, c_msg.NOTIFY_PREDECESSOR, msg)
-
-# Send all necessary files to our predecessor
-def sendFilesToPred():
-    for f, cn in list(entries.items()):
-        # For each chord_id for this file
-        k_count = 0
-        for k in cn.chord_id:
-            # Count if this key should belong to us
-            if keyInRange(k, predecessor.chord_id, me.chord_id, inc_end=True):
-                k_count += 1
-
-        # Send file to predecessor if none of the keys were for us
-        if k_count == 0:
-            myLogger.mnPrint("Transferring file ({0}) to predecessor ({1}) from file balancing".format(cn, predecessor))
             msg = newMsgDict()
-            msg['filename'] = f
-            sendFile(predecessor.ip, msg, readFromFile=True, rmEntry=True)
-
-# Node told us that it is our predecessor
-def notify(node):
-    global predecessor
-
-    # If the given id is between our current predecessor and us (or if we had no predecessor)
-    #   then set it to be our predecessor
-    if predecessor == None or keyInRange(node.chord_id, predecessor.chord_id, me.chord_id):
-        myLogger.mnPrint("Predecessor updated by notify: " + str(node))
-
-        # Transfer all necessary files to predecessor
-        for f, cn in list(entries.items()):
-            # For each chord_id for this file
-            k_count = 0
-            for k in cn.chord_id:
-                # Count if this key should move to the new predecessor
-                if predecessor is None:
-                    if keyInRange(k, me.chord_id, node.chord_id, inc_end=True):
-                        k_count += 1
-                elif keyInRange(k, predecessor.chord_id, node.chord_id, inc_end=True):
-                    k_count += 1
+        msg['lookup_id'] = self.lookups.add(callback, on_timeout)
+        self.findSuccessor(key, self.me.ip, msg)
+
+    # Find the ip of the chord node that should succeed the given key
+    def findSuccessor(self, key, target, msg=None):
+        # If key is somewhere between self and self.successor, then self.successor directly succeeds key
+        if self.successor != None and keyInRange(key, self.me.chord_id, self.successor.chord_id, inc_end=True):
+            # Build and send response
+            if msg is None:
+                msg = newMsgDict()
+            msg['suc_ip'] = self.successor.ip
+            self.sendCtrlMsg(target, c_msg.RETURN_SUCCESSOR, msg)
+        # Otherwise, send request to successor
+        else:
+            # Get node to send request to
+            if self.successor == None:
+                dst_ip = self.tracker.ip
+            else:
+                dst_ip = self.closestPreceedingNode(key)
 
-            # Send file to predecessor if necessary, rm this entry if all keys should go to predecessor
-            if k_count > 0:
-                myLogger.mnPrint("Transferring file ({0}) to new predecessor ({1}) from notify".format(cn, node))
+            # Build and send request
+            if msg is None:
                 msg = newMsgDict()
-                msg['filename'] = f
-                sendFile(node.ip, msg, readFromFile=True, rmEntry=(k_count==num_replicates))
+            msg['key'] = key
+            msg['target'] = target
+            self.sendCtrlMsg(dst_ip, c_msg.FIND_SUCCESSOR, msg)
+
+    # Find the ip of the live node in { successor_list U finger_table } that preceeds the given key closest
+    def closestPreceedingNode(self, key):
+        # Furthest live node of our successor list that preceeds the key, our successor by default
+        dst = self.successor
+        for node in self.successor_list:
+            if node.ip in self.dead_nodes:
+                continue
+            if not keyInRange(node.chord_id, self.me.chord_id, key):
+                break
+            dst = node
+
+        # A live finger may get us even closer
+        if self.using_finger_table:
+            index = self.finger_table.closestPreceding(key, dead=self.dead_nodes)
+            if index is not None and keyInRange(self.finger_table.node_ids[index], dst.chord_id, key):
+                return self.finger_table.ips[index]
+        return dst.ip
+
+    # Given the returned predecessor and successor list of our successor, update if necessary and touch base with successor
+    def stabilize(self, x, suc_list=None):
+        if self.successor is None:
+            return
+
+        self.waiting_for_alive_resp[self.successor.ip] = False
+
+        # Our successor's successors follow it in our list
+        successors = [self.successor]
+        if suc_list is not None:
+            successors += [self.chordNode(ip) for ip in suc_list if ip != self.me.ip and ip != self.successor.ip]
 
-        predecessor = node
-        waiting_for_alive_resp[predecessor.ip] = False
+        # If x is closer than our current successor, it is our new successor
+        if x != None and keyInRange(x.chord_id, self.me.chord_id, self.successor.chord_id):
+            self.successor = x
+            successors.insert(0, x)
+            self.successorChanged()
+            self.waiting_for_alive_resp[self.successor.ip] = False
+            self.myLogger.mnPrint("Successor updated by stabilize: " + str(self.successor))
 
-def fixFingers():
-    '''Refresh the finger table entries periodicially'''
-    global finger_table, finger_table_size
-   
-    for key in finger_table.keys():
+        self.successor_list = successors[:self.num_successors]
+
+        # Notify successor that we are its predecessor
         msg = newMsgDict()
-        msg["finger"] = key
-        findSuccessor(key, me.ip, msg)
+        msg['pred_ip'] = self.me.ip
+        self.sendCtrlMsg(self.successor.ip, c_msg.NOTIFY_PREDECESSOR, msg)
+
+    # Send all necessary files to our predecessor
+    def sendFilesToPred(self):
+        pred_id = self.predecessor.chord_id
+        with self.entries_lock:
+            if self.balanced_pred_id is None:
+                candidates = set(self.entries.keys())
+            else:
+                candidates = self.unbalanced
+                # Our range shrank, the keys between our old and new predecessor are no longer ours
+                if keyInRange(pred_id, self.balanced_pred_id, self.me.chord_id):
+                    candidates.update(self.key_index.filesIn(self.balanced_pred_id, pred_id))
+            self.balanced_pred_id = pred_id
+            self.unbalanced = set()
+
+            moves = []
+            for f in candidates:
+                cn = self.entries.get(f)
+                if cn is None:
+                    continue
+                # For each chord_id for this file
+                k_count = 0
+                for k in cn.chord_id:
+                    # Count if this key should belong to us
+                    if keyInRange(k, pred_id, self.me.chord_id, inc_end=True):
+                        k_count += 1
 
-# Send a file to a node
-def sendFile(dst_ip, msg, readFromFile=False, rmEntry=False):    
-    filename = msg['filename']
-    if readFromFile:
-        try:
-            with open(file_dir_path + filename) as f:
-                msg['content'] = f.read()
-        except IOError as e:
-            sendCtrlMsg(dst_ip, c_msg.ERR, msg)
-            myLogger.mnPrint("Error: {0} not found!".format(filename))
-            myLogger.mnPrint(e)
-            return
-    if rmEntry:
-        if filename in entries:
-            del entries[filename]
-            os.remove(file_dir_path + filename)
+                # Send file to predecessor if none of the keys were for us
+                if k_count == 0:
+                    moves.append((f, True))
+        if len(moves) > 0:
+            self.migrate(self.predecessor.ip, moves, "file balancing")
+
+    # Node told us that it is our predecessor
+    def notify(self, node):
+        # If the given id is between our current predecessor and us (or if we had no predecessor)
+        #   then set it to be our predecessor
+        if self.predecessor == None or keyInRange(node.chord_id, self.predecessor.chord_id, self.me.chord_id):
+            self.myLogger.mnPrint("Predecessor updated by notify: " + str(node))
+
+            # Transfer all necessary files to predecessor, those with keys that move to it
+            start_id = self.me.chord_id if self.predecessor is None else self.predecessor.chord_id
+            with self.entries_lock:
+                moves = self.key_index.filesIn(start_id, node.chord_id)
+            if len(moves) > 0:
+                # rm an entry if all its keys should go to predecessor
+                self.migrate(node.ip, [(f, k_count == self.num_replicates) for f, k_count in moves.items()], "notify")
+
+            self.predecessor = node
+            self.waiting_for_alive_resp[self.predecessor.ip] = False
+
+    def fixFingers(self):
+        '''Refresh the finger table entries periodicially, a few fingers per tick'''
+        fingers, self.next_finger = self.finger_table.refreshOrder(self.next_finger, self.fingers_per_refresh)
+        for index in fingers:
+            self.lookupFinger(index)
+
+    def lookupFinger(self, index):
+        '''Find the successor of a finger's start'''
+        self.lookup(self.finger_table.starts[index], lambda found: self.fingerFound(index, found['suc_ip']))
+
+    def fingerFound(self, index, suc_ip):
+        '''Fill in a finger once its lookup returns'''
+        # The same node also covers the following fingers up to its id
+        next_finger = self.finger_table.fill(index, self.chordNode(suc_ip).chord_id, suc_ip)
+        # Keep filling an incomplete table right away so joining nodes converge quickly
+        if next_finger < self.finger_table.size and self.finger_table.node_ids[next_finger] is None:
+            self.lookupFinger(next_finger)
+
+    # Our successor is also our first finger
+    def successorChanged(self):
+        if self.using_finger_table:
+            self.finger_table.fill(0, self.successor.chord_id, self.successor.ip)
+
+    # Send a file to a node
+    # The content is streamed over the data channel, SEND_FILE follows once the receiver has it
+    # If readFromFile is False the content is the client upload staged under msg['upload']
+    def sendFile(self, dst_ip, msg, readFromFile=False, rmEntry=False):
+        # Copy, the caller may reuse msg for the next file before the transfer completes
+        msg = dict(msg)
+        filename = msg['filename']
+        upload = None
+        if readFromFile:
+            path = self.file_dir_path + filename
         else:
-            mnPrint(filename + " not found in entries")
-    myLogger.mnPrint("Sending " + filename + " to " + dst_ip)
-    sendCtrlMsg(dst_ip, c_msg.SEND_FILE, msg)
-
-def print_entries():
-    global entries
-    if len(entries.keys()) == 0:
-        return "{}"
-    entries_str = "{"
-    for key,value in entries.items():
-        entries_str += "{0}:{1};".format(key,value.chord_id)
-    entries_str = entries_str[:-1] + "}"
-    return entries_str
+            with self.entries_lock:
+                upload = self.uploads.get(msg['upload'])
+            path = None if upload is None else upload[0]
+        if path is None or not os.path.isfile(path):
+            self.sendCtrlMsg(dst_ip, c_msg.ERR, msg)
+            self.myLogger.mnPrint("Error: {0} not found!".format(filename))
+            if upload is not None:
+                self.releaseUpload(msg['upload'])
+            return
+
+        # Decide whether our copy goes away once it has been sent
+        fileNode = None
+        record = None
+        cleanup = False
+        if rmEntry:
+            with self.entries_lock:
+                if filename in self.entries:
+                    record = self.meta.get(filename)
+                    fileNode = self.removeEntry(filename)
+                    cleanup = True
+            if fileNode is None:
+                self.myLogger.mnPrint(filename + " not found in entries")
+
+        msg['transfer'] = self.transport.newHandle()
+        msg['size'] = os.path.getsize(path)
+        msg['content'] = None
+
+        def transferDone(sent):
+            if sent:
+                # Unless a new copy of the file came back to us, or an unacked batch still needs ours
+                with self.entries_lock:
+                    if cleanup and filename not in self.entries and filename not in self.handoffs and os.path.exists(path):
+                        os.remove(path)
+                self.sendCtrlMsg(dst_ip, c_msg.SEND_FILE, msg)
+            else:
+                self.myLogger.mnPrint("Error: could not send {0} to {1}".format(filename, dst_ip))
+                # Keep our copy rather than lose the file
+                if fileNode is not None:
+                    with self.entries_lock:
+                        self.holdEntry(filename, fileNode)
+                        if record is not None:
+                            self.meta.add(filename, *record)
+            # Replicas are sent in parallel, the staged upload goes once the last of them is done with it
+            if upload is not None:
+                self.releaseUpload(msg['upload'])
+
+        self.myLogger.mnPrint("Sending " + filename + " to " + dst_ip)
+        # Copies of our files may come from the content cache, files leaving us are not worth caching
+        content = None
+        if readFromFile and not cleanup and self.content_cache.admits(msg['size']):
+            content = self.content_cache.get(filename)
+            if content is None:
+                # Read a miss into the cache away from the control path, and send it once read
+                self.transport.offload(lambda: self.readContent(filename, path),
+                    lambda content: self.transport.sendData(dst_ip, msg['transfer'], path, transferDone, content))
+                return
+        self.transport.sendData(dst_ip, msg['transfer'], path, transferDone, content)
+
+    def migrate(self, dst_ip, moves, reason):
+        '''
+        Hand files over to dst_ip in batches streamed from disk over the data channel, a few at a time,
+        files too large to share a batch are sent in batches of their own
+        moves: (filename, remove) pairs, remove drops our copy once the batch it is in is acked
+        reason: why the files move, for the log
+        '''
+        # Our own files stay where they are
+        if dst_ip == self.me.ip:
+            return
+
+        files = []
+        removes = set()
+        for filename, remove in moves:
+            path = self.file_dir_path + filename
+            if not os.path.isfile(path):
+                self.myLogger.mnPrint("Error: {0} not found!".format(filename))
+                continue
+            files.append((filename, os.path.getsize(path)))
+            if remove:
+                removes.add(filename)
+
+        batches = planBatches(files)
+        self.myLogger.mnPrint("Transferring {0} files to {1} in {2} batches from {3}".format(len(files), dst_ip, len(batches), reason))
+        # Each batch that is done starts the next, so only BATCHES_IN_FLIGHT are on their way at once
+        batches = iter(batches)
+        def sendNext():
+            with self.entries_lock:
+                batch = next(batches, None)
+            if batch is not None:
+                self.sendBatch(dst_ip, batch, [filename for filename, size in batch if filename in removes], sendNext)
+        for i in range(BATCHES_IN_FLIGHT):
+            sendNext()
+
+    def sendBatch(self, dst_ip, batch, removes, done):
+        '''
+        Send one batch of files, the entries in removes stop being ours right away but their
+        copies are only deleted once dst_ip acks the batch, and restored if it never does
+        done: called once the batch is acked or given up on
+        '''
+        # Size the batch while its files are still our entries, nothing deletes those
+        manifest, files = batchManifest(self.file_dir_path, batch)
+        if len(files) == 0:
+            done()
+            return
+
+        removed = []
+        with self.entries_lock:
+            for filename in removes:
+                if filename in self.entries:
+                    record = self.meta.get(filename)
+                    removed.append((filename, record, self.removeEntry(filename)))
+                    self.handoffs[filename] = self.handoffs.get(filename, 0) + 1
+
+        def release(restore):
+            with self.entries_lock:
+                for filename, record, fileNode in removed:
+                    pending = self.handoffs.pop(filename) - 1
+                    if pending > 0:
+                        self.handoffs[filename] = pending
+                    if restore:
+                        self.holdEntry(filename, fileNode)
+                        if record is not None:
+                            self.meta.add(filename, *record)
+                    # Unless the file came back to us or another unacked batch still needs our copy
+                    elif pending == 0 and filename not in self.entries:
+                        path = self.file_dir_path + filename
+                        if os.path.exists(path):
+                            os.remove(path)
+
+        msg = newMsgDict()
+        msg['transfer'] = self.transport.newHandle()
+        msg['size'] = len(manifest) + sum(size for path, size in files)
+
+        def batchAcked(ack):
+            release(restore=False)
+            self.myLogger.mnPrint("{0} acked a batch of {1} files".format(dst_ip, len(files)))
+            done()
+
+        def batchTimedOut():
+            self.myLogger.mnPrint("Error: {0} never acked a batch of {1} files, keeping them".format(dst_ip, len(files)))
+            release(restore=True)
+            done()
+
+        def transferDone(sent):
+            if sent:
+                msg['req_id'] = self.migrations.add(batchAcked, batchTimedOut)
+                self.sendCtrlMsg(dst_ip, c_msg.MIGRATE, msg)
+            else:
+                self.myLogger.mnPrint("Error: could not send a batch of {0} files to {1}".format(len(files), dst_ip))
+                release(restore=True)
+                done()
+
+        self.transport.sendData(dst_ip, msg['transfer'], None, transferDone, manifest, files)
+
+    def readContent(self, filename, path):
+        '''Read one of our files into the content cache, returns its content or None if it could not be read'''
+        try:
+            with open(path, "rb") as f:
+                content = f.read()
+        except (IOError, OSError):
+            return None
+        self.content_cache.put(filename, content)
+        return content
+
+    def releaseUpload(self, handle):
+        '''
+        Give up one replica's claim on a staged client upload, once its transfer finished or its
+        lookup timed out, the staged file is deleted when no replica needs it anymore
+        '''
+        with self.entries_lock:
+            upload = self.uploads.get(handle)
+            if upload is None:
+                return
+            upload[1] -= 1
+            if upload[1] > 0:
+                return
+            del self.uploads[handle]
+        if os.path.exists(upload[0]):
+            os.remove(upload[0])
+
+    def print_entries(self):
+        with self.entries_lock:
+            entries = list(self.entries.items())
+        if len(entries) == 0:
+            return "{}"
+        entries_str = "{"
+        for key,value in entries:
+            entries_str += "{0}:{1};".format(key,value.chord_id)
+        entries_str = entries_str[:-1] + "}"
+        return entries_str
 
 def exit(arg=None):
     '''exit the application
     '''
     if arg is not None:
         sys.exit(arg)
-    sys.exit()     
+    sys.exit()
 
 if __name__ == "__main__":
-    # Default parameters
-    finger_table_size = 6
-    tracker_node_ip = "172.1.1.1"
-    control_port = 500
-    using_finger_table = False
-    num_replicates = 1
-    refresh_rate = 1
-    leave_join_prob = 0
-    fail_prob = 0
-
-    try:
-        # Open config file
-        configFile = open("chordDFS.config")
-        config = json.loads(configFile.read())
-        configFile.close()
-
-        # Load parameters from config file
-        finger_table_size = config['finger_table_size']
-        tracker_node_ip = config['tracker_node_ip']
-        control_port = config['control_port']
-        using_finger_table = config['using_finger_table']
-        num_replicates = config['num_replicates']
-        refresh_rate = config['refresh_rate']
-        leave_join_prob = config['leave_join_prob']
-        fail_prob = config['fail_prob']
-    except:
-        pass
-
-    # Ring size is relative to finger table size s.t.
-    #   the last entry on the finger table will cross half the ring
-    ring_size = 2**finger_table_size # m
-
     # Pass in self as ip (getpeername gets localhost as ip)
-    my_ip = ""
-    my_name = ""
     if len(sys.argv) < 3:
-        myLogger.mnPrint("Missing self ip and name!")
+        print("Missing self ip and name!")
+        sys.stdout.flush()
         exit()
     my_ip = sys.argv[1]
     my_name = sys.argv[2]
-    me = ChordNode(my_ip, name=my_name)
-
-    # Set relative file paths
-    log_file_path = "nodes/{0}/logs/{1}.log".format(me.name, me.ip.replace(".", "_"))
-    node_directory = "nodes/" + me.name    
-    file_dir_path = node_directory + "/files/chord/"    
-
-    # Get tracker based on ip from config
-    tracker = ChordNode(tracker_node_ip)
-
-    # If we are the tracker node
-    is_tracker = me.ip == tracker_node_ip
-
-    # create logger
-    myLogger = MyLogger(me.ip, me.chord_id, log_file_path)
 
-    # Announce initialization
-    myLogger.mnPrint("Hi! I'm a chord node, my IP is {0}, my chord_id is {1}, my name is {2}".format(me.ip, me.chord_id, me.name))
-    if is_tracker:
-        myLogger.mnPrint("Oh, and I'm the tracker!")
-    
-    # Socket specifically for communicating with other chord nodes
-    control_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    control_sock.bind((me.ip, control_port))
+    # Run on an asyncio event loop instead of select() plus a refresh thread (Python 3 only)
+    config = loadConfig()
+    transport = None
+    if config['event_loop'] == "asyncio":
+        from AsyncTransport import AsyncTransport
+        transport = AsyncTransport(my_ip, config['control_port'], config['data_port'], config['transfer_timeout'])
+
+    server = ChordServer(my_ip, my_name, config, transport)
+
+    # Log lines are buffered, write them out when mininet stops us
+    def terminate(signum, frame):
+        # A second signal must not interrupt the flush
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        flushLogs()
+        os._exit(0)
+    signal.signal(signal.SIGTERM, terminate)
+    signal.signal(signal.SIGHUP, terminate)
 
-    # Every file that we are responsible for (name->ChordNode)
-    entries = dict()
-
-    # Every file on the network, only used by tracker (name->ChordNode)
-    allFiles = dict()
-
-    # Maps filename to operation we want to perform when we find its location in the ring ('send' or 'request' or 'insert')
-    outstanding_file_reqs = dict()
-
-    # If we are waiting for a certain node to tell us that it is alive
-    waiting_for_alive_resp = dict()
-
-    # Predecessor is null by default
-    predecessor = None
-
-    # Tracker creates the network, and is thus its own successor
-    if is_tracker:
-        inNetwork = True
-        successor = me
     # Every other node is joining the network after the tracker
-    else:
+    if not server.is_tracker:
         time.sleep(1)
-        inNetwork = False
-        successor = None
-        # We want most nodes to join the network initially
-        if bernoulli(1 - leave_join_prob):
-            join()
-
-    # up to m entries; me.name + 2^i
-    if using_finger_table:
-        fingers = me.generate_fingers(finger_table_size)
-        finger_table = {key: None for key in fingers}
-        fixFingers()    
-
-    # Install timer to run processes
-    timer = threading.Thread(target=refresh)
-    timer.start()
-
-    # Multiplexing lists
-    rlist = [control_sock]
-    wlist = []
-    xlist = []
-
-    while True:
-        # Multiplex on possible network messages
-        try:
-            _rlist, _wlist, _xlist = select.select(rlist, wlist, xlist)
-        except:
-            continue
+    server.start()
 
-        if control_sock in _rlist:
-            ctrlMsgReceived()
+    # Serve forever
+    server.transport.run()
@@ -1,3 +1,7 @@
+import json
+import socket
+import struct
+
 class ChordMessage():
 	# Message types
 	FIND_SUCCESSOR = "FIND_SUCCESSOR"           # Propogate a find successor message
@@ -11,6 +15,8 @@ class ChordMessage():
 	REQUEST_FILE = "REQUEST_FILE"          	    # Request a file from a node (or client)
 	SOMEONE_DIED = "SOMEONE_DIED"				# Inform that we are aware of a node that has died
 	LEAVING = "LEAVING"							# Inform that we are leaving the network
+	MIGRATE = "MIGRATE"							# Hand a batch of files over to a node
+	MIGRATE_ACK = "MIGRATE_ACK"					# Confirm that a batch of files was stored
 
 	# Message types specific to Tracker/Client interactions
 	INSERT_FILE = "INSERT"						# Insert a file
@@ -19,6 +25,7 @@ class ChordMessage():
 	ERR = "ERR"									# Error
 	SUCCESS = "SUCCESS"							# Successful transaction
 	ENTRIES = "ENTRIES"							# Get entries node is responsible for
+	HOLDINGS = "HOLDINGS"						# Tell the tracker about files on the network
 
 	# Network file operations
 	OP_SEND_FILE = "SEND"
@@ -41,8 +48,194 @@ def newMsgDict():
 	msg['target'] = None
 	msg['pred_ip'] = None
 	msg['content'] = None
+	msg['transfer'] = None
+	msg['upload'] = None
+	msg['size'] = None
+	msg['suc_list'] = None
+	msg['req_id'] = None
+	msg['lookup_id'] = None
+	msg['replica'] = None
 	msg['hash'] = None
 	msg['dead_node'] = None
 	msg["file_list"] = None
 	msg["hops"] = 0
-	return msg
\ No newline at end of file
+	return msg
+
+# Wire format version of BinaryCodec, bump only when an existing field or type code changes
+#   meaning or encoding: new message types and fields are appended, and decode skips the
+#   fields it doesn't know, so nodes of different versions still understand each other
+WIRE_VERSION = 0xC1
+
+# Message types in the order of their binary type codes (0 is no type)
+MSG_TYPES = [None, ChordMessage.FIND_SUCCESSOR, ChordMessage.RETURN_SUCCESSOR, ChordMessage.GET_PREDECESSOR,
+			ChordMessage.RETURN_PREDECESSOR, ChordMessage.NOTIFY_PREDECESSOR, ChordMessage.CHECK_ALIVE,
+			ChordMessage.AM_ALIVE, ChordMessage.SEND_FILE, ChordMessage.REQUEST_FILE, ChordMessage.SOMEONE_DIED,
+			ChordMessage.LEAVING, ChordMessage.INSERT_FILE, ChordMessage.GET_FILE, ChordMessage.GET_FILE_LIST,
+			ChordMessage.ERR, ChordMessage.SUCCESS, ChordMessage.ENTRIES,
+			ChordMessage.HOLDINGS, ChordMessage.MIGRATE, ChordMessage.MIGRATE_ACK]
+MSG_TYPE_CODES = dict((msg_type, code) for code, msg_type in enumerate(MSG_TYPES))
+
+# Field encodings
+FIELD_IP = 0		# ipv4 address, 4 bytes
+FIELD_INT = 1		# unsigned 32 bit int
+FIELD_LONG = 2		# unsigned 64 bit int
+FIELD_STR = 3		# utf-8 string, 16 bit length
+FIELD_BLOB = 4		# utf-8 string, 32 bit length
+FIELD_STR_LIST = 5	# list of utf-8 strings, 16 bit count
+FIELD_IP_LIST = 6	# list of ipv4 addresses, 8 bit count
+
+# Optional message fields, a field's index is its bit in the header's field mask
+MSG_FIELDS = [('filename', FIELD_STR), ('finger', FIELD_INT), ('client_ip', FIELD_IP), ('suc_ip', FIELD_IP),
+			('key', FIELD_INT), ('target', FIELD_IP), ('pred_ip', FIELD_IP), ('content', FIELD_BLOB),
+			('hash', FIELD_INT), ('dead_node', FIELD_IP), ('file_list', FIELD_STR_LIST), ('transfer', FIELD_STR),
+			('upload', FIELD_STR), ('size', FIELD_LONG), ('suc_list', FIELD_IP_LIST),
+			('req_id', FIELD_INT), ('lookup_id', FIELD_INT), ('replica', FIELD_INT)]
+
+# version, type code, field mask, hops
+MSG_HEADER = struct.Struct("!BBIH")
+UINT8 = struct.Struct("!B")
+UINT16 = struct.Struct("!H")
+UINT32 = struct.Struct("!I")
+UINT64 = struct.Struct("!Q")
+
+class JsonCodec():
+	'''Original wire format, the message dict as a JSON object'''
+	name = "json"
+
+	def encode(self, msg):
+		return json.dumps(msg).encode("utf-8")
+
+	def decode(self, data):
+		return json.loads(data.decode("utf-8"))
+
+class BinaryCodec():
+	'''
+	Compact wire format, a struct packed header followed by only the fields that are set
+	Also decodes JSON datagrams so nodes using either codec can talk to each other
+	'''
+	name = "binary"
+
+	def __init__(self):
+		self.json_codec = JsonCodec()
+		# Interned ip strings and their packed form
+		self.ip_strs = dict()
+		self.ip_bytes = dict()
+
+	def encode(self, msg):
+		mask = 0
+		body = []
+		for bit, (field, kind) in enumerate(MSG_FIELDS):
+			value = msg.get(field)
+			if value is None:
+				continue
+			mask |= 1 << bit
+			if kind == FIELD_IP:
+				body.append(self.pack_ip(value))
+			elif kind == FIELD_INT:
+				body.append(UINT32.pack(value))
+			elif kind == FIELD_LONG:
+				body.append(UINT64.pack(value))
+			elif kind == FIELD_STR:
+				value = to_bytes(value)
+				body.append(UINT16.pack(len(value)) + value)
+			elif kind == FIELD_BLOB:
+				value = to_bytes(value)
+				body.append(UINT32.pack(len(value)) + value)
+			elif kind == FIELD_STR_LIST:
+				value = [to_bytes(v) for v in value]
+				body.append(UINT16.pack(len(value)))
+				body.extend(UINT16.pack(len(v)) + v for v in value)
+			elif kind == FIELD_IP_LIST:
+				body.append(UINT8.pack(len(value)))
+				body.extend(self.pack_ip(v) for v in value)
+		header = MSG_HEADER.pack(WIRE_VERSION, MSG_TYPE_CODES[msg['msg_type']], mask, msg.get('hops', 0))
+		return header + b"".join(body)
+
+	def decode(self, data):
+		if data[:1] == b"{":
+			return self.json_codec.decode(data)
+		version, type_code, mask, hops = MSG_HEADER.unpack_from(data, 0)
+		if version != WIRE_VERSION:
+			raise ValueError("unsupported wire version {0}".format(version))
+		if type_code >= len(MSG_TYPES):
+			raise ValueError("unknown message type code {0}".format(type_code))
+		msg = newMsgDict()
+		msg['msg_type'] = MSG_TYPES[type_code]
+		msg['hops'] = hops
+		offset = MSG_HEADER.size
+		bit = 0
+		while mask:
+			# Fields are serialized in bit order, so the fields of newer nodes come after every one we know
+			if bit == len(MSG_FIELDS):
+				break
+			if mask & 1:
+				field, kind = MSG_FIELDS[bit]
+				if kind == FIELD_IP:
+					value = self.unpack_ip(take(data, offset, 4))
+					offset += 4
+				elif kind == FIELD_INT:
+					value = UINT32.unpack_from(data, offset)[0]
+					offset += UINT32.size
+				elif kind == FIELD_LONG:
+					value = UINT64.unpack_from(data, offset)[0]
+					offset += UINT64.size
+				elif kind == FIELD_STR:
+					value, offset = unpack_str(data, offset, UINT16)
+				elif kind == FIELD_BLOB:
+					value, offset = unpack_str(data, offset, UINT32)
+				elif kind == FIELD_STR_LIST:
+					count = UINT16.unpack_from(data, offset)[0]
+					offset += UINT16.size
+					value = []
+					for i in range(count):
+						v, offset = unpack_str(data, offset, UINT16)
+						value.append(v)
+				elif kind == FIELD_IP_LIST:
+					count = UINT8.unpack_from(data, offset)[0]
+					offset += UINT8.size
+					value = []
+					for i in range(count):
+						value.append(self.unpack_ip(take(data, offset, 4)))
+						offset += 4
+				msg[field] = value
+			mask >>= 1
+			bit += 1
+		return msg
+
+	def pack_ip(self, ip):
+		packed = self.ip_bytes.get(ip)
+		if packed is None:
+			packed = socket.inet_aton(ip)
+			self.ip_bytes[ip] = packed
+		return packed
+
+	def unpack_ip(self, packed):
+		ip = self.ip_strs.get(packed)
+		if ip is None:
+			ip = socket.inet_ntoa(packed)
+			self.ip_strs[packed] = ip
+		return ip
+
+CODECS = {JsonCodec.name: JsonCodec, BinaryCodec.name: BinaryCodec}
+
+def getCodec(name):
+	'''Get the codec Chord nodes and clients serialize control messages with'''
+	if name not in CODECS:
+		raise ValueError("unknown message codec {0}".format(name))
+	return CODECS[name]()
+
+def to_bytes(value):
+	if isinstance(value, bytes):
+		return value
+	return value.encode("utf-8")
+
+def take(data, offset, length):
+	'''length bytes of data from offset, raises ValueError if a truncated datagram ends before them'''
+	if offset + length > len(data):
+		raise ValueError("message truncated at byte {0}".format(len(data)))
+	return data[offset:offset + length]
+
+def unpack_str(data, offset, length_struct):
+	length = length_struct.unpack_from(data, offset)[0]
+	offset += length_struct.size
+	return take(data, offset, length).decode("utf-8"), offset + length
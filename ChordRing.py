@@ -0,0 +1,271 @@
+import bisect
+import hashlib
+import struct
+import threading
+from collections import OrderedDict
+
+# Node and file identities a process keeps hashed, each
+IDENTITY_CACHE_SIZE = 16384
+
+# Chord ids are the first 4 bytes of a SHA-1 digest
+HASH_PREFIX = struct.Struct("<L")
+
+# Determine if the given key is between the two given endpoints
+def keyInRange(key, start_id, end_id, inc_end=False):
+    # If endpoints are on same side of chord ring
+    if end_id > start_id:
+        return key > start_id and (key <= end_id if inc_end else key < end_id)
+    # If endpoints straddle the 0 point of the chord ring (or are equal)
+    else:
+        return key > start_id or (key <= end_id if inc_end else key < end_id)
+
+# Represents any object that has a place on the Chord ring
+class ChordNode:
+    def __init__(self, key, ring_size, name="", isFile=False, num_replicates=1, chord_id=None):
+        # Chord Nodes can be used for network nodes or files
+        self.ip = key
+        self.filename = key
+        self.name = name
+
+        # Use hash to find position on ring, unless the caller already hashed the key
+        if chord_id is not None:
+            self.chord_id = chord_id
+        elif isFile:
+            self.chord_id = [h % ring_size for h in get_hash(key, numHashes=num_replicates)]
+        else:
+            self.chord_id = get_hash(key)[0] % ring_size
+
+    def __str__(self):
+        if self.name == "":
+            return "key: {0}, chord id: {1}".format(self.ip, self.chord_id)
+        return "key: {0}, name: {1}, chord id: {2}".format(self.ip, self.name, self.chord_id)
+
+# Get the hash of a key
+def get_hash(key, numHashes=1):
+    return get_hashes([key], numHashes)[0]
+
+# Get the hashes of many keys at once
+def get_hashes(keys, numHashes=1):
+    unpack = HASH_PREFIX.unpack_from
+    hashes = []
+    for key in keys:
+        data = key.encode()
+        hash_func = hashlib.sha1()
+        hashList = []
+        for i in range(numHashes):
+            # Update with key and keep first 4 bytes
+            hash_func.update(data)
+            hashList.append(unpack(hash_func.digest())[0])
+        hashes.append(hashList)
+    return hashes
+
+class IdentityCache():
+    '''
+    ChordNodes of the nodes and files of a ring by key, reused instead of hashing the key again,
+    least recently used evicted past max_entries
+    ring_size: size of the chord ring
+    num_replicates: chord ids of each file
+    '''
+    def __init__(self, ring_size, num_replicates, max_entries=IDENTITY_CACHE_SIZE):
+        self.ring_size = ring_size
+        self.num_replicates = num_replicates
+        self.max_entries = max_entries
+        # (key, isFile)->ChordNode, least recently used first
+        self.identities = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.identities)
+
+    def __str__(self):
+        return "identities:{0}, hits:{1}, misses:{2}".format(len(self.identities), self.hits, self.misses)
+
+    def node(self, ip):
+        return self.get(ip, False)
+
+    def file(self, filename):
+        return self.get(filename, True)
+
+    def get(self, key, isFile):
+        with self.lock:
+            identity = self.identities.pop((key, isFile), None)
+            if identity is not None:
+                self.identities[(key, isFile)] = identity
+                self.hits += 1
+                return identity
+        return self.lookup([key], isFile)[0]
+
+    def files(self, filenames):
+        '''ChordNodes of many files, hashing the ones not cached in one batch'''
+        return self.lookup(filenames, True)
+
+    def lookup(self, keys, isFile):
+        found = []
+        missing = []
+        with self.lock:
+            for key in keys:
+                identity = self.identities.pop((key, isFile), None)
+                if identity is None:
+                    missing.append(key)
+                else:
+                    self.identities[(key, isFile)] = identity
+                found.append(identity)
+            self.hits += len(keys) - len(missing)
+            self.misses += len(missing)
+        if len(missing) == 0:
+            return found
+
+        hashes = get_hashes(missing, self.num_replicates if isFile else 1)
+        hashed = dict()
+        for key, hashList in zip(missing, hashes):
+            chord_id = [h % self.ring_size for h in hashList] if isFile else hashList[0] % self.ring_size
+            hashed[key] = ChordNode(key, self.ring_size, isFile=isFile, chord_id=chord_id)
+        with self.lock:
+            for key, identity in hashed.items():
+                self.identities[(key, isFile)] = identity
+            while len(self.identities) > self.max_entries:
+                self.identities.popitem(last=False)
+        return [hashed[key] if identity is None else identity for key, identity in zip(keys, found)]
+
+class FingerTable():
+    '''
+    Finger table of a chord node, kept as preallocated parallel arrays indexed by finger
+    chord_id: chord id of the node owning the table
+    size: number of fingers (m)
+    ring_size: size of the chord ring (2**m)
+    '''
+    def __init__(self, chord_id, size, ring_size):
+        self.chord_id = chord_id
+        self.size = size
+        self.ring_size = ring_size
+
+        # Finger i covers the keys starting at chord_id + 2^i
+        self.starts = [(chord_id + 2**i) % ring_size for i in range(size)]
+        self.node_ids = [None] * size
+        self.ips = [None] * size
+        # Clockwise distance from us to each finger's node, 0 while unknown
+        self.offsets = [0] * size
+        # Offsets of a complete, consistent table never decrease, which lets lookups bisect
+        self.monotone = False
+
+    def __str__(self):
+        text = "\n"
+        for i in range(self.size):
+            text += "N{0} + {1}: {2}\n".format(self.chord_id, 2**i, self.ips[i])
+        return text
+
+    def fill(self, index, node_id, ip):
+        '''
+        Point finger index at the node that succeeds its start, along with every following
+        finger whose start that node also succeeds (no node lies between those starts)
+        returns the index of the first finger that was left untouched
+        '''
+        node_offset = (node_id - self.chord_id) % self.ring_size
+        if node_offset == 0:
+            node_offset = self.ring_size
+        self.set(index, node_id, ip)
+        index += 1
+        while index < self.size and 2**index <= node_offset:
+            self.set(index, node_id, ip)
+            index += 1
+        self.checkMonotone()
+        return index
+
+    def refreshOrder(self, start, count):
+        '''
+        Pick up to count fingers to look up, rotating from finger start
+        Fingers sharing a node with the finger before them are skipped, fill() refreshes
+        them along with that finger, and finger 0 is skipped once the successor has set it
+        returns the fingers to look up and the finger to start from next time
+        '''
+        picked = []
+        index = start % self.size
+        for step in range(self.size):
+            if len(picked) == count:
+                break
+            if index == 0:
+                shared = self.node_ids[0] is not None
+            else:
+                shared = self.node_ids[index] is not None and self.node_ids[index] == self.node_ids[index - 1]
+            if not shared:
+                picked.append(index)
+            index = (index + 1) % self.size
+        return picked, index
+
+    def set(self, index, node_id, ip):
+        self.node_ids[index] = node_id
+        self.ips[index] = ip
+        self.offsets[index] = (node_id - self.chord_id) % self.ring_size
+
+    def checkMonotone(self):
+        self.monotone = None not in self.node_ids and \
+            all(self.offsets[i] <= self.offsets[i + 1] for i in range(self.size - 1))
+
+    def closestPreceding(self, key, dead=()):
+        '''
+        Find the finger whose node most closely precedes key, skipping nodes whose ip is in dead
+        returns the index of that finger, or None if no finger does
+        '''
+        # Distance from us to the key, the full ring if key is our own id
+        key_offset = (key - self.chord_id) % self.ring_size
+        if key_offset == 0:
+            key_offset = self.ring_size
+
+        # Bisect to the furthest finger short of the key, otherwise start from the furthest finger
+        if self.monotone:
+            index = bisect.bisect_left(self.offsets, key_offset) - 1
+        else:
+            index = self.size - 1
+
+        # Move inward past unknown and dead fingers, fingers pointing at ourselves precede nothing
+        while index >= 0:
+            if self.node_ids[index] is not None and 0 < self.offsets[index] < key_offset and self.ips[index] not in dead:
+                return index
+            index -= 1
+        return None
+
+class KeyIndex():
+    '''
+    Chord ids of the files a node holds, kept as one sorted array of (key, filename) pairs
+    so the files with keys in a range of the ring are found by bisection
+    '''
+    def __init__(self):
+        self.items = []
+
+    def __len__(self):
+        return len(self.items)
+
+    def add(self, filename, keys):
+        for key in keys:
+            bisect.insort(self.items, (key, filename))
+
+    def addFiles(self, files):
+        '''Add many (filename, keys) pairs at once, one sort instead of an insertion per key'''
+        for filename, keys in files:
+            self.items.extend((key, filename) for key in keys)
+        self.items.sort()
+
+    def remove(self, filename, keys):
+        for key in keys:
+            index = bisect.bisect_left(self.items, (key, filename))
+            if index < len(self.items) and self.items[index] == (key, filename):
+                del self.items[index]
+
+    def filesIn(self, start_id, end_id):
+        '''
+        Files with keys in the range (start_id, end_id] of the ring, wrapping past 0 like keyInRange
+        returns filename->how many of its keys are in the range
+        '''
+        # (key,) sorts before every (key, filename) pair
+        lo = bisect.bisect_left(self.items, (start_id + 1,))
+        hi = bisect.bisect_left(self.items, (end_id + 1,))
+        if end_id > start_id:
+            items = self.items[lo:hi]
+        else:
+            items = self.items[lo:] + self.items[:hi]
+        counts = dict()
+        for key, filename in items:
+            counts[filename] = counts.get(filename, 0) + 1
+        return counts
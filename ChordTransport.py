@@ -0,0 +1,209 @@
+import collections
+import heapq
+import os
+import select
+import socket
+import threading
+import time
+
+from DataChannel import CHUNK_SIZE, ChecksumWriter, DataChannel, partChunks
+
+class UdpTransport():
+    '''
+    Transport of a chord node running in its own process (one per Mininet host)
+    Control messages are UDP datagrams, file content goes over the TCP data channel
+    ip: ip of the node
+    control_port, data_port: ports every node listens on
+    transfer_timeout: seconds to wait on a peer during a file transfer
+    '''
+    def __init__(self, ip, control_port, data_port, transfer_timeout):
+        self.ip = ip
+        self.control_port = control_port
+        self.data_port = data_port
+        self.transfer_timeout = transfer_timeout
+        self.server = None
+
+    def attach(self, server):
+        '''Bind the node's sockets, called by the ChordServer using this transport
+        '''
+        self.server = server
+
+        # Socket specifically for communicating with other chord nodes
+        self.control_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.control_sock.bind((self.ip, self.control_port))
+
+        # Socket for streaming file content to and from other chord nodes and clients
+        self.data_channel = DataChannel(self.ip, self.data_port, server.staging_dir_path, server.myLogger, timeout=self.transfer_timeout, compression=server.compression)
+
+    def sendCtrl(self, dst_ip, data):
+        self.control_sock.sendto(data, (dst_ip, self.control_port))
+
+    def newHandle(self):
+        return self.data_channel.new_handle()
+
+    def sendData(self, dst_ip, handle, path, callback=None, content=None, files=None):
+        self.data_channel.send(dst_ip, handle, path, callback, content, files)
+
+    def claim(self, handle):
+        return self.data_channel.claim(handle)
+
+    def offload(self, fn, callback):
+        '''Call callback with the result of fn, file I/O the caller would rather not run on its event loop'''
+        callback(fn())
+
+    def schedule(self, delay, fn):
+        t = threading.Timer(delay, fn)
+        t.start()
+
+    def now(self):
+        return time.time()
+
+    def run(self):
+        '''Run the node's refresh thread and multiplex on its sockets forever
+        '''
+        timer = threading.Thread(target=self.refresh)
+        timer.start()
+
+        # Multiplexing lists
+        rlist = [self.control_sock, self.data_channel.listen_sock]
+        wlist = []
+        xlist = []
+
+        while True:
+            # Multiplex on possible network messages
+            try:
+                _rlist, _wlist, _xlist = select.select(rlist, wlist, xlist)
+            except:
+                continue
+
+            if self.control_sock in _rlist:
+                # Get data from socket
+                try:
+                    data, addr = self.control_sock.recvfrom(65535)
+                except socket.error as e:
+                    print(e)
+                    continue
+                self.server.ctrlMsgReceived(data, addr)
+
+            if self.data_channel.listen_sock in _rlist:
+                self.data_channel.accept()
+
+    def refresh(self):
+        while True:
+            self.server.refresh()
+            # Wait for short time
+            time.sleep(self.server.refresh_rate)
+
+class MemoryNetwork():
+    '''
+    In-process network for running many ChordServers in a single process
+    Time advances in rounds: every round each node runs one refresh tick and the
+    messages it causes are delivered before the next node's tick
+    '''
+    def __init__(self):
+        # Transports of every node on the network (ip->MemoryTransport)
+        self.transports = collections.OrderedDict()
+        # Control messages in flight (src ip, dst ip, data)
+        self.messages = collections.deque()
+        # Scheduled callbacks (time, sequence number, fn)
+        self.timers = []
+        self.timer_count = 0
+        self.now = 0.0
+        self.delivered = 0
+
+    def add(self, transport):
+        self.transports[transport.ip] = transport
+
+    def send(self, src_ip, dst_ip, data):
+        # Messages to unknown ips are lost, like datagrams to a dead host
+        if dst_ip in self.transports:
+            self.messages.append((src_ip, dst_ip, data))
+
+    def schedule(self, delay, fn):
+        self.timer_count += 1
+        heapq.heappush(self.timers, (self.now + delay, self.timer_count, fn))
+
+    def deliver(self):
+        '''Deliver messages until no more are in flight
+        '''
+        while self.messages:
+            src_ip, dst_ip, data = self.messages.popleft()
+            transport = self.transports[dst_ip]
+            self.delivered += 1
+            transport.server.ctrlMsgReceived(data, (src_ip, transport.control_port))
+
+    def step(self, refresh_rate):
+        '''Run one refresh round of refresh_rate seconds
+        '''
+        self.now += refresh_rate
+        while self.timers and self.timers[0][0] <= self.now:
+            heapq.heappop(self.timers)[2]()
+            self.deliver()
+        for transport in list(self.transports.values()):
+            transport.server.refresh()
+            self.deliver()
+
+class MemoryTransport():
+    '''
+    Transport of a chord node on a MemoryNetwork
+    Control messages are handed to the network, file content is copied between staging directories
+    '''
+    def __init__(self, network, ip, control_port=500):
+        self.network = network
+        self.ip = ip
+        self.control_port = control_port
+        self.server = None
+        self.handle_count = 0
+        # Completed incoming transfers (handle->(staged path, crc32 of the content))
+        self.completed = dict()
+
+    def attach(self, server):
+        self.server = server
+        self.staging_dir = server.staging_dir_path
+        if not os.path.exists(self.staging_dir):
+            os.makedirs(self.staging_dir)
+        self.network.add(self)
+
+    def sendCtrl(self, dst_ip, data):
+        self.network.send(self.ip, dst_ip, data)
+
+    def newHandle(self):
+        self.handle_count += 1
+        return "{0}_{1}".format(self.ip, self.handle_count)
+
+    def sendData(self, dst_ip, handle, path, callback=None, content=None, files=None):
+        dst = self.network.transports.get(dst_ip)
+        sent = dst is not None
+        if sent:
+            staged = os.path.join(dst.staging_dir, handle + ".part")
+            with open(staged, "wb") as f:
+                out = ChecksumWriter(f)
+                if files is not None:
+                    for chunk in partChunks(content, files):
+                        out.write(chunk)
+                elif content is not None:
+                    out.write(content)
+                else:
+                    with open(path, "rb") as source:
+                        for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+                            out.write(chunk)
+            dst.completed[handle] = (staged, out.checksum())
+        if callback is not None:
+            callback(sent)
+
+    def claim(self, handle):
+        return self.completed.pop(handle, (None, None))
+
+    def offload(self, fn, callback):
+        callback(fn())
+
+    def schedule(self, delay, fn):
+        self.network.schedule(delay, fn)
+
+    def now(self):
+        return self.network.now
+
+    def run(self):
+        '''Nothing to run, the MemoryNetwork drives every node
+        '''
+        pass
@@ -1,15 +1,52 @@
 import time
 import json
+import math
 import socket
 import select
+import struct
 import sys
 import os
 import fcntl
 import threading
 
-from ReadLog import MyLogger
+from ReadLog import MyLogger, PrettyMsg
+from DataChannel import DataChannel
 from ChordMessage import ChordMessage as c_msg
-from ChordMessage import newMsgDict
+from ChordMessage import newMsgDict, getCodec
+from RequestTable import RequestTable
+from LocationCache import LocationCache
+from Compression import Compression, loadDictionary
+from ChordRing import IdentityCache
+
+# Seconds between checks for requests that timed out
+EXPIRE_INTERVAL = 0.5
+# Seconds to wait on a cached owner before routing the get through the ring instead
+DIRECT_TIMEOUT = 1
+# Most ring members kept as entry points
+MAX_ENTRY_NODES = 32
+# Read modes, every replica sends its copy or replicas are asked one at a time
+READ_ALL = "all"
+READ_HEDGED = "hedged"
+
+class ClientRequest():
+    '''
+    A request made by the client, across all of its attempts
+    op: request type (INSERT, GET, LIST or ENTRIES)
+    args: arguments of the request
+    '''
+    def __init__(self, op, args):
+        self.op = op
+        self.args = args
+        self.start = time.time()
+        self.attempts = 0
+        # Responses to the current attempt, one per replica
+        self.acks = 0
+        self.errors = 0
+        # Cached owner a get was sent straight to, None once it is routed through the ring
+        self.owner = None
+        # Replicas a hedged get has asked in the current attempt, and the entry nodes it asked through
+        self.asked = 0
+        self.entries = []
 
 class Client():
     '''
@@ -27,7 +64,23 @@ class Client():
         # Default parameters    
         self.tracker_node_ip = "172.1.1.1"
         self.control_port = 500
-        self.retries = 0
+        self.data_port = 501
+        self.transfer_timeout = 10
+        self.msg_codec = "binary"
+        self.request_timeout = 10
+        self.max_retries = 3
+        self.num_replicates = 1
+        self.log_flush_interval = 0.5
+        self.log_events = False
+        self.location_ttl = 30
+        self.entry_nodes = []
+        self.entry_policy = "closest"
+        self.finger_table_size = 6
+        self.read_mode = READ_HEDGED
+        self.hedge_delay = 0.1
+        self.compress_level = 1
+        self.compress_min_bytes = 1024
+        self.compress_dict = None
 
         try:
             # Open config file
@@ -38,104 +91,354 @@ class Client():
             # Load parameters from config file        
             self.tracker_node_ip = config['tracker_node_ip']
             self.control_port = config['control_port']
+            self.data_port = config['data_port']
+            self.transfer_timeout = config['transfer_timeout']
+            self.msg_codec = config['msg_codec']
+            self.request_timeout = config.get('request_timeout', self.request_timeout)
+            self.max_retries = config.get('client_retries', self.max_retries)
+            self.num_replicates = config.get('num_replicates', self.num_replicates)
+            self.log_flush_interval = config.get('log_flush_interval', self.log_flush_interval)
+            self.log_events = config.get('log_events', self.log_events)
+            self.location_ttl = config.get('location_ttl', self.location_ttl)
+            self.entry_nodes = list(config.get('entry_nodes', self.entry_nodes))
+            self.entry_policy = config.get('entry_policy', self.entry_policy)
+            self.finger_table_size = config.get('finger_table_size', self.finger_table_size)
+            self.read_mode = config.get('read_mode', self.read_mode)
+            self.hedge_delay = config.get('hedge_delay', self.hedge_delay)
+            self.compress_level = config.get('compress_level', self.compress_level)
+            self.compress_min_bytes = config.get('compress_min_bytes', self.compress_min_bytes)
+            self.compress_dict = config.get('compress_dict', self.compress_dict)
             self.rate = config['client_rate']
 
         except:
             pass        
+        # serializes control messages
+        self.codec = getCodec(self.msg_codec)
         # file directory
         self.file_dir_path = "nodes/{0}/files/client/".format(self.name)    
         # logging
         log_file_path = "nodes/{0}/logs/{1}_c.log".format(self.name, self.ip.replace(".", "_"))
         # create logger
-        self.myLogger = MyLogger(self.ip, self.name, log_file_path, client=True)
+        self.myLogger = MyLogger(self.ip, self.name, log_file_path, client=True, flush_interval=self.log_flush_interval, events=self.log_events)
+        # file content is streamed over the data channel, compressed towards nodes that accept it
+        staging_dir_path = "nodes/{0}/files/staging/".format(self.name)
+        self.compression = Compression(self.compress_level, self.compress_min_bytes, loadDictionary(self.compress_dict))
+        self.data_channel = DataChannel(self.ip, self.data_port, staging_dir_path, self.myLogger, timeout=self.transfer_timeout, compression=self.compression)
+
+        # Attempts in flight by request id, every response carries the id of the attempt it answers
+        self.requests = RequestTable(self.request_timeout)
+        # Timeouts are checked often enough to hedge gets on time
+        self.expire_interval = EXPIRE_INTERVAL
+        if self.read_mode == READ_HEDGED:
+            self.expire_interval = min(EXPIRE_INTERVAL, self.hedge_delay / 2.0)
+        # Requests not yet finished, guarded by window
+        self.in_flight = 0
+        self.window = threading.Condition()
+        # Latencies of finished requests and number of failed requests by request type
+        self.latencies = dict()
+        self.failures = dict()
+        # Nodes known to hold each file, so gets of hot files skip the ring
+        self.locations = LocationCache(self.location_ttl)
+        # Ring members inserts and gets are sent to, bootstrapped from the config and grown by every
+        #   node that answers us, the tracker only handles LIST and ENTRIES
+        self.ring_size = 2**self.finger_table_size
+        # Ring positions of entry nodes and of the files we pick entry nodes for
+        self.identities = IdentityCache(self.ring_size, self.num_replicates)
+        self.entries_lock = threading.Lock()
+        self.entry_ids = dict()
+        for ip in self.entry_nodes or [self.tracker_node_ip]:
+            self.addEntryNode(ip)
+        self.next_entry = 0
 
         # Announce initialization
         self.myLogger.mnPrint("Hi! I'm a chord client, my IP is {0}".format(self.ip, self.name))        
+        self.myLogger.event("start")
 
     def __str__(self):
         return "ip: {0}, name: {1}\nlast: {2}".format(self.ip, self.name, self.last_request)
 
     '''Main Methods'''
-    def insert_file(self, filename):
+    def insert_file(self, filename, request=None):
         ''' Insert a file
         '''
-        self.last_request = [c_msg.INSERT_FILE, filename]
-        try:
-            with open(self.file_dir_path+filename) as f_in:
-                content = f_in.read()
-                msg = newMsgDict()
-                msg['filename'] = filename
-                msg['content'] = content
-                msg['client_ip'] = self.ip
-                msg["hops"] = 0
-                self.sendMessage(c_msg.INSERT_FILE, msg)                
-        except IOError as e:
-            self.myLogger.mnPrint("Error: last request:{0} failed!".format(self.last_request))
-            self.myLogger.mnPrint(e)
-
-    def get_file(self, filename):
+        request = self.track(c_msg.INSERT_FILE, [filename], request)
+        path = self.file_dir_path+filename
+        if not os.path.isfile(path):
+            self.myLogger.mnPrint("{0} not found".format(path))
+            self.finish(request, False)
+            return
+        msg = newMsgDict()
+        msg['filename'] = filename
+        msg['client_ip'] = self.ip
+        msg['transfer'] = self.data_channel.new_handle()
+        msg['size'] = os.path.getsize(path)
+        msg["hops"] = 0
+
+        # upload the content first, the entry node claims it when INSERT arrives
+        entry_ip = self.entryNode(filename)
+        def uploaded(sent):
+            if sent:
+                self.sendMessage(c_msg.INSERT_FILE, msg, request, dst_ip=entry_ip)
+            else:
+                self.removeEntryNode(entry_ip)
+                self.retry(request, "could not be uploaded")
+        self.data_channel.send(entry_ip, msg['transfer'], path, uploaded)
+
+    def get_file(self, filename, request=None):
         '''Request a file
         '''
-        self.last_request = [c_msg.GET_FILE,filename]    
+        request = self.track(c_msg.GET_FILE, [filename], request)
+        # Ask an owner we already know of directly, the tracker looks the file up otherwise
+        request.owner = self.locations.get(filename)
+        if request.owner is not None:
+            self.sendMessage(c_msg.REQUEST_FILE, self.getMsg(filename), request, dst_ip=request.owner, timeout=DIRECT_TIMEOUT)
+        else:
+            self.sendGet(request)
+
+    def sendGet(self, request, req_id=None):
+        '''
+        Route a get through an entry node
+        In hedged mode only the next replica is asked, and the one after it too if no copy arrived
+            within hedge_delay, and so on
+        req_id: attempt this is a further request of, a new attempt by default
+        '''
+        filename = request.args[0]
+        msg = self.getMsg(filename)
+        hedged = self.read_mode == READ_HEDGED
+        replica = 0
+        if hedged:
+            replica = msg['replica'] = request.asked
+            request.asked += 1
+        # Further requests go through other entry nodes, in case the first one is what is slow
+        entry_ip = self.entryNode(filename, replica, avoid=request.entries)
+        request.entries.append(entry_ip)
+        self.sendMessage(c_msg.GET_FILE, msg, request, dst_ip=entry_ip, req_id=req_id)
+        if hedged and request.asked < self.num_replicates:
+            self.requests.add(None, lambda: self.hedge(request, msg['req_id']), self.hedge_delay)
+
+    def hedge(self, request, req_id):
+        '''The replicas asked so far are slow, ask another unless a copy already arrived
+        '''
+        if req_id in self.requests and request.asked < self.num_replicates:
+            self.myLogger.mnPrint("Hedging get of {0} to replica {1}".format(request.args[0], request.asked))
+            self.sendGet(request, req_id)
+
+    def getMsg(self, filename):
         msg = newMsgDict()
         msg['filename'] = filename
         msg["client_ip"] = self.ip
         msg["hops"] = 0
-        self.sendMessage(c_msg.GET_FILE, msg)    
-        
+        return msg
 
-    def get_file_list(self):
+    def routeGet(self, request, reason):
+        '''A get sent to a cached owner failed, forget the owner and look the file up through the tracker
+        '''
+        filename = request.args[0]
+        self.myLogger.mnPrint("Cached owner {0} of {1} {2}, routing the get".format(request.owner, filename, reason))
+        self.locations.invalidate(filename, request.owner)
+        request.owner = None
+        request.errors = 0
+        request.asked = 0
+        request.entries = []
+        self.sendGet(request)
+
+    def entryNode(self, filename, replica=0, avoid=()):
+        '''
+        Ring member to send an operation on filename to
+        round_robin spreads operations evenly, closest picks the known node nearest after the key of
+            the file's replica, which likely holds it so the lookups take few hops
+        avoid: nodes not to pick unless there is no other
+        '''
+        with self.entries_lock:
+            entry_ids = dict(self.entry_ids)
+            for ip in avoid:
+                if len(entry_ids) > 1:
+                    entry_ids.pop(ip, None)
+            self.next_entry = (self.next_entry + 1) % len(entry_ids)
+            next_entry = self.next_entry
+        if self.entry_policy == "round_robin":
+            return sorted(entry_ids.keys())[next_entry]
+        keys = self.identities.file(filename).chord_id
+        key = keys[replica % len(keys)]
+        return min(entry_ids.keys(), key=lambda ip: (entry_ids[ip] - key) % self.ring_size)
+
+    def addEntryNode(self, ip):
+        with self.entries_lock:
+            if ip not in self.entry_ids and len(self.entry_ids) < MAX_ENTRY_NODES:
+                self.entry_ids[ip] = self.identities.node(ip).chord_id
+
+    def removeEntryNode(self, ip):
+        '''Stop using a node that failed us, unless it is the last one we know'''
+        with self.entries_lock:
+            if ip in self.entry_ids and len(self.entry_ids) > 1:
+                del self.entry_ids[ip]
+
+    def get_file_list(self, request=None):
         '''Request available files
         '''
-        self.last_request = [c_msg.GET_FILE_LIST]    
+        request = self.track(c_msg.GET_FILE_LIST, [], request)
         msg = newMsgDict()        
         msg["client_ip"] = self.ip
         msg["hops"] = 0
-        self.sendMessage(c_msg.GET_FILE_LIST, msg)
+        self.sendMessage(c_msg.GET_FILE_LIST, msg, request)
 
-    def entries(self):
+    def entries(self, request=None):
         '''Tell server to write entries to log
         '''
-        self.last_request = [c_msg.ENTRIES]    
+        request = self.track(c_msg.ENTRIES, [], request)
         msg = newMsgDict()        
         msg["client_ip"] = self.ip
         msg["hops"] = 0
-        self.sendMessage(c_msg.ENTRIES, msg)
+        self.sendMessage(c_msg.ENTRIES, msg, request)
         
 
     '''Helper methods'''
-    def processRequest(self, request, args=None):
+    def processRequest(self, request, args=None, retrying=None):
         '''
         process a request
         request: the request to process
         arg: arg for request
+        retrying: ClientRequest this is another attempt of
         '''
+        self.last_request = [request, args]
         self.myLogger.mnPrint("received request: {0}:{1}".format(request, args))        
         if request == c_msg.GET_FILE:
-            self.get_file(args[0])
+            self.get_file(args[0], retrying)
         elif request == c_msg.INSERT_FILE:
-            self.insert_file(args[0])            
+            self.insert_file(args[0], retrying)            
         elif request == c_msg.GET_FILE_LIST:
-            self.get_file_list()
+            self.get_file_list(retrying)
         elif request == c_msg.ENTRIES:
-            self.entries()            
+            self.entries(retrying)            
         elif request == "LS":
             self.list_dir()        
 
-    def sendMessage(self, msg_type, msg):
+    def track(self, op, args, request=None):
+        '''Start a new request, or the next attempt of one being retried
+        '''
+        if request is None:
+            request = ClientRequest(op, args)
+            with self.window:
+                self.in_flight += 1
+        request.attempts += 1
+        request.acks = 0
+        request.errors = 0
+        request.asked = 0
+        request.entries = []
+        return request
+
+    def waitForWindow(self, size):
+        '''Block until fewer than size requests are in flight
+        '''
+        with self.window:
+            while self.in_flight >= size:
+                self.window.wait()
+
+    def responseReceived(self, request, msg):
+        '''The current attempt of request was answered with msg
+        returns False while more responses to the attempt are expected
+        '''
+        if msg['msg_type'] == c_msg.ERR:
+            # The cached owner no longer has the file
+            if request.owner is not None:
+                self.routeGet(request, "does not have it")
+                return
+            # A get only fails once no replica has the file
+            request.errors += 1
+            if request.op == c_msg.GET_FILE and self.read_mode == READ_HEDGED:
+                # Ask the next replica right away, or wait for the others already asked
+                if request.asked < self.num_replicates:
+                    self.sendGet(request, msg['req_id'])
+                    return False
+                if request.errors < request.asked:
+                    return False
+            elif request.op == c_msg.GET_FILE and request.errors < self.num_replicates:
+                return False
+            self.retry(request, "failed")
+        else:
+            # An insert is done once every replica has been stored
+            request.acks += 1
+            if request.op == c_msg.INSERT_FILE and request.acks < self.num_replicates:
+                return False
+            self.finish(request, True)
+
+    def retry(self, request, reason):
+        '''Try request again, unless it is out of attempts
+        '''
+        self.myLogger.mnPrint("Error: request {0}:{1} {2}!".format(request.op, request.args, reason))
+        if request.attempts > self.max_retries:
+            self.finish(request, False)
+            return
+        self.myLogger.mnPrint("Retrying attempt: {0}".format(request.attempts))
+        self.processRequest(request.op, request.args, request)
+
+    def finish(self, request, succeeded):
+        '''Account for a finished request and open its slot in the window
+        '''
+        latency = time.time() - request.start
+        # Log before opening the slot, the script may print its stats as soon as the window empties
+        self.myLogger.event("done" if succeeded else "failed", msg=request.op, attempts=request.attempts, latency=1000 * latency)
+        if succeeded:
+            self.myLogger.mnPrint("Success: request {0}:{1} succeeded in {2:.1f} ms!".format(request.op, request.args, 1000 * latency))
+        else:
+            self.myLogger.mnPrint("Error: request {0}:{1} failed after {2} attempts!".format(request.op, request.args, request.attempts))
+        with self.window:
+            if succeeded:
+                self.latencies.setdefault(request.op, []).append(latency)
+            else:
+                self.failures[request.op] = self.failures.get(request.op, 0) + 1
+            self.in_flight -= 1
+            self.window.notify_all()
+
+    def printStats(self, elapsed):
+        '''Print throughput and latency percentiles per request type
+        '''
+        header = "{0:<8}{1:>8}{2:>8}{3:>10}{4:>10}{5:>10}{6:>10}"
+        row = "{0:<8}{1:>8}{2:>8}{3:>10.2f}{4:>10}{5:>10}{6:>10}"
+        lines = [header.format("op", "done", "failed", "req/s", "p50 ms", "p95 ms", "p99 ms")]
+        with self.window:
+            ops = sorted(set(self.latencies.keys()) | set(self.failures.keys()))
+            for op in ops:
+                latencies = sorted(self.latencies.get(op, []))
+                lines.append(row.format(op, len(latencies), self.failures.get(op, 0), len(latencies) / elapsed,
+                    *[formatMs(percentile(latencies, p)) for p in (50, 95, 99)]))
+            done = sum(len(latencies) for latencies in self.latencies.values())
+            failed = sum(self.failures.values())
+        lines.append(row.format("total", done, failed, done / elapsed, "", "", ""))
+        lines.append("location cache: {0}".format(self.locations))
+        lines.append("compression: {0}".format(self.compression))
+        self.myLogger.mnPrint("Requests over {0:.2f} sec:\n{1}".format(elapsed, "\n".join(lines)))
+
+    def sendMessage(self, msg_type, msg, request, dst_ip=None, timeout=None, req_id=None):
         '''Send message to tracker node
+        request: ClientRequest this message is an attempt of
+        dst_ip: node to send to instead of the tracker
+        timeout: seconds to wait for a response, request_timeout by default
+        req_id: attempt already in flight this message belongs to, a new attempt by default
         '''
+        if dst_ip is None:
+            dst_ip = self.tracker_node_ip
         # Include the type of message this is
         msg['msg_type'] = msg_type
-
-        # Serialize the message
-        msg_json = json.dumps(msg)
-        if sys.version_info[0] >= 3:
-            msg_json = bytes(msg_json, encoding="utf-8")
-
-        # Send the message to the destination's control port
-        self.control_sock.sendto(msg_json, (self.tracker_node_ip, self.control_port))
-        self.myLogger.mnPrint("msg type:{0} sent to {1}: msg:{2}".format(msg_type, self.tracker_node_ip, self.myLogger.pretty_msg(msg)))
+        # Responses to this attempt carry its id, an attempt that is never answered is retried,
+        #   or routed if it went to a cached owner
+        if req_id is None:
+            if request.owner is not None:
+                on_timeout = lambda: self.routeGet(request, "timed out")
+            else:
+                on_timeout = lambda: self.entryTimedOut(request, dst_ip)
+            req_id = self.requests.add(lambda response: self.responseReceived(request, response), on_timeout, timeout)
+        msg['req_id'] = req_id
+
+        # Serialize the message and send it to the destination's control port
+        data = self.codec.encode(msg)
+        self.control_sock.sendto(data, (dst_ip, self.control_port))
+        self.myLogger.mnPrint("msg type:{0} sent to {1}: msg:{2}", msg_type, dst_ip, PrettyMsg(msg))
+        self.myLogger.event("send", msg=msg_type, req=msg['req_id'], hops=msg['hops'], bytes=len(data), dst=dst_ip)
+
+    def entryTimedOut(self, request, dst_ip):
+        self.removeEntryNode(dst_ip)
+        self.retry(request, "timed out")
 
     def list_dir(self):
         '''
@@ -147,29 +450,40 @@ class Client():
         sys.stdout.flush()
 
     def processResponse(self, data, addr):
-        msg = json.loads(str(data))
+        try:
+            msg = self.codec.decode(data)
+        except (ValueError, IndexError, struct.error) as e:
+            self.myLogger.mnPrint("Dropping malformed message from {0}: {1}".format(addr[0], e))
+            return
         msg_type = msg['msg_type']
         msg["hops"] += 1
-        self.myLogger.mnPrint("msg type:{0} rcvd from {1}: msg:{2}".format(msg_type, addr[0], self.myLogger.pretty_msg(msg)))
+        self.myLogger.mnPrint("msg type:{0} rcvd from {1}: msg:{2}", msg_type, addr[0], PrettyMsg(msg))
+        # Anyone answering us is a ring member we can send operations to
+        self.addEntryNode(addr[0])
+        self.myLogger.event("recv", msg=msg_type, req=msg['req_id'], hops=msg['hops'], bytes=len(data), src=addr[0])
         # file from server
         if msg_type == c_msg.SEND_FILE:
             filename = msg["filename"]
-            content = msg["content"]
-            with open(self.file_dir_path+filename, "w") as newFile:
-                newFile.write(content)
-            self.myLogger.mnPrint("Received file " + filename + " from " + str(addr[0]))
+            staged, _ = self.data_channel.claim(msg["transfer"])
+            if staged is None:
+                self.myLogger.mnPrint("Error: content of {0} from {1} never arrived".format(filename, addr[0]))
+                return
+            # Whoever sends us a file holds it
+            self.locations.add(filename, addr[0])
+            # Every replica answers a get, only the first copy is kept
+            if msg['req_id'] in self.requests:
+                os.rename(staged, self.file_dir_path+filename)
+                self.myLogger.mnPrint("Received file " + filename + " from " + str(addr[0]))
+            else:
+                os.remove(staged)
+                self.myLogger.mnPrint("Dropping extra copy of " + filename + " from " + str(addr[0]))
             #self.list_dir()
-        # success for last request
-        if msg_type == c_msg.INSERT_FILE or msg_type == c_msg.ENTRIES:
-            self.myLogger.mnPrint("Success: last request:{0} succeeded!".format(self.last_request))            
-        # error for last request
-        if msg_type == c_msg.ERR:
-            self.myLogger.mnPrint("Error: last request:{0} failed!".format(self.last_request))                
-            # retry 3x then give up        
-            if self.retries < 3:
-                self.retries +=1
-                self.myLogger.mnPrint("Retrying attempt: {0}".format(self.retries))
-                self.processRequest(self.last_request[0], self.last_request[-1])
+        # Every replica that stored an insert holds the file
+        if msg_type == c_msg.INSERT_FILE:
+            self.locations.add(msg['filename'], addr[0])
+        # response to one of our requests, anything after the first response to an attempt is ignored
+        if msg_type in (c_msg.SEND_FILE, c_msg.INSERT_FILE, c_msg.GET_FILE_LIST, c_msg.ENTRIES, c_msg.ERR):
+            self.requests.complete(msg['req_id'], msg)
         if msg_type == c_msg.GET_FILE_LIST:
             self.myLogger.mnPrint("Server Files:\n{0}".format(self.print_dir(msg["file_list"])))
 
@@ -180,6 +494,18 @@ class Client():
         return str[:-1]    
 
 '''utility functions'''
+def percentile(values, p):
+    '''p-th percentile (nearest rank) of sorted values, None if there are none
+    '''
+    if len(values) == 0:
+        return None
+    return values[max(0, int(math.ceil(p / 100.0 * len(values))) - 1)]
+
+def formatMs(seconds):
+    if seconds is None:
+        return "-"
+    return "{0:.1f}".format(1000 * seconds)
+
 def exit(arg=None):
     '''exit the application
     '''
@@ -193,7 +519,7 @@ def ctrlMsgReceived():
     # Get data from socket
     #me.control_sock.settimeout(me.rate)
     try:
-        data, addr = me.control_sock.recvfrom(1024)
+        data, addr = me.control_sock.recvfrom(65535)
     except socket.error as e:
         print(e)
         return
@@ -201,20 +527,25 @@ def ctrlMsgReceived():
     me.processResponse(data,addr)
 
 def receiveMessages():
-    rlist = [control_sock]
+    rlist = [control_sock, me.data_channel.listen_sock]
     wlist = []
     xlist = []
 
-    while True:
+    while not stop_receiving.is_set():
         # Multiplex on possible network messages
         try:
-            _rlist, _wlist, _xlist = select.select(rlist, wlist, xlist)
+            _rlist, _wlist, _xlist = select.select(rlist, wlist, xlist, me.expire_interval)
         except:
             continue
 
         if control_sock in _rlist:
             ctrlMsgReceived()
 
+        if me.data_channel.listen_sock in _rlist:
+            me.data_channel.accept()
+
+        me.requests.expire()
+
 def processStdin():
     '''Process the stdin input and take appropriate action
     '''
@@ -273,8 +604,12 @@ if __name__ == "__main__":
 
     # script testing        
     script = None    
-    if len(sys.argv) == 4:
+    if len(sys.argv) >= 4:
         script = sys.argv[3]
+    # keep up to window requests of the script in flight instead of pacing them by client_rate
+    window = None
+    if len(sys.argv) >= 5:
+        window = int(sys.argv[4])
         
     # Socket specifically for communicating with other chord nodes
     control_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -286,36 +621,52 @@ if __name__ == "__main__":
 
     # script --> blocking
     if script is not None:
+        stop_receiving = threading.Event()
         timer = threading.Thread(target=receiveMessages)
         timer.start()
         cmds_to_run = []
         with open(script, "r") as f_in:
             cmds_to_run = f_in.read().strip().split("\n")
+        start_time = time.time()
         while len(cmds_to_run) != 0:
             args = cmds_to_run.pop(0).split(" ")
             if len(args) != 0 and args[0] != "":
                 cmd = args[0].upper().strip()                    
+                if window is not None:
+                    me.waitForWindow(window)
                 me.processRequest(cmd, args[1:])
                 #ctrlMsgReceived()
-            time.sleep(me.rate)
+            if window is None:
+                time.sleep(me.rate)
+        # every request either finishes or runs out of retries
+        me.waitForWindow(1)
+        me.printStats(time.time() - start_time)
+        # stop receiving before the interpreter shuts down under the receiver
+        stop_receiving.set()
+        timer.join()
         # prevent broken pipe
         exit()
 
     # Multiplexing lists
     fcntl.fcntl(sys.stdin, fcntl.F_SETFL, fcntl.fcntl(sys.stdin, fcntl.F_GETFL) | os.O_NONBLOCK)    
-    rlist = [control_sock, sys.stdin]
+    rlist = [control_sock, me.data_channel.listen_sock, sys.stdin]
     wlist = []
     xlist = []
 
     while True:
         # Multiplex on possible network messages
         try:
-            _rlist, _wlist, _xlist = select.select(rlist, wlist, xlist)
+            _rlist, _wlist, _xlist = select.select(rlist, wlist, xlist, me.expire_interval)
         except:
             continue
 
         if control_sock in _rlist:
             ctrlMsgReceived()
 
+        if me.data_channel.listen_sock in _rlist:
+            me.data_channel.accept()
+
         if sys.stdin in _rlist:
-            processStdin()            
+            processStdin()
+
+        me.requests.expire()            
@@ -0,0 +1,172 @@
+import collections
+import re
+import sys
+import threading
+import time
+import zlib
+
+# Receivers acknowledge a transfer with one byte, the transfer ack itself (1) plus the
+#   compression formats they accept, if the sender said it understands them
+ACK_OK = 0x01
+ACK_ZLIB = 0x02
+ACK_ZLIB_DICT = 0x04
+
+# Transfer codecs named in the header frame
+CODEC_ZLIB = "zlib"
+CODEC_ZLIB_DICT = "zlib-dict"
+
+# A transfer is only compressed if a sample of it shrinks below this fraction, so already
+#   compressed files are sent as they are
+MAX_RATIO = 0.9
+
+# Preset dictionaries need zlib's zdict argument (Python 3.3+)
+try:
+    zlib.compressobj(zdict=b" ")
+    HAS_ZDICT = True
+except TypeError:
+    HAS_ZDICT = False
+
+def loadDictionary(path):
+    '''Preset dictionary shared by the ring, None without a path or zdict support'''
+    if path is None or not HAS_ZDICT:
+        return None
+    with open(path, "rb") as f:
+        return f.read()
+
+def trainDictionary(paths, size=32 * 1024):
+    '''
+    Preset dictionary for small files like the ones at paths: their most common words,
+    least common first since zlib reaches the end of the dictionary most cheaply
+    '''
+    counts = collections.Counter()
+    for path in paths:
+        with open(path, "rb") as f:
+            counts.update(re.findall(br"[^\s]{4,32}\s?", f.read()))
+    words = []
+    total = 0
+    for word, count in counts.most_common():
+        if count < 2 or total + len(word) > size:
+            break
+        words.append(word)
+        total += len(word)
+    return b"".join(reversed(words))
+
+class Compression():
+    '''
+    Per-transfer zlib compression of the data channel, only used towards peers whose acks said
+    they accept it, so nodes running older code keep receiving plain transfers
+    level: zlib level of the transfers we send, 0 sends everything uncompressed
+    min_bytes: smallest transfer worth compressing
+    zdict: preset dictionary, used with peers that have the same one
+    '''
+    def __init__(self, level=0, min_bytes=1024, zdict=None):
+        self.level = level
+        self.min_bytes = min_bytes
+        self.zdict = zdict
+        self.dict_id = None if zdict is None else zlib.crc32(zdict) & 0xffffffff
+        # peer ip->compression formats it accepts (ACK_* bits), learned from its acks
+        self.peers = dict()
+        self.lock = threading.Lock()
+
+        # Transfers sent compressed, their size before and after, and seconds spent compressing
+        self.compressed = 0
+        self.raw_bytes = 0
+        self.wire_bytes = 0
+        self.compress_time = 0.0
+        # Transfers received compressed and seconds spent decompressing them
+        self.decompressed = 0
+        self.decompress_time = 0.0
+
+    def __str__(self):
+        ratio = self.raw_bytes / float(self.wire_bytes) if self.wire_bytes > 0 else 1.0
+        return "sent:{0}, ratio:{1:.2f}, saved:{2} bytes, compress:{3:.1f} ms, received:{4}, decompress:{5:.1f} ms".format(
+            self.compressed, ratio, self.raw_bytes - self.wire_bytes, 1000 * self.compress_time,
+            self.decompressed, 1000 * self.decompress_time)
+
+    def header(self, handle):
+        '''Header frame of a transfer, telling the receiver we understand compression acks'''
+        header = {"handle": handle, "accept": True}
+        if self.dict_id is not None:
+            header["dict"] = self.dict_id
+        return header
+
+    def ackFor(self, header):
+        '''Ack byte for a transfer that arrived with header'''
+        ack = ACK_OK
+        if header.get("accept"):
+            ack |= ACK_ZLIB
+            if self.dict_id is not None and header.get("dict") == self.dict_id:
+                ack |= ACK_ZLIB_DICT
+        return bytearray([ack])
+
+    def acked(self, ip, ack):
+        '''Record what ip accepts from its ack, returns False if ack is not a valid transfer ack'''
+        ack = bytearray(ack)
+        if len(ack) != 1 or not ack[0] & ACK_OK:
+            return False
+        with self.lock:
+            self.peers[ip] = ack[0]
+        return True
+
+    def wants(self, ip, size):
+        '''Whether a transfer of size bytes to ip may be compressed'''
+        return self.level > 0 and size >= self.min_bytes and self.peers.get(ip, 0) & ACK_ZLIB != 0
+
+    def codecFor(self, ip, sample):
+        '''
+        Codec to send a transfer that wants() compression to ip with, None to send it uncompressed
+        sample: start of the content, to check that it compresses at all
+        '''
+        if len(zlib.compress(sample, self.level)) > MAX_RATIO * len(sample):
+            return None
+        if self.zdict is not None and self.peers.get(ip, 0) & ACK_ZLIB_DICT:
+            return CODEC_ZLIB_DICT
+        return CODEC_ZLIB
+
+    def compressor(self, codec):
+        if codec == CODEC_ZLIB_DICT:
+            return zlib.compressobj(self.level, zlib.DEFLATED, zlib.MAX_WBITS, 8, zlib.Z_DEFAULT_STRATEGY, self.zdict)
+        return zlib.compressobj(self.level)
+
+    def decompressor(self, codec):
+        '''Decompressor for a transfer sent with codec, None if it was sent uncompressed'''
+        if codec is None:
+            return None
+        if codec == CODEC_ZLIB:
+            return zlib.decompressobj()
+        if codec == CODEC_ZLIB_DICT and self.zdict is not None:
+            return zlib.decompressobj(zlib.MAX_WBITS, self.zdict)
+        raise ValueError("unsupported transfer codec {0}".format(codec))
+
+    def compress(self, compressor, data=None):
+        '''Compress the next data of a transfer, or flush it if data is None'''
+        start = time.time()
+        out = compressor.flush() if data is None else compressor.compress(data)
+        with self.lock:
+            self.compress_time += time.time() - start
+            if data is None:
+                self.compressed += 1
+            else:
+                self.raw_bytes += len(data)
+            self.wire_bytes += len(out)
+        return out
+
+    def decompress(self, decompressor, data=None):
+        '''Decompress the next frame of a transfer, or flush it if data is None'''
+        start = time.time()
+        out = decompressor.flush() if data is None else decompressor.decompress(data)
+        with self.lock:
+            self.decompress_time += time.time() - start
+            if data is None:
+                self.decompressed += 1
+        return out
+
+if __name__ == "__main__":
+    # Train a preset dictionary from sample files
+    if len(sys.argv) < 3:
+        print("Usage: python Compression.py out.dict sample_file...")
+        sys.exit()
+    zdict = trainDictionary(sys.argv[2:])
+    with open(sys.argv[1], "wb") as f:
+        f.write(zdict)
+    print("Wrote a {0} byte dictionary to {1}".format(len(zdict), sys.argv[1]))
@@ -0,0 +1,63 @@
+import threading
+from collections import OrderedDict
+
+class ContentCache():
+    '''
+    File content kept in memory by filename, evicting the least recently used file
+    once the cached content exceeds max_bytes
+    max_bytes: bound on the total size of the cached content, 0 disables the cache
+    max_file_bytes: largest file admitted, so one big file cannot flush every popular one
+    '''
+    def __init__(self, max_bytes, max_file_bytes=None):
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_bytes // 4 if max_file_bytes is None else max_file_bytes
+        # filename->content, least recently used first
+        self.files = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.files)
+
+    def __str__(self):
+        return "files:{0}, bytes:{1}/{2}, hits:{3}, misses:{4}, evictions:{5}".format(
+            len(self.files), self.size, self.max_bytes, self.hits, self.misses, self.evictions)
+
+    def admits(self, size):
+        '''Whether a file of size bytes would be cached'''
+        return 0 < self.max_bytes and size <= self.max_file_bytes
+
+    def get(self, filename):
+        '''Cached content of filename, None on a miss'''
+        with self.lock:
+            content = self.files.pop(filename, None)
+            if content is None:
+                self.misses += 1
+                return None
+            self.files[filename] = content
+            self.hits += 1
+            return content
+
+    def put(self, filename, content):
+        if not self.admits(len(content)):
+            return
+        with self.lock:
+            old = self.files.pop(filename, None)
+            if old is not None:
+                self.size -= len(old)
+            self.files[filename] = content
+            self.size += len(content)
+            while self.size > self.max_bytes:
+                evicted, evicted_content = self.files.popitem(last=False)
+                self.size -= len(evicted_content)
+                self.evictions += 1
+
+    def invalidate(self, filename):
+        '''Drop filename's content, call whenever the file on disk changes or goes away'''
+        with self.lock:
+            content = self.files.pop(filename, None)
+            if content is not None:
+                self.size -= len(content)
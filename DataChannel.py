@@ -0,0 +1,401 @@
+import collections
+import json
+import os
+import re
+import socket
+import struct
+import threading
+import time
+import zlib
+
+from Compression import Compression
+
+# Every frame on the data channel is prefixed with its length
+FRAME_HEADER = struct.Struct("!I")
+# Size of the chunks file content is read and written in
+CHUNK_SIZE = 64 * 1024
+# Largest frame of file content sent, the kernel copies a whole frame from disk to the socket when it can
+FILE_FRAME_SIZE = 1024 * 1024
+# Largest frame accepted from a peer: a frame of file content, or a compressed chunk and what zlib held back
+MAX_FRAME_SIZE = FILE_FRAME_SIZE + 4 * CHUNK_SIZE
+# Sent by the receiver once a transfer has been fully written to disk
+TRANSFER_ACK = b"\x01"
+# Seconds a completed transfer waits to be claimed, its control message was probably lost after that
+UNCLAIMED_TIMEOUT = 60
+# Handles are part of staged file names, so they may only be plain tokens
+HANDLE_RE = re.compile(r"[A-Za-z0-9_.-]{1,128}$")
+
+class DataChannel():
+    '''
+    Bulk TCP channel used to move file content between nodes, so that control
+    datagrams only ever carry metadata and a transfer handle
+    ip: ip to listen on
+    port: data port
+    staging_dir: directory incoming transfers are written to until claimed
+    logger: MyLogger of the owning node or client
+    timeout: seconds to wait on a peer before giving up on a transfer
+    compression: Compression of the transfers, uncompressed by default
+    unclaimed_timeout: seconds before a completed transfer nobody claimed is deleted
+    '''
+    def __init__(self, ip, port, staging_dir, logger, timeout=10, compression=None, unclaimed_timeout=UNCLAIMED_TIMEOUT):
+        self.ip = ip
+        self.port = port
+        self.staging_dir = staging_dir
+        self.myLogger = logger
+        self.timeout = timeout
+        self.compression = Compression() if compression is None else compression
+        self.unclaimed_timeout = unclaimed_timeout
+
+        if not os.path.exists(self.staging_dir):
+            os.makedirs(self.staging_dir)
+
+        # Completed incoming transfers in the order they completed (handle->(staged path, crc32 of
+        #   the content, completion time)) and their completion events
+        self.completed = collections.OrderedDict()
+        self.ready = dict()
+        self.lock = threading.Lock()
+
+        # Handles are unique per sender
+        self.handle_count = 0
+
+        # Outgoing transfers waiting for each destination (dst_ip->deque), every destination is streamed
+        #   to in order by a worker of its own, so a dead peer only holds up its own transfers
+        self.pending = dict()
+
+        # Socket other nodes stream file content to
+        self.listen_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listen_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listen_sock.bind((self.ip, self.port))
+        self.listen_sock.listen(16)
+
+    def new_handle(self):
+        '''Create a transfer handle for an outgoing transfer
+        '''
+        with self.lock:
+            self.handle_count += 1
+            return "{0}_{1}_{2}".format(self.ip, int(time.time() * 1000), self.handle_count)
+
+    def send(self, dst_ip, handle, path, callback=None, content=None, files=None):
+        '''
+        Queue the file at path to be streamed to dst_ip under handle
+        callback: called with True once the receiver acknowledged the transfer, False on failure
+        content: the file's content if it is already in memory, sent instead of reading path
+        files: (path, size) pairs streamed from disk after content instead, the first size bytes of each
+        '''
+        with self.lock:
+            pending = self.pending.get(dst_ip)
+            if pending is None:
+                pending = self.pending[dst_ip] = collections.deque()
+                sender = threading.Thread(target=self._sendWorker, args=(dst_ip,))
+                sender.daemon = True
+                sender.start()
+            pending.append((handle, path, callback, content, files))
+
+    def accept(self):
+        '''Accept an incoming transfer, call when listen_sock is readable
+        '''
+        try:
+            conn, addr = self.listen_sock.accept()
+        except socket.error as e:
+            self.myLogger.mnPrint(e)
+            return
+        receiver = threading.Thread(target=self._receive, args=(conn, addr))
+        receiver.daemon = True
+        receiver.start()
+
+    def claim(self, handle, timeout=None):
+        '''
+        Wait for the transfer with the given handle to complete and take ownership of its staged file
+        returns the staged path and the crc32 of its content, (None, None) if the transfer failed or never arrived
+        '''
+        if handle is None:
+            return None, None
+        with self.lock:
+            event = self.ready.setdefault(handle, threading.Event())
+        event.wait(self.timeout if timeout is None else timeout)
+        with self.lock:
+            self.ready.pop(handle, None)
+            if not event.is_set():
+                return None, None
+            path, checksum, completed = self.completed.pop(handle, (None, None, None))
+            return path, checksum
+
+    def _staged_path(self, handle):
+        return os.path.join(self.staging_dir, handle + ".part")
+
+    def _complete(self, handle, path, checksum=None):
+        now = time.time()
+        with self.lock:
+            self.completed[handle] = (path, checksum, now)
+            self.ready.setdefault(handle, threading.Event()).set()
+            expired = self._expire(now)
+        for stale, staged in expired:
+            self.myLogger.mnPrint("Error: transfer {0} was never claimed".format(stale))
+            if staged is not None and os.path.exists(staged):
+                os.remove(staged)
+
+    def _expire(self, now):
+        '''Forget the completed transfers nobody claimed in time, call holding the lock
+        returns their (handle, staged path) pairs, the caller deletes the staged files
+        '''
+        expired = []
+        while len(self.completed) > 0:
+            handle, (path, checksum, completed) = next(iter(self.completed.items()))
+            if now - completed < self.unclaimed_timeout:
+                break
+            del self.completed[handle]
+            # A claim that is still waiting gets nothing
+            self.ready.pop(handle, None)
+            expired.append((handle, path))
+        return expired
+
+    def _receive(self, conn, addr):
+        '''Read a length-prefixed stream of chunks into the staging directory
+        '''
+        conn.settimeout(self.timeout)
+        handle = None
+        path = None
+        try:
+            header = json.loads(recvFrame(conn).decode("utf-8"))
+            if not validHandle(header["handle"]):
+                raise ValueError("invalid transfer handle {0!r}".format(header["handle"]))
+            handle = header["handle"]
+            decompressor = self.compression.decompressor(header.get("codec"))
+            path = self._staged_path(handle)
+            with open(path, "wb") as f:
+                # The checksum is taken on the way to disk, nobody has to read the file again
+                staged = ChecksumWriter(f)
+                if decompressor is None:
+                    buf = bytearray(CHUNK_SIZE)
+                    while recvFrameInto(conn, staged, buf) > 0:
+                        pass
+                else:
+                    while True:
+                        chunk = recvFrame(conn)
+                        if len(chunk) == 0:
+                            break
+                        staged.write(self.compression.decompress(decompressor, chunk))
+                    staged.write(self.compression.decompress(decompressor))
+            conn.sendall(self.compression.ackFor(header))
+            self._complete(handle, path, staged.checksum())
+        except (socket.error, IOError, ValueError, KeyError, zlib.error) as e:
+            self.myLogger.mnPrint("Error: transfer {0} from {1} failed: {2}".format(handle, addr[0], e))
+            if path is not None and os.path.exists(path):
+                os.remove(path)
+            if handle is not None:
+                self._complete(handle, None)
+        finally:
+            conn.close()
+
+    def _sendWorker(self, dst_ip):
+        '''Stream the transfers queued for dst_ip, until there are none left'''
+        with self.lock:
+            pending = self.pending[dst_ip]
+        try:
+            while True:
+                with self.lock:
+                    if len(pending) == 0:
+                        return
+                    handle, path, callback, content, files = pending.popleft()
+                try:
+                    self._stream(dst_ip, handle, path, content, files)
+                    sent = True
+                except (socket.error, IOError) as e:
+                    self.myLogger.mnPrint("Error: transfer {0} to {1} failed: {2}".format(handle, dst_ip, e))
+                    sent = False
+                if callback is not None:
+                    # A failing callback must not stop the transfers queued behind it
+                    try:
+                        callback(sent)
+                    except Exception as e:
+                        self.myLogger.mnPrint("Error: callback of transfer {0} to {1} failed: {2}".format(handle, dst_ip, e))
+        finally:
+            # Whatever stops us, the next send to dst_ip starts a new worker
+            with self.lock:
+                if self.pending.get(dst_ip) is pending:
+                    del self.pending[dst_ip]
+
+    def _stream(self, dst_ip, handle, path, content=None, files=None):
+        sock = socket.create_connection((dst_ip, self.port), self.timeout)
+        try:
+            header = self.compression.header(handle)
+            if files is not None:
+                self._sendParts(sock, dst_ip, header, content, files)
+            elif content is not None:
+                self._sendContent(sock, dst_ip, header, content)
+            else:
+                with open(path, "rb") as f:
+                    self._sendFile(sock, dst_ip, header, f)
+            sendFrame(sock, b"")
+            if not self.compression.acked(dst_ip, recvExact(sock, len(TRANSFER_ACK))):
+                raise socket.error("transfer {0} was not acknowledged".format(handle))
+        finally:
+            sock.close()
+
+    def _sendContent(self, sock, dst_ip, header, content):
+        codec = None
+        if self.compression.wants(dst_ip, len(content)):
+            codec = self.compression.codecFor(dst_ip, content[:CHUNK_SIZE])
+            header["codec"] = codec
+        sendFrame(sock, json.dumps(header).encode("utf-8"))
+        if codec is not None:
+            chunks = (content[offset:offset + CHUNK_SIZE] for offset in range(0, len(content), CHUNK_SIZE))
+            self._sendCompressed(sock, codec, chunks)
+        else:
+            view = memoryview(content)
+            for offset in range(0, len(content), FILE_FRAME_SIZE):
+                sendFrame(sock, view[offset:offset + FILE_FRAME_SIZE])
+
+    def _sendFile(self, sock, dst_ip, header, f):
+        size = os.fstat(f.fileno()).st_size
+        codec = None
+        if self.compression.wants(dst_ip, size):
+            codec = self.compression.codecFor(dst_ip, f.read(CHUNK_SIZE))
+            header["codec"] = codec
+            f.seek(0)
+        sendFrame(sock, json.dumps(header).encode("utf-8"))
+        if codec is not None:
+            self._sendCompressed(sock, codec, iter(lambda: f.read(CHUNK_SIZE), b""))
+        else:
+            sendFileFrames(sock, f, size)
+
+    def _sendParts(self, sock, dst_ip, header, content, files):
+        size = len(content) + sum(size for path, size in files)
+        codec = None
+        if self.compression.wants(dst_ip, size):
+            codec = self.compression.codecFor(dst_ip, content[:CHUNK_SIZE])
+            header["codec"] = codec
+        sendFrame(sock, json.dumps(header).encode("utf-8"))
+        if codec is not None:
+            self._sendCompressed(sock, codec, partChunks(content, files))
+            return
+        view = memoryview(content)
+        for offset in range(0, len(content), FILE_FRAME_SIZE):
+            sendFrame(sock, view[offset:offset + FILE_FRAME_SIZE])
+        for path, size in files:
+            with open(path, "rb") as f:
+                sendFileFrames(sock, f, size)
+
+    def _sendCompressed(self, sock, codec, chunks):
+        compressor = self.compression.compressor(codec)
+        for chunk in chunks:
+            out = self.compression.compress(compressor, chunk)
+            # zlib holds on to small inputs, and an empty frame would end the transfer
+            if out:
+                sendFrame(sock, out)
+        out = self.compression.compress(compressor)
+        if out:
+            sendFrame(sock, out)
+
+def validHandle(handle):
+    '''True if handle is a plain token, safe to name a staged file after'''
+    try:
+        return HANDLE_RE.match(handle) is not None
+    except TypeError:
+        return False
+
+class ChecksumWriter():
+    '''Writes to the file f, keeping the crc32 of everything written'''
+    def __init__(self, f):
+        self.f = f
+        self.crc = 0
+
+    def write(self, data):
+        self.f.write(data)
+        try:
+            self.crc = zlib.crc32(data, self.crc)
+        except TypeError:
+            # Python 2's crc32 takes no memoryviews
+            self.crc = zlib.crc32(data.tobytes(), self.crc)
+
+    def checksum(self):
+        return self.crc & 0xffffffff
+
+def frame(payload):
+    '''Length-prefix payload for the data channel'''
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+def sendFrame(sock, payload):
+    sock.sendall(FRAME_HEADER.pack(len(payload)))
+    sock.sendall(payload)
+
+def recvFrame(sock):
+    return recvExact(sock, frameLength(recvExact(sock, FRAME_HEADER.size)))
+
+def frameLength(header):
+    '''Payload length from a frame header, raises ValueError if it is more than a peer may send'''
+    length = FRAME_HEADER.unpack(header)[0]
+    if length > MAX_FRAME_SIZE:
+        raise ValueError("frame of {0} bytes, at most {1} are allowed".format(length, MAX_FRAME_SIZE))
+    return length
+
+def sendFileFrames(sock, f, size):
+    '''
+    Stream the first size bytes of the binary file f as frames, without copying them into Python
+    objects: socket.sendfile hands the copy to the kernel, older Pythons read into one reused buffer
+    '''
+    use_sendfile = hasattr(sock, "sendfile")
+    buf = None if use_sendfile else bytearray(CHUNK_SIZE)
+    offset = 0
+    while offset < size:
+        length = min(FILE_FRAME_SIZE, size - offset)
+        sock.sendall(FRAME_HEADER.pack(length))
+        if use_sendfile:
+            if sock.sendfile(f, offset, length) != length:
+                raise socket.error("file shrank mid-transfer")
+        else:
+            view = memoryview(buf)
+            left = length
+            while left > 0:
+                read = f.readinto(view[:min(left, CHUNK_SIZE)])
+                if not read:
+                    raise socket.error("file shrank mid-transfer")
+                sock.sendall(view[:read])
+                left -= read
+        offset += length
+
+def fileChunks(f, size):
+    '''The first size bytes of the binary file f, in chunks'''
+    left = size
+    while left > 0:
+        chunk = f.read(min(left, CHUNK_SIZE))
+        if not chunk:
+            raise IOError("file shrank mid-transfer")
+        left -= len(chunk)
+        yield chunk
+
+def partChunks(content, files):
+    '''content followed by the first size bytes of each of the (path, size) files, in chunks'''
+    for offset in range(0, len(content), CHUNK_SIZE):
+        yield content[offset:offset + CHUNK_SIZE]
+    for path, size in files:
+        with open(path, "rb") as f:
+            for chunk in fileChunks(f, size):
+                yield chunk
+
+def recvFrameInto(sock, f, buf):
+    '''
+    Write the payload of the next frame to the file f, receiving it through buf
+    returns the length of the payload, 0 for the terminating frame
+    '''
+    length = frameLength(recvExact(sock, FRAME_HEADER.size))
+    view = memoryview(buf)
+    left = length
+    while left > 0:
+        received = sock.recv_into(view, min(left, len(buf)))
+        if not received:
+            raise socket.error("connection closed mid-transfer")
+        f.write(view[:received])
+        left -= received
+    return length
+
+def recvExact(sock, length):
+    '''Read exactly length bytes from sock
+    '''
+    data = b""
+    while len(data) < length:
+        chunk = sock.recv(min(length - len(data), CHUNK_SIZE))
+        if not chunk:
+            raise socket.error("connection closed mid-transfer")
+        data += chunk
+    return data
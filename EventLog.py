@@ -0,0 +1,271 @@
+import array
+import json
+import math
+import mmap
+import os
+import sys
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Packed event files start with this line, then a JSON header line, then the columns
+MAGIC = b"CHORDEV1\n"
+
+# Numeric columns are float64 with NaN where an event has no value
+NUMERIC_COLUMNS = ["ts", "req", "hops", "bytes", "latency", "count", "files", "attempts",
+                   "cache_hits", "cache_misses", "cache_bytes", "raw_bytes", "wire_bytes", "compress_time"]
+# String columns are int32 codes into a vocabulary kept in the header
+STRING_COLUMNS = ["node", "event", "msg"]
+
+# Columns are aligned to this many bytes in the file
+ALIGN = 8
+
+def eventFiles(root="nodes"):
+    '''Every event log written by MyLogger under root'''
+    paths = []
+    for dirpath, dirs, files in os.walk(root):
+        for f in files:
+            if f.endswith(".events.jsonl"):
+                paths.append(os.path.join(dirpath, f))
+    return sorted(paths)
+
+def pack(paths, out_path="events.col"):
+    '''
+    Pack the events of every JSON lines file in paths into one columnar file
+    returns the number of events packed
+    '''
+    columns = dict((name, array.array("d")) for name in NUMERIC_COLUMNS)
+    codes = dict((name, array.array("i")) for name in STRING_COLUMNS)
+    vocabs = dict((name, dict()) for name in STRING_COLUMNS)
+    nan = float("nan")
+    rows = 0
+    for path in paths:
+        with open(path) as events:
+            for line in events:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    # a node killed mid-write leaves a partial last line
+                    continue
+                for name in NUMERIC_COLUMNS:
+                    value = event.get(name)
+                    columns[name].append(nan if value is None else float(value))
+                for name in STRING_COLUMNS:
+                    value = event.get(name)
+                    if value is None:
+                        codes[name].append(-1)
+                    else:
+                        codes[name].append(vocabs[name].setdefault(value, len(vocabs[name])))
+                rows += 1
+
+    # Lay the columns out one after another, each aligned
+    header = {"rows": rows, "byteorder": sys.byteorder, "columns": []}
+    offset = 0
+    for name in NUMERIC_COLUMNS + STRING_COLUMNS:
+        column = columns[name] if name in columns else codes[name]
+        entry = {"name": name, "type": column.typecode, "offset": offset}
+        if name in vocabs:
+            vocab = [None] * len(vocabs[name])
+            for value, code in vocabs[name].items():
+                vocab[code] = value
+            entry["vocab"] = vocab
+        header["columns"].append(entry)
+        offset += alignUp(len(column) * column.itemsize)
+
+    with open(out_path, "wb") as f_out:
+        f_out.write(MAGIC)
+        f_out.write(json.dumps(header).encode("utf-8") + b"\n")
+        for name in NUMERIC_COLUMNS + STRING_COLUMNS:
+            column = columns[name] if name in columns else codes[name]
+            size = len(column) * column.itemsize
+            f_out.write(tobytes(column))
+            f_out.write(b"\0" * (alignUp(size) - size))
+    return rows
+
+def alignUp(size):
+    return (size + ALIGN - 1) // ALIGN * ALIGN
+
+def tobytes(column):
+    if hasattr(column, "tobytes"):
+        return column.tobytes()
+    return column.tostring()
+
+class Events():
+    '''
+    Columns of a packed event file, numpy arrays mapped straight from the file when numpy
+    is installed, array.arrays otherwise
+    path: file written by pack()
+    '''
+    def __init__(self, path="events.col"):
+        self.columns = dict()
+        self.vocabs = dict()
+        with open(path, "rb") as f:
+            if f.readline() != MAGIC:
+                raise ValueError("{0} is not a packed event file".format(path))
+            header = json.loads(f.readline().decode("utf-8"))
+            start = f.tell()
+            self.rows = header["rows"]
+            swap = header["byteorder"] != sys.byteorder
+            if np is not None and self.rows > 0:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            for entry in header["columns"]:
+                name = entry["name"]
+                if np is not None:
+                    dtype = np.float64 if entry["type"] == "d" else np.int32
+                    if self.rows == 0:
+                        column = np.zeros(0, dtype=dtype)
+                    else:
+                        column = np.frombuffer(data, dtype=dtype, count=self.rows, offset=start + entry["offset"])
+                    if swap:
+                        column = column.byteswap()
+                else:
+                    column = array.array(entry["type"])
+                    f.seek(start + entry["offset"])
+                    column.fromfile(f, self.rows)
+                    if swap:
+                        column.byteswap()
+                self.columns[name] = column
+                if "vocab" in entry:
+                    self.vocabs[name] = entry["vocab"]
+
+    def __len__(self):
+        return self.rows
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def code(self, name, value):
+        '''Code of value in a string column, -1 if it never occurs'''
+        try:
+            return self.vocabs[name].index(value)
+        except ValueError:
+            return -1
+
+    def value(self, name, code):
+        return self.vocabs[name][code]
+
+def percentiles(values, ps):
+    '''Nearest rank percentiles of values, same definition as the client's'''
+    if len(values) == 0:
+        return [None] * len(ps)
+    if np is not None:
+        values = np.sort(values)
+    else:
+        values = sorted(values)
+    return [values[max(0, int(math.ceil(p / 100.0 * len(values))) - 1)] for p in ps]
+
+def hopsByMsg(events, event_type="recv"):
+    '''(msg type, count, mean hops, max hops) of the messages received, by message type'''
+    event_code = events.code("event", event_type)
+    stats = []
+    if np is not None:
+        mask = (events["event"] == event_code) & (events["msg"] >= 0) & ~np.isnan(events["hops"])
+        msgs = events["msg"][mask]
+        hops = events["hops"][mask]
+        num_msgs = len(events.vocabs["msg"])
+        counts = np.bincount(msgs, minlength=num_msgs)
+        sums = np.bincount(msgs, weights=hops, minlength=num_msgs)
+        maxes = np.zeros(num_msgs)
+        np.maximum.at(maxes, msgs, hops)
+        for code in np.nonzero(counts)[0]:
+            stats.append((events.value("msg", code), int(counts[code]), sums[code] / counts[code], int(maxes[code])))
+    else:
+        groups = dict()
+        for event, msg, hops in zip(events["event"], events["msg"], events["hops"]):
+            if event != event_code or msg < 0 or hops != hops:
+                continue
+            group = groups.setdefault(msg, [0, 0.0, 0])
+            group[0] += 1
+            group[1] += hops
+            group[2] = max(group[2], int(hops))
+        for code, group in groups.items():
+            stats.append((events.value("msg", code), group[0], group[1] / group[0], group[2]))
+    return sorted(stats)
+
+def latencyByOp(events):
+    '''(op, done, failed, p50, p95, p99 ms) of client requests, by request type'''
+    done = events.code("event", "done")
+    failed = events.code("event", "failed")
+    stats = []
+    for code, op in enumerate(events.vocabs["msg"]):
+        if np is not None:
+            ops = events["msg"] == code
+            latencies = events["latency"][ops & (events["event"] == done)]
+            num_failed = int(np.count_nonzero(ops & (events["event"] == failed)))
+        else:
+            latencies = []
+            num_failed = 0
+            for event, msg, latency in zip(events["event"], events["msg"], events["latency"]):
+                if msg != code:
+                    continue
+                if event == done:
+                    latencies.append(latency)
+                elif event == failed:
+                    num_failed += 1
+        if len(latencies) > 0 or num_failed > 0:
+            stats.append([op, len(latencies), num_failed] + percentiles(latencies, (50, 95, 99)))
+    return sorted(stats)
+
+def keyDistribution(events):
+    '''Number of files every node held when it last reported its entries (node->count)'''
+    entries = events.code("event", "entries")
+    latest = dict()
+    if np is not None:
+        rows = np.nonzero(events["event"] == entries)[0]
+        # Last report of every node, by time
+        rows = rows[np.argsort(events["ts"][rows], kind="mergesort")][::-1]
+        nodes, first = np.unique(events["node"][rows], return_index=True)
+        for node, row in zip(nodes, rows[first]):
+            latest[events.value("node", node)] = int(events["count"][row])
+    else:
+        times = dict()
+        for event, node, ts, count in zip(events["event"], events["node"], events["ts"], events["count"]):
+            if event == entries and ts >= times.get(node, ts):
+                times[node] = ts
+                latest[events.value("node", node)] = int(count)
+    return latest
+
+def report(events):
+    '''Summary of a packed run'''
+    lines = ["Events: {0}".format(len(events)), "", "Hops of received messages:",
+        "{0:<20}{1:>10}{2:>10}{3:>10}".format("msg type", "count", "mean", "max")]
+    for msg, count, mean, most in hopsByMsg(events):
+        lines.append("{0:<20}{1:>10}{2:>10.2f}{3:>10}".format(msg, count, mean, most))
+
+    lines += ["", "Client requests:", "{0:<10}{1:>8}{2:>8}{3:>10}{4:>10}{5:>10}".format("op", "done", "failed", "p50 ms", "p95 ms", "p99 ms")]
+    for op, done, failed, p50, p95, p99 in latencyByOp(events):
+        lines.append("{0:<10}{1:>8}{2:>8}{3:>10}{4:>10}{5:>10}".format(op, done, failed, *[formatMs(p) for p in (p50, p95, p99)]))
+
+    key_counts = keyDistribution(events)
+    lines += ["", "Key distribution:"]
+    if len(key_counts) == 0:
+        lines.append("\tNone")
+    else:
+        counts = list(key_counts.values())
+        lines.append("\tNodes: {0}, Files: {1}, Min: {2}, Mean: {3:.2f}, Max: {4}".format(len(counts), sum(counts), min(counts), sum(counts) / float(len(counts)), max(counts)))
+        for node in sorted(key_counts.keys()):
+            lines.append("\t{0}-> # keys:{1}".format(node, key_counts[node]))
+    return "\n".join(lines)
+
+def formatMs(ms):
+    if ms is None:
+        return "-"
+    return "{0:.1f}".format(ms)
+
+if __name__ == "__main__":
+    # Pack the event logs of a run, or report on a packed run
+    if len(sys.argv) < 2 or sys.argv[1] not in ("pack", "report"):
+        print("Usage: python EventLog.py pack|report [events.col]")
+        sys.exit()
+    path = "events.col"
+    if len(sys.argv) > 2:
+        path = sys.argv[2]
+
+    if sys.argv[1] == "pack":
+        paths = eventFiles()
+        rows = pack(paths, path)
+        print("Packed {0} events from {1} logs into {2}".format(rows, len(paths), path))
+    else:
+        print(report(Events(path)))
@@ -0,0 +1,59 @@
+import random
+import threading
+import time
+
+class LocationCache():
+    '''
+    Nodes known to hold a file, learned from completed requests, each forgotten after ttl seconds
+    ttl: seconds an owner stays cached, 0 disables the cache
+    clock: returns the current time in seconds
+    '''
+    def __init__(self, ttl, clock=time.time):
+        self.ttl = ttl
+        self.clock = clock
+        # filename->{owner ip: expiry}
+        self.owners = dict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.owners)
+
+    def __str__(self):
+        return "files:{0}, hits:{1}, misses:{2}".format(len(self.owners), self.hits, self.misses)
+
+    def add(self, filename, ip):
+        '''ip holds filename, as of now'''
+        if self.ttl <= 0:
+            return
+        with self.lock:
+            self.owners.setdefault(filename, dict())[ip] = self.clock() + self.ttl
+
+    def get(self, filename):
+        '''One of the owners of filename still cached, picked at random to spread the load, None on a miss'''
+        now = self.clock()
+        with self.lock:
+            owners = self.owners.get(filename)
+            if owners is not None:
+                for ip in [ip for ip, expiry in owners.items() if expiry <= now]:
+                    del owners[ip]
+                if len(owners) == 0:
+                    del self.owners[filename]
+                    owners = None
+            if owners is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return random.choice(list(owners.keys()))
+
+    def invalidate(self, filename, ip=None):
+        '''Forget that ip holds filename, or every owner of filename if ip is None'''
+        with self.lock:
+            owners = self.owners.get(filename)
+            if owners is None:
+                return
+            if ip is not None:
+                owners.pop(ip, None)
+            if ip is None or len(owners) == 0:
+                del self.owners[filename]
@@ -0,0 +1,95 @@
+import json
+import os
+import threading
+
+# Records appended to the log before it is folded into a new checkpoint
+CHECKPOINT_EVERY = 1000
+
+class MetaStore():
+    '''
+    Durable index of the files a node holds (filename->[replica chord ids, size, checksum])
+    Changes are appended to a log that is folded into a checkpoint every checkpoint_every records,
+    so loading it costs the size of the index, never the size of the files
+    dir_path: directory of the checkpoint and log
+    '''
+    def __init__(self, dir_path, checkpoint_every=CHECKPOINT_EVERY):
+        self.checkpoint_every = checkpoint_every
+        self.checkpoint_path = os.path.join(dir_path, "meta.ckpt")
+        self.log_path = os.path.join(dir_path, "meta.log")
+        if not os.path.exists(dir_path):
+            os.makedirs(dir_path)
+
+        self.files = dict()
+        self.log_records = 0
+        self.lock = threading.Lock()
+        self.load()
+        self.log = open(self.log_path, "a")
+
+    def __len__(self):
+        return len(self.files)
+
+    def __contains__(self, filename):
+        return filename in self.files
+
+    def get(self, filename):
+        return self.files.get(filename)
+
+    def load(self):
+        '''Read the last checkpoint and replay the log written since'''
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path) as f:
+                self.files = json.load(f)
+        if os.path.exists(self.log_path):
+            # Length of the complete records at the start of the log
+            valid = 0
+            with open(self.log_path, "rb") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line.decode("utf-8"))
+                    except ValueError:
+                        break
+                    # a node killed mid-write leaves a partial last line
+                    if not line.endswith(b"\n"):
+                        break
+                    self.apply(record)
+                    self.log_records += 1
+                    valid += len(line)
+            # Cut the partial line off, records appended after it would be lost on the next load
+            if valid < os.path.getsize(self.log_path):
+                with open(self.log_path, "r+b") as f:
+                    f.truncate(valid)
+
+    def apply(self, record):
+        if record["op"] == "add":
+            self.files[record["file"]] = [record["ids"], record["size"], record["sum"]]
+        elif record["op"] == "rm":
+            self.files.pop(record["file"], None)
+
+    def add(self, filename, chord_ids, size, checksum):
+        self.append({"op": "add", "file": filename, "ids": list(chord_ids), "size": size, "sum": checksum})
+
+    def remove(self, filename):
+        if filename in self.files:
+            self.append({"op": "rm", "file": filename})
+
+    def append(self, record):
+        with self.lock:
+            self.apply(record)
+            self.log.write(json.dumps(record) + "\n")
+            self.log.flush()
+            self.log_records += 1
+            if self.log_records >= self.checkpoint_every:
+                self.checkpoint()
+
+    def checkpoint(self):
+        '''Fold the log into a new checkpoint and start an empty log, called with the lock held'''
+        # Replace the checkpoint atomically, a crash before the log is emptied only replays it again
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.files, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_path, self.checkpoint_path)
+        self.log.close()
+        self.log = open(self.log_path, "w")
+        self.log_records = 0
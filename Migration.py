@@ -0,0 +1,99 @@
+import json
+import os
+import struct
+import zlib
+
+# Limits of one batch of a bulk handoff, a file larger than BATCH_BYTES gets a batch of its own
+BATCH_FILES = 256
+BATCH_BYTES = 4 * 1024 * 1024
+# Batches of one handoff on their way at a time, the next is only started once one of them is acked or failed
+BATCHES_IN_FLIGHT = 2
+
+# Length of the manifest at the start of a batch
+MANIFEST_HEADER = struct.Struct("!I")
+# Bytes copied at a time when unpacking a batch
+COPY_CHUNK = 64 * 1024
+
+def planBatches(files, max_files=BATCH_FILES, max_bytes=BATCH_BYTES):
+    '''
+    Group files for a bulk handoff
+    files: (filename, size) pairs
+    returns the batches, lists of (filename, size)
+    '''
+    batches = []
+    batch = []
+    batch_bytes = 0
+    for filename, size in files:
+        # Still a batch, its copy is only deleted once the receiver acks it like any other
+        if size > max_bytes:
+            batches.append([(filename, size)])
+            continue
+        if len(batch) == max_files or batch_bytes + size > max_bytes:
+            batches.append(batch)
+            batch = []
+            batch_bytes = 0
+        batch.append((filename, size))
+        batch_bytes += size
+    if len(batch) > 0:
+        batches.append(batch)
+    return batches
+
+def batchManifest(dir_path, batch):
+    '''
+    Start of a batch on the wire: the length-prefixed JSON manifest of its files ([filename, size] pairs),
+    the files' content follows in manifest order, streamed from disk by the data channel
+    returns the manifest and the (path, size) pairs to stream after it, files gone from disk are left out
+    '''
+    manifest = []
+    files = []
+    for filename, size in batch:
+        path = os.path.join(dir_path, filename)
+        try:
+            # The sizes are those of the files now, the data channel sends exactly that many bytes of each
+            size = os.path.getsize(path)
+        except OSError:
+            continue
+        manifest.append([filename, size])
+        files.append((path, size))
+    manifest = json.dumps(manifest).encode("utf-8")
+    return MANIFEST_HEADER.pack(len(manifest)) + manifest, files
+
+def plainFilename(filename):
+    '''True if filename names a file right inside a directory, manifests come from other nodes'''
+    try:
+        if filename in ("", ".", "..") or os.path.isabs(filename):
+            return False
+        return not any(c in filename for c in ("/", "\\", "\0"))
+    except (TypeError, AttributeError):
+        return False
+
+def unpackBatch(path, dir_path):
+    '''
+    Write the files of the batch at path into dir_path, copying them in chunks
+    returns the manifest with the crc32 of each file appended to its entry, raises ValueError if the batch is truncated
+    '''
+    with open(path, "rb") as f:
+        header = f.read(MANIFEST_HEADER.size)
+        if len(header) != MANIFEST_HEADER.size:
+            raise ValueError("batch {0} has no manifest".format(path))
+        length = MANIFEST_HEADER.unpack(header)[0]
+        manifest = json.loads(f.read(length).decode("utf-8"))
+        # Check the whole batch is there, and names no file outside dir_path, before writing anything
+        for filename, size in manifest:
+            if not plainFilename(filename):
+                raise ValueError("batch {0} names the file {1!r}".format(path, filename))
+        expected = MANIFEST_HEADER.size + length + sum(size for filename, size in manifest)
+        if os.fstat(f.fileno()).st_size != expected:
+            raise ValueError("batch {0} does not match its manifest".format(path))
+        for entry in manifest:
+            filename, size = entry
+            checksum = 0
+            with open(os.path.join(dir_path, filename), "wb") as out:
+                left = size
+                while left > 0:
+                    chunk = f.read(min(left, COPY_CHUNK))
+                    out.write(chunk)
+                    checksum = zlib.crc32(chunk, checksum)
+                    left -= len(chunk)
+            entry.append(checksum & 0xffffffff)
+    return manifest
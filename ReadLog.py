@@ -1,55 +1,488 @@
+import atexit
+import collections
+import heapq
+import mmap
 import os
 import json
 import sys
 import re
+import threading
+import time
 from ChordMessage import ChordMessage as c_msg
 from datetime import datetime
 
+# Seconds between writes of buffered log lines
+FLUSH_INTERVAL = 0.5
+
+# Log lines start with a timestamp like 2018-05-09_10:40:34.210800
+TIMESTAMP_RE = re.compile(br"[0-9]{4}-[0-9]{2}-[0-9]{2}_[0-9]{2}:[0-9]{2}:[0-9]{2}(\.[0-9]{6})?$")
+
+# Message types too frequent to log
+FILTERED_TYPES = [c_msg.FIND_SUCCESSOR,c_msg.RETURN_SUCCESSOR,c_msg.GET_PREDECESSOR,c_msg.RETURN_PREDECESSOR,c_msg.NOTIFY_PREDECESSOR,c_msg.CHECK_ALIVE,c_msg.AM_ALIVE,c_msg.SOMEONE_DIED,\
+                    c_msg.LEAVING]
+
 class MyLogger():
-    def __init__(self, ip, chord_id, log_file_path, client=False):     
+    '''
+    Log of a node or client, lines are buffered and written out by the process' LogWriter
+    flush_interval: seconds between writes, the first logger of the process sets it
+    events: also write structured events, one JSON object per line, next to the log (see EventLog.py)
+    '''
+    def __init__(self, ip, chord_id, log_file_path, client=False, echo=True, flush_interval=FLUSH_INTERVAL, events=False):     
         self.ip = ip   
         self.chord_id = chord_id
         self.log_file_path = log_file_path
         self.client = client
+        # echo debug output to stdout (mininet output)
+        self.echo = echo
+        self.events = events
 
-    # Print that will show up in mininet output and get added to log file
-    def mnPrint(self, msg, debug=True):       
-        # log only certain message types
-        try:
-            # filter msg types
-            messages = [c_msg.FIND_SUCCESSOR,c_msg.RETURN_SUCCESSOR,c_msg.GET_PREDECESSOR,c_msg.RETURN_PREDECESSOR,c_msg.NOTIFY_PREDECESSOR,c_msg.CHECK_ALIVE,c_msg.AM_ALIVE,c_msg.SOMEONE_DIED,\
-                            c_msg.LEAVING]
-            for msg_type in messages:
-                if msg.find(msg_type) > 0:
-                    return            
-        except:
-            pass     
         if self.client:
-            # Format msg
-            msg = "<{0}_c>: {1}".format(self.ip, msg)
+            self.prefix = "<{0}_c>: ".format(self.ip)
+            self.node = "{0}_c".format(self.ip)
         else:
-            # Format msg
-            msg = "<{0}, {1}>: {2}".format(self.ip, self.chord_id, msg)
+            self.prefix = "<{0}, {1}>: ".format(self.ip, self.chord_id)
+            self.node = self.ip
 
-        # Print msg to stdout 
-        if debug:  
+        # Lines waiting to be written (time, line, echo to stdout)
+        self.pending = collections.deque()
+        # Events waiting to be written
+        self.pending_events = collections.deque()
+        self.events_file_path = os.path.splitext(self.log_file_path)[0] + ".events.jsonl"
+        # Opened by the writer on the first flush and kept open
+        self.log_file = None
+        self.events_file = None
+        logWriter(flush_interval).register(self)
+
+    # Print that will show up in mininet output and get added to log file
+    # msg is a format string for args, only formatted if the line is logged
+    def mnPrint(self, msg, *args, **kwargs):       
+        debug = kwargs.get('debug', True)
+        # log only certain message types
+        if self.filtered(msg, args):
+            return
+        if len(args) > 0:
+            msg = msg.format(*args)
+        msg = self.prefix + str(msg)
+
+        # Clients print right away, they may be interactive
+        echo = debug and self.echo
+        if echo and self.client:
             print(msg)
             sys.stdout.flush() # need to flush output, else never show up
+            echo = False
+
+        # Written to log file (and stdout) by the LogWriter
+        self.pending.append((time.time(), msg, echo))
 
-        # Write msg to log file        
-        with open(self.log_file_path, "a") as logFile:
-            logFile.write("{0} {1}\n".format(str(datetime.now()).replace(" ", "_"), msg))
+    def event(self, event_type, **fields):
+        '''
+        Record a structured event, serialized later by the LogWriter
+        fields: msg (message type), req (request id), hops, bytes, and anything else worth keeping
+        '''
+        if not self.events:
+            return
+        fields['ts'] = time.time()
+        fields['node'] = self.node
+        fields['event'] = event_type
+        self.pending_events.append(fields)
+
+    def filtered(self, msg, args):
+        '''True if the line is about a message type we don't log'''
+        for msg_type in FILTERED_TYPES:
+            if msg_type in args:
+                return True
+            try:
+                if msg.find(msg_type) > 0:
+                    return True
+            except AttributeError:
+                pass
+        return False
+
+    def flush(self):
+        '''Write out buffered lines, called from the LogWriter'''
+        lines = []
+        echoed = []
+        while True:
+            try:
+                timestamp, msg, echo = self.pending.popleft()
+            except IndexError:
+                break
+            lines.append("{0} {1}\n".format(str(datetime.fromtimestamp(timestamp)).replace(" ", "_"), msg))
+            if echo:
+                echoed.append(msg + "\n")
+        if len(echoed) > 0:
+            sys.stdout.write("".join(echoed))
+            sys.stdout.flush()
+        if len(lines) > 0:
+            if self.log_file is None:
+                self.log_file = open(self.log_file_path, "a")
+            self.log_file.write("".join(lines))
+            self.log_file.flush()
+
+        events = []
+        while True:
+            try:
+                events.append(json.dumps(self.pending_events.popleft()) + "\n")
+            except IndexError:
+                break
+        if len(events) > 0:
+            if self.events_file is None:
+                self.events_file = open(self.events_file_path, "a")
+            self.events_file.write("".join(events))
+            self.events_file.flush()
 
     def pretty_msg(self, msg):
         '''Only print key,value pairs where value is not None'''
-        pretty = "{"
-        for key, value in msg.items():
-            if value is not None:
-                pretty += "{0}:{1},".format(key,value)
-        pretty = pretty[:-1] + "}"
-        return pretty
+        return prettyMsg(msg)
+
+class PrettyMsg():
+    '''A message to log, only made pretty if the line is actually logged'''
+    def __init__(self, msg):
+        self.msg = msg
+
+    def __str__(self):
+        return prettyMsg(self.msg)
+
+def prettyMsg(msg):
+    '''Only print key,value pairs where value is not None'''
+    pretty = "{"
+    for key, value in msg.items():
+        if value is not None:
+            pretty += "{0}:{1},".format(key,value)
+    pretty = pretty[:-1] + "}"
+    return pretty
+
+class LogWriter():
+    '''
+    Background thread writing out the buffered lines of every MyLogger in the process,
+    so logging a line costs the caller an append instead of an open, write and close
+    flush_interval: seconds between writes
+    '''
+    def __init__(self, flush_interval):
+        self.flush_interval = flush_interval
+        self.loggers = []
+        self.lock = threading.Lock()
+        writer = threading.Thread(target=self.run)
+        writer.daemon = True
+        writer.start()
+        # Don't lose the last lines on a normal exit
+        atexit.register(self.flush)
+
+    def register(self, logger):
+        with self.lock:
+            self.loggers.append(logger)
+
+    def run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            for logger in self.loggers:
+                try:
+                    logger.flush()
+                except (IOError, OSError) as e:
+                    sys.stderr.write("Error: could not write {0}: {1}\n".format(logger.log_file_path, e))
+
+# The LogWriter of this process
+writer = None
+writer_lock = threading.Lock()
+
+def logWriter(flush_interval=FLUSH_INTERVAL):
+    '''The process' LogWriter, started on first use'''
+    global writer
+    with writer_lock:
+        if writer is None:
+            writer = LogWriter(flush_interval)
+        return writer
+
+def flushLogs():
+    '''Write out every buffered log line now, e.g. before the process is killed'''
+    if writer is not None:
+        writer.flush()
 
 # functions for main application
+def logLines(path, index):
+    '''
+    Timestamped lines of one log, in the order they were written
+    yields (timestamp, index, line), index breaks ties between logs
+    '''
+    with open(path, "rb") as logFile:
+        for line in logFile:
+            timestamp = line.split(b" ", 1)[0]
+            # skip non timestamps
+            if TIMESTAMP_RE.match(timestamp) is None:
+                continue
+            if not line.endswith(b"\n"):
+                line += b"\n"
+            yield (timestamp, index, line)
+
+def mergeLogs(logFileNames, out_path="master.log"):
+    '''
+    Merge the logs of every node into out_path by time, holding one line per log in memory
+    Timestamps sort as strings, so lines are never parsed
+    returns the number of lines merged and the first and last timestamps
+    '''
+    count = 0
+    first = None
+    last = None
+    logs = [logLines(logFileName, i) for i, logFileName in enumerate(logFileNames)]
+    with open(out_path, "wb") as f_out:
+        for timestamp, index, line in heapq.merge(*logs):
+            if first is None:
+                first = timestamp
+            last = timestamp
+            f_out.write(line)
+            count += 1
+            if count % 1000 == 0:
+                print("iter: {0}x1000".format(count // 1000))
+    return count, first, last
+
+def mapLog(path="master.log"):
+    '''Memory-map the merged log read-only, the analysis commands search it in place'''
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def parseTime(timestamp):
+    if timestamp is None:
+        return None
+    timestamp = timestamp.decode("utf-8")
+    try:
+        return datetime.strptime(timestamp, "%Y-%m-%d_%H:%M:%S.%f")
+    except ValueError:
+        return datetime.strptime(timestamp, "%Y-%m-%d_%H:%M:%S")
+
+class Metric():
+    '''
+    Accumulates one statistic from the log, fed every line whose message starts with prefix
+    (or with any of them, if prefix is a tuple)
+    '''
+    prefix = None
+
+    def add(self, timestamp, who, text):
+        '''
+        timestamp: time of the line
+        who: "ip, chord_id" of a node or "ip_c" of a client
+        text: the logged message
+        '''
+        pass
+
+class ServerIds(Metric):
+    '''Chord ids of the nodes that started'''
+    prefix = "Hi! I'm a chord node"
+
+    def __init__(self):
+        self.ids = []
+
+    def add(self, timestamp, who, text):
+        # ex: Hi! I'm a chord node, my IP is 172.1.1.3, my chord_id is 11, my name is n3
+        self.ids.append(int(text.split("chord_id is ", 1)[1].split(",", 1)[0]))
+
+class ClientIps(Metric):
+    '''Ips of the clients that started'''
+    prefix = "Hi! I'm a chord client"
+
+    def __init__(self):
+        self.ips = []
+
+    def add(self, timestamp, who, text):
+        # ex: Hi! I'm a chord client, my IP is 172.1.1.2
+        self.ips.append(text.split("my IP is ", 1)[1].strip())
+
+class StabilizeTimes(Metric):
+    '''First and last time a node's successor changed through stabilize'''
+    prefix = "Successor updated by stabilize"
+
+    def __init__(self):
+        self.first = None
+        self.last = None
+
+    def add(self, timestamp, who, text):
+        # Followed logs are read file by file, so don't rely on lines arriving in time order
+        if self.first is None or timestamp < self.first:
+            self.first = timestamp
+        if self.last is None or timestamp > self.last:
+            self.last = timestamp
+
+class ClientRequests(Metric):
+    '''
+    Requests of one kind clients finished and how many of them succeeded, with the hops their responses took
+    Requests are counted once each, however many messages, retries and replica copies they took
+    op: request type, as the client logs it
+    rcvd_type: message type of the responses
+    '''
+    prefix = ("msg type:", "Success: request ", "Error: request ")
+
+    def __init__(self, op, rcvd_type):
+        self.succeeded_prefix = "Success: request {0}:".format(op)
+        self.failed_prefix = "Error: request {0}:".format(op)
+        self.rcvd_prefix = "msg type:{0} rcvd ".format(rcvd_type)
+        self.sent = 0
+        self.rcvd = 0
+        self.hops = []
+
+    def add(self, timestamp, who, text):
+        if not who.endswith("_c"):
+            return
+        # ex: Success: request GET:['0.bin'] succeeded in 62.0 ms!
+        if text.startswith(self.succeeded_prefix):
+            self.sent += 1
+            self.rcvd += 1
+        # ex: Error: request GET:['missing.bin'] failed after 4 attempts!, a failed attempt doesn't count
+        elif text.startswith(self.failed_prefix):
+            if " failed after " in text:
+                self.sent += 1
+        elif text.startswith(self.rcvd_prefix):
+            # ex: msg type:INSERT rcvd from 172.1.1.1: msg:{client_ip:172.1.1.2,msg_type:INSERT,hops:7,...}
+            hops = text.rfind("hops:")
+            if hops >= 0:
+                digits = re.match(r"[0-9]+", text[hops + 5:])
+                if digits is not None:
+                    self.hops.append(int(digits.group(0)))
+
+class LatestEntries(Metric):
+    '''Files every node last reported being responsible for'''
+    prefix = "entries: "
+
+    def __init__(self):
+        self.key_map = dict()
+
+    def add(self, timestamp, who, text):
+        # ex: entries: {text.text:[33],newfile:[34]}
+        if who.endswith("_c"):
+            return
+        # The latest report wins
+        timestamp = parseTime(timestamp)
+        if who in self.key_map and self.key_map[who]["timestamp"] > timestamp:
+            return
+        self.key_map[who] = {"timestamp": timestamp, "entries": [text[len(self.prefix):].strip()]}
+
+class LogMetrics():
+    '''
+    Single pass over the log, each line is parsed once and handed to the registered
+    Metrics whose prefix its message starts with
+    '''
+    def __init__(self):
+        self.metrics = dict()
+        # prefix->Metrics fed lines starting with it
+        self.by_prefix = dict()
+        self.first = None
+        self.last = None
+        self.lines = 0
+
+    def register(self, name, metric):
+        self.metrics[name] = metric
+        prefixes = metric.prefix
+        if not isinstance(prefixes, tuple):
+            prefixes = (prefixes,)
+        for prefix in prefixes:
+            self.by_prefix.setdefault(prefix, []).append(metric)
+        return metric
+
+    def __getitem__(self, name):
+        return self.metrics[name]
+
+    def add(self, line):
+        '''Feed one line of the log'''
+        # ex: 2018-05-09_10:40:34.210800 <172.1.1.3, 11>: Successor updated by stabilize: ...
+        timestamp, _, rest = line.partition(b" ")
+        if TIMESTAMP_RE.match(timestamp) is None:
+            return
+        if self.first is None or timestamp < self.first:
+            self.first = timestamp
+        if self.last is None or timestamp > self.last:
+            self.last = timestamp
+        self.lines += 1
+        who, _, text = rest.partition(b">: ")
+        if not who.startswith(b"<"):
+            return
+        text = text.decode("utf-8", "replace")
+        for prefix, metrics in self.by_prefix.items():
+            if text.startswith(prefix):
+                who = who[1:].decode("utf-8")
+                for metric in metrics:
+                    metric.add(timestamp, who, text)
+                return
+
+def reportMetrics():
+    '''LogMetrics with everything report() needs'''
+    metrics = LogMetrics()
+    metrics.register("servers", ServerIds())
+    metrics.register("clients", ClientIps())
+    metrics.register("stabilize", StabilizeTimes())
+    metrics.register("inserts", ClientRequests(c_msg.INSERT_FILE, c_msg.INSERT_FILE))
+    metrics.register("gets", ClientRequests(c_msg.GET_FILE, c_msg.SEND_FILE))
+    metrics.register("entries", LatestEntries())
+    return metrics
+
+class LogTail():
+    '''Follows a growing log, returning the complete lines appended since the last read'''
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+        # Start of a line still being written
+        self.partial = b""
+
+    def read(self):
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return []
+        # Truncated or replaced, start over
+        if size < self.offset:
+            self.offset = 0
+            self.partial = b""
+        if size == self.offset:
+            return []
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            data = f.read(size - self.offset)
+        self.offset += len(data)
+        lines = (self.partial + data).split(b"\n")
+        self.partial = lines.pop()
+        return lines
+
+def follow(interval, root="nodes"):
+    '''
+    Keep the report up to date as the node logs grow, reading only what was appended,
+    and reprint it every interval seconds
+    '''
+    global metrics
+    metrics = reportMetrics()
+    tails = dict()
+    while True:
+        # Nodes may start logging at any time
+        for path in logFiles(root):
+            if path not in tails:
+                tails[path] = LogTail(path)
+        for tail in tails.values():
+            for line in tail.read():
+                metrics.add(line)
+        print("==== {0}: {1} lines from {2} logs ====".format(datetime.now(), metrics.lines, len(tails)))
+        print(report())
+        sys.stdout.flush()
+        time.sleep(interval)
+
+def logFiles(root="nodes"):
+    '''Every node and client log under root'''
+    logFileNames = []
+    for dirpath, dirs, files in os.walk(root, topdown=False):
+        for f in files:
+            if f.endswith(".log"):
+                logFileNames.append(os.path.join(dirpath, f))
+    return logFileNames
+
+def scanLog(log, metrics):
+    '''Feed every line of the mapped log to metrics'''
+    if len(log) == 0:
+        return metrics
+    for line in iter(log.readline, b""):
+        metrics.add(line)
+    return metrics
+
 def help():
     help_str = '''Chord Log Application v1.0 
     ring           print chord ring    
@@ -63,29 +496,26 @@ def help():
     '''
 
 def ring():
-    global log_str
+    global metrics
     chord_ring = ""
-    # find chord ids
-    ring_re = re.compile(r"chord_id is [0-9]+")
-    # get chord ids
-    num_re = re.compile(r'[0-9]+')
     # sort ids
-    nodes = sorted(list(map(int,num_re.findall("".join(ring_re.findall(log_str))))))
+    nodes = sorted(metrics["servers"].ids)
+    if len(nodes) == 0:
+        return "None"
     for node in nodes:
         chord_ring += "{0}->".format(node)
     chord_ring += str(nodes[0])
     return chord_ring
 
 def start():
-    global sorted_entries
-    return sorted_entries[0]["time"]
+    global metrics
+    return parseTime(metrics.first)
 
 def end():
-    global sorted_entries
-    return sorted_entries[-1]["time"]
+    global metrics
+    return parseTime(metrics.last)
     
 def report():
-    global log_str
     # report of log summaries etc
     inserts_str = inserts()
     gets_str = gets()
@@ -116,107 +546,56 @@ def report():
     return report_str
 
 def stabilize():
-    global log_str
-    # example 2018-05-09_10:40:34.210800 <172.1.1.3, 11>: Successor updated by stabilize: key: 172.1.1.4, chord id: 47
-    stabilize_re = re.compile(r"[0-9]{4}-[0-9]{2}-[0-9]{2}_[0-9]{2}:[0-9]{2}:[0-9]{2}.[0-9]{6} <[0-9]+\.[0-9]+\.[0-9]+\.[0-9]+, [0-9]+>: Successor updated by stabilize")    
-    times_stab = stabilize_re.findall(log_str)
-    time_re = re.compile(r"[0-9]{2}:[0-9]{2}:[0-9]{2}.[0-9]{6}")    
-    times = time_re.findall("".join(times_stab))    
-    start = datetime.strptime(times[0],"%H:%M:%S.%f")
-    end = datetime.strptime(times[-1],"%H:%M:%S.%f")
-    total = end - start
+    global metrics
+    stabilize_times = metrics["stabilize"]
+    if stabilize_times.first is None:
+        return "None"
+    total = parseTime(stabilize_times.last) - parseTime(stabilize_times.first)
     final = "{0} sec".format(total.total_seconds())
     return final
 
 def servers():
-    global log_str    
-    # find chord ids
-    ring_re = re.compile(r"chord_id is [0-9]+")
-    nodes = ring_re.findall(log_str)
-    return len(nodes)
+    global metrics
+    return len(metrics["servers"].ids)
 
 def clients():
-    global log_str    
-    # find clients    
-    # ex: I'm a chord client, my IP is 172.1.1.2
-    ring_re = re.compile(r"chord client, my IP is [0-9]+\.[0-9]+\.[0-9]+\.[0-9]+")
-    ip_re = re.compile(r"[0-9]+\.[0-9]+\.[0-9]+\.[0-9]+")    
-    nodes = ip_re.findall("".join(ring_re.findall(log_str)))
-    return len(nodes)
+    global metrics
+    return len(metrics["clients"].ips)
 
-def inserts():
-    global log_str, num_replicates
-    # example <172.1.1.2_c>: msg type:INSERT sent to 172.1.1.1:
-    '''2018-05-09_10:40:36.868994 <172.1.1.2_c>: msg type:INSERT rcvd from 172.1.1.1: msg:{client_ip:172.1.1.2,target:172.1.1.1,msg_type:INSERT,hops:7,filename:temp.txt,content:testingggg,suc_ip:172.1.1.1,key:5}'''
-    insert_sent_re = re.compile(r"<[0-9]+\.[0-9]+\.[0-9]+\.[0-9]+_c>: msg type:INSERT sent to 172.1.1.1")
-    insert_sent = insert_sent_re.findall(log_str)
-    num_inserts_sent = len(insert_sent)
-    insert_re = re.compile(r"<[0-9]+\.[0-9]+\.[0-9]+\.[0-9]+_c>: msg type:INSERT rcvd .*hops:[0-9]+")
-    inserts_arr = insert_re.findall(log_str)
-    num_inserts = int(len(inserts_arr)/num_replicates)
-    hops_re = re.compile(r"hops:[0-9]+")
-    hops = hops_re.findall("".join(inserts_arr))
-    num_re = re.compile(r'[0-9]+')
-    hops_nums = list(map(int,num_re.findall("".join(hops))))
-    if len(hops_nums) == 0:
+def requests(name):
+    '''
+    (sent, received, avg hops, loss rate) of the client requests counted by metrics[name]
+    '''
+    global metrics
+    counts = metrics[name]
+    num_rcvd = counts.rcvd
+    if len(counts.hops) == 0:
         avg_hops = 0
     else:
-        avg_hops = sum(hops_nums)/len(hops_nums)
+        avg_hops = sum(counts.hops)/len(counts.hops)
     loss_rate = 0
-    if num_inserts_sent != 0:
-        loss_rate = 1 - (num_inserts/num_inserts_sent)      
-    inserts_str = (num_inserts_sent,num_inserts,avg_hops,loss_rate)
-    return inserts_str
+    if counts.sent != 0:
+        loss_rate = 1 - (float(num_rcvd)/counts.sent)
+    return (counts.sent,num_rcvd,avg_hops,loss_rate)
+
+def inserts():
+    return requests("inserts")
 
 def gets():
-    global log_str
-    '''2018-05-09_10:41:42.752116 <172.1.1.2_c>: msg type:SEND_FILE rcvd from 172.1.1.1: msg:{client_ip:172.1.1.2,target:172.1.1.1,msg_type:SEND_FILE,hops:7,filename:temp.txt,content:testingggg,suc_ip:172.1.1.1,key:5}'''    
-    get_sent_re = re.compile(r"<[0-9]+\.[0-9]+\.[0-9]+\.[0-9]+_c>: msg type:SEND_FILE sent")
-    get_re = re.compile(r"<[0-9]+\.[0-9]+\.[0-9]+\.[0-9]+_c>: msg type:SEND_FILE rcvd .*hops:[0-9]+")
-    get_sent = get_sent_re.findall(log_str)
-    num_get_sent = len(get_sent)
-    gets_arr = get_re.findall(log_str)
-    num_gets = int(len(gets_arr)/num_replicates)
-    hops_re = re.compile(r"hops:[0-9]+")
-    hops = hops_re.findall("".join(gets_arr))
-    num_re = re.compile(r'[0-9]+')
-    hops_nums = list(map(int,num_re.findall("".join(hops))))
-    if len(hops_nums) == 0:
-        avg_hops = 0
-    else:
-        avg_hops = sum(hops_nums)/len(hops_nums)
-    loss_rate = 0
-    if num_get_sent != 0:
-        loss_rate = 1 - num_gets/num_get_sent    
-    gets_str = (num_get_sent,num_gets,avg_hops,loss_rate)
-    return gets_str
+    return requests("gets")
 
 def keys():
     '''
     2018-05-09_15:35:05.715598 <172.1.1.3, 11>: entries: {}
     2018-05-09_15:35:05.717302 <172.1.1.5, 35>: entries: {text.text:[33],newfile:[34]}
     '''
-    entries_re = re.compile(r"[0-9]{4}-[0-9]{2}-[0-9]{2}_[0-9]{2}:[0-9]{2}:[0-9]{2}.[0-9]{6} <[0-9]+\.[0-9]+\.[0-9]+\.[0-9]+, [0-9]+>: entries: {.*}")
-    entries = entries_re.findall(log_str)    
-    dictionary_re = re.compile(r"{.*}")
-    key_map = {}
-    if len(entries) == 0:
+    global metrics
+    key_map = metrics["entries"].key_map
+    if len(key_map) == 0:
         return "None", {}
-    for entry in entries:
-        ipid_re = re.compile(r"[0-9]+\.[0-9]+\.[0-9]+\.[0-9]+, [0-9]+")
-        time_re = re.compile(r"[0-9]{2}:[0-9]{2}:[0-9]{2}.[0-9]{6}")
-        ip = ipid_re.findall(entry)[0]
-        ts = datetime.strptime(time_re.findall(entry)[0],"%H:%M:%S.%f")
-        n_entries = dictionary_re.findall(entry)        
-        # only use most up to date info
-        if ip in key_map:
-            if key_map[ip]["timestamp"] < ts:
-                key_map[ip]["timestamp"] = ts
-                key_map[ip]["entries"] = n_entries
-        else:
-            key_map[ip] = {"timestamp":ts,"entries":n_entries}       
     return print_key_map(key_map), key_map
 
+
 def print_key_map(key_map):
     key_map_str = "\t"
     for key in key_map.keys():        
@@ -249,59 +628,21 @@ def key_summary(key_map):
 
 
 if __name__ == "__main__":       
-    # Get every file in logs folder
-    logFileNames = []
-    for root, dirs, files in os.walk("nodes", topdown=False):
-        for f in files:
-            if f.endswith(".log"):
-                logFileNames.append(os.path.join(root, f))               
-    # Get all entries from log files
-    entries = []
-    for logFileName in logFileNames:
-        logFile = open(logFileName)
-        for line in logFile:
-            timestamp = line.strip().split(" ", 1)[0]
-            # skip non timestamps
-            try:
-                timestamp = datetime.strptime(timestamp, "%Y-%m-%d_%H:%M:%S.%f")
-            except:
-                continue
-            entry = dict()
-            entry['time'] = timestamp
-            entry['log'] = line
-            entries.append(entry)
-        logFile.close()     
-    log_str = ""
-    sorted_entries = sorted(entries, key=lambda e: e['time'])
-    # Print all entries in order
-    update = 0
-    iter = 0
-    for entry in sorted_entries:
-        update += 1
-        if update == 1000:
-            iter += 1
-            print("iter: {0}x1000".format(iter))
-            update = 0
-        log_str += entry['log']        
-
-    # same compiled logs into 1  
-    try:  
-        with open("master.log", "w") as f_out:
-            f_out.write(log_str)  
-    except:
-        pass        
-    input_str = ""    
+    # follow the logs of a running experiment
+    if len(sys.argv) > 1 and sys.argv[1] == "follow":
+        interval = 5
+        if len(sys.argv) > 2:
+            interval = float(sys.argv[2])
+        try:
+            follow(interval)
+        except KeyboardInterrupt:
+            sys.exit()
 
-    try:
-        # Open config file
-        configFile = open("chordDFS.config")
-        config = json.loads(configFile.read())
-        configFile.close()
-
-        # Load parameters from config file        
-        num_replicates = config['num_replicates']
-    except IOError as e:
-        print(e)
+    # Merge the logs into 1, in time order
+    mergeLogs(logFiles())
+    # Every statistic of the report comes from one scan of the merged log
+    metrics = scanLog(mapLog(), reportMetrics())
+    input_str = ""    
 
     # just run the report
     if len(sys.argv) > 1:        
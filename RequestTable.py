@@ -0,0 +1,74 @@
+import threading
+import time
+
+# Request ids travel as unsigned 32 bit ints
+MAX_REQ_ID = 2**32
+
+class RequestTable():
+    '''
+    Requests in flight by request id, each with a deadline and a completion callback
+    timeout: default seconds before a request expires
+    clock: returns the current time in seconds
+    '''
+    def __init__(self, timeout, clock=time.time):
+        self.timeout = timeout
+        self.clock = clock
+        # request id->[callback, on_timeout, deadline]
+        self.requests = dict()
+        self.next_id = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.requests)
+
+    def __contains__(self, req_id):
+        return req_id in self.requests
+
+    def add(self, callback, on_timeout=None, timeout=None):
+        '''
+        Track a new request
+        callback: called with the arguments given to complete(), may return False to keep
+            the request in flight for further responses
+        on_timeout: called with no arguments if the request expires first
+        returns the id of the request
+        '''
+        if timeout is None:
+            timeout = self.timeout
+        with self.lock:
+            self.next_id = (self.next_id + 1) % MAX_REQ_ID
+            req_id = self.next_id
+            self.requests[req_id] = [callback, on_timeout, self.clock() + timeout]
+        return req_id
+
+    def complete(self, req_id, *args):
+        '''
+        Complete a request and call its callback with args
+        returns False if the request was unknown or had already completed or expired
+        '''
+        with self.lock:
+            request = self.requests.pop(req_id, None)
+        if request is None:
+            return False
+        if request[0](*args) is False:
+            with self.lock:
+                self.requests[req_id] = request
+        return True
+
+    def cancel(self, req_id):
+        '''Stop tracking a request without calling any of its callbacks'''
+        with self.lock:
+            return self.requests.pop(req_id, None) is not None
+
+    def expire(self):
+        '''
+        Drop every request past its deadline, calling its on_timeout
+        returns the number of expired requests
+        '''
+        now = self.clock()
+        with self.lock:
+            expired = [req_id for req_id, request in self.requests.items() if request[2] <= now]
+            expired = [self.requests.pop(req_id) for req_id in expired]
+        for request in expired:
+            if request[1] is not None:
+                request[1]()
+        return len(expired)
@@ -0,0 +1,75 @@
+import math
+import os
+import resource
+import sys
+import time
+
+from Chord import ChordServer, loadConfig
+from ChordTransport import MemoryNetwork, MemoryTransport
+
+def simIp(index):
+    '''ip of the index-th simulated node, the first one is the tracker'''
+    index += 1
+    return "10.{0}.{1}.{2}".format((index >> 16) & 255, (index >> 8) & 255, index & 255)
+
+def ringCorrect(servers):
+    '''Fraction of nodes in the network whose successor is the next node on the ring'''
+    members = sorted((s for s in servers if s.inNetwork), key=lambda s: s.me.chord_id)
+    if len(members) == 0:
+        return 0
+    correct = 0
+    for i, server in enumerate(members):
+        expected = members[(i + 1) % len(members)]
+        if server.successor is not None and server.successor.chord_id == expected.me.chord_id:
+            correct += 1
+    return correct / float(len(members))
+
+if __name__ == "__main__":
+    # Run num_nodes chord nodes in this process over a MemoryNetwork
+    if len(sys.argv) < 2:
+        print("Usage: python Simulate.py num_nodes [rounds]")
+        sys.exit()
+    num_nodes = int(sys.argv[1])
+    rounds = 100
+    if len(sys.argv) > 2:
+        rounds = int(sys.argv[2])
+
+    # Every node's logger keeps its log file open
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or hard > num_nodes + 64:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (max(soft, num_nodes + 64), hard))
+
+    config = loadConfig()
+    config["tracker_node_ip"] = simIp(0)
+    # Same sizing start.py uses, with room so ids rarely collide
+    config["finger_table_size"] = int(math.ceil(math.log(num_nodes, 2) + 3))
+
+    network = MemoryNetwork()
+    servers = []
+    start_time = time.time()
+    for i in range(num_nodes):
+        ip = simIp(i)
+        name = "s{0}".format(i + 1)
+        for path in ["files/chord", "files/client", "logs"]:
+            if not os.path.exists("nodes/{0}/{1}".format(name, path)):
+                os.makedirs("nodes/{0}/{1}".format(name, path))
+        server = ChordServer(ip, name, config, MemoryTransport(network, ip, config["control_port"]), echo=False)
+        server.start()
+        network.deliver()
+        servers.append(server)
+    print("Started {0} nodes in {1:.2f} sec".format(num_nodes, time.time() - start_time))
+    sys.stdout.flush()
+
+    stable_round = None
+    for r in range(rounds):
+        network.step(config["refresh_rate"])
+        correct = ringCorrect(servers)
+        if correct == 1 and stable_round is None:
+            stable_round = r + 1
+        if (r + 1) % 10 == 0:
+            print("round {0}: ring {1:.1f}% correct, {2} messages".format(r + 1, 100 * correct, network.delivered))
+            sys.stdout.flush()
+
+    print("Stabilized after: {0} rounds".format(stable_round))
+    print("Messages delivered: {0}".format(network.delivered))
+    print("Wall time: {0:.2f} sec".format(time.time() - start_time))
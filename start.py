@@ -25,11 +25,11 @@ from topo import ChordDFSTopo
 net = None
 
 
-def startNetwork(num_nodes):
+def startNetwork(num_nodes, keep_files=False):
     "instantiates a topo, then starts the network and prints debug information"
 
     info('** Creating ChordDFS network topology\n')
-    topo = ChordDFSTopo(num_nodes)
+    topo = ChordDFSTopo(num_nodes, keep_files)
 
     info('** Starting the network\n')
     global net
@@ -78,12 +78,14 @@ if __name__ == '__main__':
         num_nodes = int(sys.argv[1])
     else:
         num_nodes = 5
+    # Restart with the files the nodes held in the last run
+    keep_files = "--keep" in sys.argv[2:]
     # Force cleanup on exit by registering a cleanup function
     atexit.register(stopNetwork)
 
     # Tell mininet to print useful information
     setLogLevel('info')
-    startNetwork(num_nodes)
+    startNetwork(num_nodes, keep_files)
 
 	
 
@@ -0,0 +1,52 @@
+import json
+import struct
+import unittest
+
+from ChordMessage import ChordMessage, BinaryCodec, MSG_FIELDS, MSG_HEADER, MSG_TYPES, WIRE_VERSION, newMsgDict
+
+class BinaryCodecTest(unittest.TestCase):
+    def setUp(self):
+        self.codec = BinaryCodec()
+        self.msg = newMsgDict()
+        self.msg['msg_type'] = ChordMessage.SEND_FILE
+        self.msg['filename'] = "report.txt"
+        self.msg['client_ip'] = "10.0.0.20"
+        self.msg['key'] = 2**32 - 1
+        self.msg['content'] = "x" * 70000
+        self.msg['file_list'] = ["a", "b", ""]
+        self.msg['size'] = 2**40
+        self.msg['suc_list'] = ["10.0.0.1", "10.0.0.2"]
+        self.msg['replica'] = 0
+        self.msg['hops'] = 3
+
+    def testRoundTrip(self):
+        self.assertEqual(self.codec.decode(self.codec.encode(self.msg)), self.msg)
+
+    def testDecodesJson(self):
+        data = json.dumps(self.msg).encode("utf-8")
+        self.assertEqual(self.codec.decode(data), self.msg)
+
+    def testSkipsUnknownFields(self):
+        # A newer node sets a field we don't know, after every field we do
+        data = bytearray(self.codec.encode(self.msg))
+        version, type_code, mask, hops = MSG_HEADER.unpack_from(bytes(data), 0)
+        data[:MSG_HEADER.size] = MSG_HEADER.pack(version, type_code, mask | 1 << len(MSG_FIELDS), hops)
+        data += b"\x00\x05extra"
+        self.assertEqual(self.codec.decode(bytes(data)), self.msg)
+
+    def testTruncated(self):
+        data = self.codec.encode(self.msg)
+        for end in (MSG_HEADER.size + 1, MSG_HEADER.size + 6, len(data) // 2, len(data) - 5, len(data) - 1):
+            with self.assertRaises((ValueError, struct.error)):
+                self.codec.decode(data[:end])
+
+    def testUnknownTypeCode(self):
+        data = MSG_HEADER.pack(WIRE_VERSION, len(MSG_TYPES), 0, 0)
+        self.assertRaises(ValueError, self.codec.decode, data)
+
+    def testUnknownVersion(self):
+        data = MSG_HEADER.pack(WIRE_VERSION + 1, 1, 0, 0)
+        self.assertRaises(ValueError, self.codec.decode, data)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+
+from ChordRing import FingerTable, KeyIndex, keyInRange
+
+class KeyIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.index = KeyIndex()
+        self.index.add("a", [5, 60])
+        self.index.add("b", [10])
+        self.index.addFiles([("c", [0, 63]), ("d", [30])])
+
+    def testFilesIn(self):
+        self.assertEqual(self.index.filesIn(5, 30), {"b": 1, "d": 1})
+        self.assertEqual(self.index.filesIn(4, 5), {"a": 1})
+        self.assertEqual(self.index.filesIn(10, 29), {})
+
+    def testWrapsPastZero(self):
+        self.assertEqual(self.index.filesIn(59, 5), {"a": 2, "c": 2})
+
+    def testWholeRing(self):
+        # start == end covers the whole ring, like keyInRange
+        self.assertEqual(self.index.filesIn(10, 10), {"a": 2, "b": 1, "c": 2, "d": 1})
+
+    def testMatchesKeyInRange(self):
+        for start in range(0, 64, 7):
+            for end in range(0, 64, 5):
+                expected = dict()
+                for key, filename in self.index.items:
+                    if keyInRange(key, start, end, inc_end=True):
+                        expected[filename] = expected.get(filename, 0) + 1
+                self.assertEqual(self.index.filesIn(start, end), expected)
+
+    def testRemove(self):
+        self.index.remove("a", [60])
+        self.index.remove("b", [11])
+        self.assertEqual(len(self.index), 5)
+        self.assertEqual(self.index.filesIn(59, 5), {"a": 1, "c": 2})
+
+class FingerTableTest(unittest.TestCase):
+    def setUp(self):
+        # Node 10 on a ring of 64, with nodes 20, 40 and 3 after it
+        self.table = FingerTable(10, 6, 64)
+
+    def fillAll(self):
+        # Successors of the finger starts 11, 26 and 42
+        nodes = {0: (20, "n20"), 4: (40, "n40"), 5: (3, "n3")}
+        index = 0
+        while index < self.table.size:
+            index = self.table.fill(index, *nodes[index])
+
+    def testFill(self):
+        # Node 20 succeeds the starts of fingers 0-3 (11, 12, 14, 18)
+        self.assertEqual(self.table.fill(0, 20, "n20"), 4)
+        self.assertEqual(self.table.ips[:5], ["n20"] * 4 + [None])
+        self.assertFalse(self.table.monotone)
+        self.assertEqual(self.table.fill(4, 40, "n40"), 5)
+        self.assertEqual(self.table.fill(5, 3, "n3"), 6)
+        self.assertTrue(self.table.monotone)
+
+    def testClosestPreceding(self):
+        self.fillAll()
+        for monotone in (True, False):
+            self.table.monotone = monotone
+            self.assertEqual(self.table.ips[self.table.closestPreceding(30)], "n20")
+            self.assertEqual(self.table.ips[self.table.closestPreceding(41)], "n40")
+            self.assertEqual(self.table.ips[self.table.closestPreceding(5)], "n3")
+            # Nothing lies between us and our successor
+            self.assertEqual(self.table.closestPreceding(15), None)
+
+    def testSkipsDead(self):
+        self.fillAll()
+        self.assertEqual(self.table.ips[self.table.closestPreceding(5, dead=("n3",))], "n40")
+        self.assertEqual(self.table.closestPreceding(5, dead=("n3", "n40", "n20")), None)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+import zlib
+
+from Compression import ACK_OK, CODEC_ZLIB, CODEC_ZLIB_DICT, HAS_ZDICT, Compression
+
+class CompressionTest(unittest.TestCase):
+    def setUp(self):
+        self.sample = b"the quick brown fox jumps over the lazy dog " * 100
+
+    def testOnlyTowardsPeersThatAccept(self):
+        sender = Compression(level=6)
+        self.assertFalse(sender.wants("peer", len(self.sample)))
+        # An older receiver acks without the compression bits
+        self.assertTrue(sender.acked("old", bytearray([ACK_OK])))
+        self.assertFalse(sender.wants("old", len(self.sample)))
+
+        receiver = Compression()
+        self.assertTrue(sender.acked("peer", receiver.ackFor(sender.header("h1"))))
+        self.assertTrue(sender.wants("peer", len(self.sample)))
+        self.assertFalse(sender.wants("peer", 10))
+        self.assertFalse(Compression(level=0).wants("peer", len(self.sample)))
+
+    def testInvalidAck(self):
+        sender = Compression(level=6)
+        self.assertFalse(sender.acked("peer", b"\x00"))
+        self.assertFalse(sender.acked("peer", b"\x01\x01"))
+
+    def testIncompressibleSample(self):
+        sender = Compression(level=6)
+        sender.acked("peer", Compression().ackFor(sender.header("h1")))
+        self.assertEqual(sender.codecFor("peer", self.sample), CODEC_ZLIB)
+        self.assertEqual(sender.codecFor("peer", zlib.compress(self.sample)), None)
+
+    @unittest.skipUnless(HAS_ZDICT, "preset dictionaries need zlib zdict support")
+    def testDictionary(self):
+        sender = Compression(level=6, zdict=b"quick brown fox")
+        sender.acked("plain", Compression().ackFor(sender.header("h1")))
+        sender.acked("dict", Compression(zdict=b"quick brown fox").ackFor(sender.header("h2")))
+        sender.acked("other", Compression(zdict=b"other words").ackFor(sender.header("h3")))
+        self.assertEqual(sender.codecFor("plain", self.sample), CODEC_ZLIB)
+        self.assertEqual(sender.codecFor("dict", self.sample), CODEC_ZLIB_DICT)
+        self.assertEqual(sender.codecFor("other", self.sample), CODEC_ZLIB)
+
+        receiver = Compression(zdict=b"quick brown fox")
+        compressor = sender.compressor(CODEC_ZLIB_DICT)
+        data = sender.compress(compressor, self.sample) + sender.compress(compressor)
+        decompressor = receiver.decompressor(CODEC_ZLIB_DICT)
+        self.assertEqual(receiver.decompress(decompressor, data) + receiver.decompress(decompressor), self.sample)
+
+    def testUnknownCodec(self):
+        self.assertRaises(ValueError, Compression().decompressor, "lz4")
+        self.assertEqual(Compression().decompressor(None), None)
+
+if __name__ == "__main__":
+    unittest.main()
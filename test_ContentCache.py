@@ -0,0 +1,43 @@
+import unittest
+
+from ContentCache import ContentCache
+
+class ContentCacheTest(unittest.TestCase):
+    def testEvictsLeastRecentlyUsed(self):
+        cache = ContentCache(30, max_file_bytes=30)
+        cache.put("a", b"a" * 10)
+        cache.put("b", b"b" * 10)
+        cache.put("c", b"c" * 10)
+        self.assertEqual(cache.get("a"), b"a" * 10)
+        cache.put("d", b"d" * 10)
+        self.assertEqual(cache.get("b"), None)
+        self.assertEqual(sorted(cache.files), ["a", "c", "d"])
+        self.assertEqual(cache.size, 30)
+        self.assertEqual(cache.evictions, 1)
+
+    def testBoundedByBytes(self):
+        cache = ContentCache(30, max_file_bytes=30)
+        cache.put("a", b"a" * 10)
+        cache.put("b", b"b" * 10)
+        cache.put("big", b"x" * 25)
+        self.assertEqual(list(cache.files), ["big"])
+        # Replacing a file counts only its new content
+        cache.put("big", b"y" * 5)
+        self.assertEqual(cache.size, 5)
+
+    def testAdmits(self):
+        cache = ContentCache(40)
+        cache.put("big", b"x" * 11)
+        self.assertEqual(len(cache), 0)
+        self.assertFalse(ContentCache(0).admits(1))
+
+    def testInvalidate(self):
+        cache = ContentCache(40)
+        cache.put("a", b"a" * 10)
+        cache.invalidate("a")
+        cache.invalidate("missing")
+        self.assertEqual(cache.get("a"), None)
+        self.assertEqual(cache.size, 0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,35 @@
+import unittest
+
+from LocationCache import LocationCache
+
+class LocationCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 0
+        self.cache = LocationCache(10, clock=lambda: self.now)
+
+    def testExpires(self):
+        self.cache.add("a", "10.0.0.1")
+        self.now = 5
+        self.cache.add("a", "10.0.0.2")
+        self.now = 10
+        self.assertEqual(self.cache.get("a"), "10.0.0.2")
+        self.now = 15
+        self.assertEqual(self.cache.get("a"), None)
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def testInvalidate(self):
+        self.cache.add("a", "10.0.0.1")
+        self.cache.add("a", "10.0.0.2")
+        self.cache.invalidate("a", "10.0.0.1")
+        self.assertEqual(self.cache.get("a"), "10.0.0.2")
+        self.cache.invalidate("a")
+        self.assertEqual(self.cache.get("a"), None)
+
+    def testDisabled(self):
+        cache = LocationCache(0)
+        cache.add("a", "10.0.0.1")
+        self.assertEqual(cache.get("a"), None)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from MetaStore import MetaStore
+
+class MetaStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.dir_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_path)
+
+    def testTornLastLine(self):
+        store = MetaStore(self.dir_path)
+        store.add("a", [1], 10, 100)
+        store.add("b", [2], 20, 200)
+        store.log.close()
+
+        # A crash mid-write leaves half a record at the end of the log
+        with open(store.log_path, "a") as f:
+            f.write('{"op": "add", "file": "x", "ids"')
+
+        store = MetaStore(self.dir_path)
+        self.assertEqual(sorted(store.files), ["a", "b"])
+        store.add("c", [3], 30, 300)
+        store.add("d", [4], 40, 400)
+        store.log.close()
+
+        store = MetaStore(self.dir_path)
+        self.assertEqual(sorted(store.files), ["a", "b", "c", "d"])
+        self.assertEqual(store.get("c"), [[3], 30, 300])
+        store.log.close()
+
+    def testCheckpoint(self):
+        store = MetaStore(self.dir_path, checkpoint_every=3)
+        for i in range(7):
+            store.add("f{0}".format(i), [i], i, i)
+        store.remove("f0")
+        store.log.close()
+
+        store = MetaStore(self.dir_path)
+        self.assertEqual(len(store), 6)
+        self.assertFalse("f0" in store)
+        store.log.close()
+
+if __name__ == "__main__":
+    unittest.main()
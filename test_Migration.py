@@ -0,0 +1,75 @@
+import os
+import shutil
+import tempfile
+import unittest
+import zlib
+
+from Migration import MANIFEST_HEADER, batchManifest, planBatches, unpackBatch
+
+class PlanBatchesTest(unittest.TestCase):
+    def testLimits(self):
+        files = [("f{0}".format(i), 10) for i in range(7)]
+        batches = planBatches(files, max_files=3, max_bytes=100)
+        self.assertEqual([len(batch) for batch in batches], [3, 3, 1])
+        batches = planBatches(files, max_files=10, max_bytes=25)
+        self.assertEqual([len(batch) for batch in batches], [2, 2, 2, 1])
+        self.assertEqual(sum(batches, []), files)
+
+    def testOversizedFile(self):
+        files = [("a", 10), ("big", 500), ("b", 10)]
+        self.assertEqual(planBatches(files, max_bytes=100), [[("big", 500)], [("a", 10), ("b", 10)]])
+
+class UnpackBatchTest(unittest.TestCase):
+    def setUp(self):
+        self.dir_path = tempfile.mkdtemp()
+        self.src = os.path.join(self.dir_path, "src")
+        self.dst = os.path.join(self.dir_path, "dst")
+        os.mkdir(self.src)
+        os.mkdir(self.dst)
+        self.contents = {"a.txt": b"alpha" * 1000, "b.bin": os.urandom(200000), "empty": b""}
+        for filename, content in self.contents.items():
+            with open(os.path.join(self.src, filename), "wb") as f:
+                f.write(content)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_path)
+
+    def stage(self, manifest, files):
+        '''Write a batch the way the data channel stages it: the manifest, then each file's content'''
+        path = os.path.join(self.dir_path, "staged")
+        with open(path, "wb") as f:
+            f.write(manifest)
+            for file_path, size in files:
+                with open(file_path, "rb") as source:
+                    f.write(source.read(size))
+        return path
+
+    def testRoundTrip(self):
+        batch = [(filename, 0) for filename in sorted(self.contents)] + [("gone", 5)]
+        manifest, files = batchManifest(self.src, batch)
+        self.assertEqual(len(files), 3)
+        manifest = unpackBatch(self.stage(manifest, files), self.dst)
+        for filename, size, checksum in manifest:
+            content = self.contents[filename]
+            self.assertEqual(size, len(content))
+            self.assertEqual(checksum, zlib.crc32(content) & 0xffffffff)
+            with open(os.path.join(self.dst, filename), "rb") as f:
+                self.assertEqual(f.read(), content)
+
+    def testTruncated(self):
+        manifest, files = batchManifest(self.src, [("a.txt", 0), ("b.bin", 0)])
+        path = self.stage(manifest, files)
+        with open(path, "r+b") as f:
+            f.truncate(os.path.getsize(path) - 1)
+        self.assertRaises(ValueError, unpackBatch, path, self.dst)
+        self.assertEqual(os.listdir(self.dst), [])
+
+    def testBadFilenames(self):
+        for filename in ("../a.txt", "/tmp/a.txt", "sub/a.txt", "..", ""):
+            manifest = ('[["{0}", 0]]'.format(filename)).encode("utf-8")
+            path = self.stage(MANIFEST_HEADER.pack(len(manifest)) + manifest, [])
+            self.assertRaises(ValueError, unpackBatch, path, self.dst)
+        self.assertEqual(os.listdir(self.dst), [])
+
+if __name__ == "__main__":
+    unittest.main()
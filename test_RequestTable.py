@@ -0,0 +1,50 @@
+import unittest
+
+from RequestTable import RequestTable
+
+class RequestTableTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 0
+        self.table = RequestTable(5, clock=lambda: self.now)
+        self.results = []
+
+    def testComplete(self):
+        req_id = self.table.add(self.results.append)
+        self.assertTrue(self.table.complete(req_id, "done"))
+        self.assertFalse(self.table.complete(req_id, "again"))
+        self.assertEqual(self.results, ["done"])
+        self.assertEqual(len(self.table), 0)
+
+    def testKeepInFlight(self):
+        # The callback returns False until it has all the responses it waits for
+        req_id = self.table.add(lambda response: self.results.append(response) or len(self.results) == 2)
+        self.table.complete(req_id, 1)
+        self.assertTrue(req_id in self.table)
+        self.table.complete(req_id, 2)
+        self.assertFalse(req_id in self.table)
+
+    def testExpire(self):
+        expired = []
+        first = self.table.add(self.results.append, on_timeout=lambda: expired.append("first"))
+        self.table.add(self.results.append, on_timeout=lambda: expired.append("second"), timeout=10)
+        self.now = 5
+        self.assertEqual(self.table.expire(), 1)
+        self.assertEqual(expired, ["first"])
+        # A response arriving after the deadline is dropped
+        self.assertFalse(self.table.complete(first, "late"))
+        self.now = 10
+        self.assertEqual(self.table.expire(), 1)
+        self.assertEqual(expired, ["first", "second"])
+        self.assertEqual(self.results, [])
+
+    def testRetryAfterCancel(self):
+        req_id = self.table.add(self.results.append, on_timeout=lambda: self.results.append("timeout"))
+        self.assertTrue(self.table.cancel(req_id))
+        retry_id = self.table.add(self.results.append)
+        self.assertNotEqual(retry_id, req_id)
+        self.now = 5
+        self.assertEqual(self.table.expire(), 1)
+        self.assertEqual(self.results, [])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -16,13 +16,19 @@ net = None
 class ChordDFSTopo(Topo):
 	"Creates a topology of ChordDFS routers"
 
-	def __init__(self, num_nodes):
+	def __init__(self, num_nodes, keep_files=False):
 		"""Initialize a ChordDFS topology with num_nodes nodes, configure their IP
-		addresses and paths to their private directories"""
+		addresses and paths to their private directories
+		keep_files: keep the nodes' files and metadata from the last run, so they restart with them"""
 		Topo.__init__(self)
 
 		chordDFSHosts = []
 
+		# directories whose files survive a restart
+		kept_dirs = ["client"]
+		if keep_files:
+			kept_dirs += ["chord", "meta"]
+
 		# create nodes
 		for node in range(num_nodes):		
 			host = self.addHost(name='n{0}'.format(node+1), ip='172.1.1.{0}/24'.format(node+1))
@@ -39,7 +45,7 @@ class ChordDFSTopo(Topo):
 				for root, dirs, files in os.walk("nodes", topdown=False):
 					# dont delete the files dir	
 					split_path = root.split("/")			
-					if split_path[-1] != "client":
+					if split_path[-1] not in kept_dirs:
 						for f in files:
 							os.remove(os.path.join(root,f))
 		ixpfabric = self.addSwitch('sw1')